@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     Client, AuditLog, Region, Zone, Territory, Rep, Pharmacy, 
     ProductBrand, ProductCategory, Product,
-    SalesDocument, SalesLine
+    SalesDocument, SalesLine, SalesDailyRollup, ReorderSuggestion,
+    PurchaseCycleState, DemandForecast, AnomalyAlert
 )
 
 @admin.register(Client)
@@ -33,6 +34,37 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('sku', 'name')
     list_filter = ('client', 'brand', 'category')
 
+@admin.register(SalesDailyRollup)
+class SalesDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'zone', 'client', 'doc_count', 'total_amount', 'updated_at')
+    list_filter = ('client', 'zone')
+    exclude = ('pharmacy_sketch',)
+
+@admin.register(ReorderSuggestion)
+class ReorderSuggestionAdmin(admin.ModelAdmin):
+    list_display = ('pharmacy', 'rank', 'product', 'days_since_last', 'avg_cycle', 'generated_at')
+    list_filter = ('client',)
+    search_fields = ('pharmacy__display_name', 'product__name', 'product__sku')
+
+@admin.register(PurchaseCycleState)
+class PurchaseCycleStateAdmin(admin.ModelAdmin):
+    list_display = ('pharmacy', 'product', 'last_order_date', 'unique_order_days', 'gap_sum', 'updated_at')
+    list_filter = ('client',)
+    search_fields = ('pharmacy__display_name', 'product__name', 'product__sku')
+
+@admin.register(DemandForecast)
+class DemandForecastAdmin(admin.ModelAdmin):
+    list_display = ('pharmacy', 'product', 'method', 'expected_units', 'horizon_days', 'generated_at')
+    list_filter = ('client', 'method')
+    search_fields = ('pharmacy__display_name', 'product__name', 'product__sku')
+
+@admin.register(AnomalyAlert)
+class AnomalyAlertAdmin(admin.ModelAdmin):
+    list_display = ('date', 'label', 'scope', 'metric', 'value', 'expected', 'zscore', 'is_acknowledged')
+    list_filter = ('client', 'scope', 'metric', 'is_acknowledged')
+    list_editable = ('is_acknowledged',)
+    search_fields = ('label',)
+
 # Register others simply
 admin.site.register(Region)
 admin.site.register(Zone)
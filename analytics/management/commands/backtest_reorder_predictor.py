@@ -0,0 +1,120 @@
+import argparse
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from analytics.models import Client, SalesDocument
+from analytics.services import backtesting
+from analytics.services.prediction import DUE_BUFFER, ABANDONED_FACTOR
+
+
+def float_list(value):
+    return [float(v) for v in value.split(',')]
+
+
+def predictor_list(value):
+    names = [v.strip() for v in value.split(',') if v.strip()]
+    unknown = set(names) - set(backtesting.PREDICTORS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Predictores desconocidos: {', '.join(sorted(unknown))}")
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        'Backtests the reorder predictor: replays history at cutoff dates and scores the '
+        'suggestions against the actual orders of the following days (precision / recall, timings)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: first active client)')
+        parser.add_argument('--cutoffs', help='Comma separated YYYY-MM-DD (default: --count cutoffs every --step-days)')
+        parser.add_argument('--count', type=int, default=4)
+        parser.add_argument('--step-days', type=int, default=30)
+        parser.add_argument('--horizon-days', type=int, default=30, help='Days after each cutoff to look for reorders')
+        parser.add_argument('--lookback-days', type=int, default=180)
+        parser.add_argument('--min-orders', type=int, default=2)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--buffers', type=float_list, default=[DUE_BUFFER], help='e.g. 0.1,0.2,0.3')
+        parser.add_argument('--abandoned-factors', type=float_list, default=[ABANDONED_FACTOR], help='e.g. 3,4,6')
+        parser.add_argument(
+            '--predictors', type=predictor_list, default=list(backtesting.PREDICTORS),
+            help='batch (BatchReorderPredictor) and/or state (ReorderPredictor over PurchaseCycleState)',
+        )
+
+        synthetic = parser.add_argument_group('synthetic data (no DB)')
+        synthetic.add_argument('--synthetic', action='store_true')
+        synthetic.add_argument('--pharmacies', type=int, default=1000)
+        synthetic.add_argument('--products-per-pharmacy', type=int, default=50)
+        synthetic.add_argument('--days', type=int, default=365)
+        synthetic.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['synthetic']:
+            last_date = datetime.date.today()
+            history = backtesting.synthetic_history(
+                options['pharmacies'], options['products_per_pharmacy'], options['days'], last_date, options['seed'],
+            )
+            source = f"sintético ({options['pharmacies']} farmacias)"
+        else:
+            clients = Client.objects.filter(is_active=True)
+            if options['client']:
+                clients = clients.filter(code=options['client'])
+            client = clients.first()
+            if client is None:
+                raise CommandError("No hay clientes activos")
+            last = SalesDocument.objects.filter(client=client, status='COMPLETED').aggregate(last=Max('date'))['last']
+            if last is None:
+                raise CommandError(f"{client.name} no tiene ventas")
+            last_date = last.date()
+            history = None
+            source = client.name
+
+        if options['cutoffs']:
+            cutoffs = [datetime.date.fromisoformat(d) for d in options['cutoffs'].split(',')]
+        else:
+            cutoffs = backtesting.default_cutoffs(last_date, options['horizon_days'], options['count'], options['step_days'])
+
+        if history is None:
+            history = backtesting.load_history(
+                client.id,
+                min(cutoffs) - datetime.timedelta(days=options['lookback_days']),
+                max(cutoffs) + datetime.timedelta(days=options['horizon_days']),
+            )
+        load_time = time.perf_counter() - started
+        self.stdout.write(f"Fuente: {source} - {len(history)} líneas cargadas en {load_time:.2f}s")
+
+        for buffer in options['buffers']:
+            for factor in options['abandoned_factors']:
+                for predictor in options['predictors']:
+                    results = backtesting.backtest(
+                        history, cutoffs, options['horizon_days'], predictor,
+                        LOOKBACK_DAYS=options['lookback_days'], MIN_ORDERS=options['min_orders'],
+                        TOP_K=options['top_k'], DUE_BUFFER=buffer, ABANDONED_FACTOR=factor,
+                    )
+                    self.report(predictor, buffer, factor, results)
+
+    def report(self, predictor, buffer, factor, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{predictor}: buffer={buffer:g} abandono={factor:g}x"))
+        self.stdout.write(
+            f"  {'corte':<10} {'farm.':>6} {'líneas':>9} {'sugeridas':>9} {'repuestas':>9} "
+            f"{'aciertos':>8} {'prec.':>6} {'recall':>6} {'slice ms':>9} {'estado ms':>9} {'pred. ms':>9} {'eval ms':>8}"
+        )
+        for r in results:
+            t = r['timings']
+            self.stdout.write(
+                f"  {r['cutoff'].isoformat():<10} {r['pharmacies']:>6} {r['lines']:>9} {r['suggested']:>9} "
+                f"{r['reordered']:>9} {r['hits']:>8} {r['precision']:>6.2f} {r['recall']:>6.2f} "
+                f"{t['slice'] * 1000:>9.1f} {t['state'] * 1000:>9.1f} {t['predict'] * 1000:>9.1f} "
+                f"{t['evaluate'] * 1000:>8.1f}"
+            )
+
+        suggested = sum(r['suggested'] for r in results)
+        reordered = sum(r['reordered'] for r in results)
+        hits = sum(r['hits'] for r in results)
+        precision = hits / suggested if suggested else 0.0
+        recall = hits / reordered if reordered else 0.0
+        self.stdout.write(self.style.SUCCESS(f"  Total: precisión {precision:.2f}, recall {recall:.2f}"))
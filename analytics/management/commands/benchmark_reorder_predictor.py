@@ -0,0 +1,84 @@
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from analytics.services.prediction import ReorderPredictor, DUE_BUFFER, ABANDONED_FACTOR, TOP_K
+
+
+def legacy_suggestions(names, dates, today, min_orders):
+    """Original per-product loop of ReorderPredictor.get_suggestions, kept as the baseline."""
+    df = pd.DataFrame({'prod_name': names, 'date': pd.to_datetime(list(dates))})
+    order_counts = df.groupby('prod_name')['date'].nunique()
+    recurring_products = order_counts[order_counts >= min_orders].index
+    df_filtered = df[df['prod_name'].isin(recurring_products)]
+
+    suggestions = []
+    today = pd.Timestamp(today)
+    for product_name, group in df_filtered.groupby('prod_name'):
+        dates = group['date'].drop_duplicates().sort_values()
+        gaps = dates.diff().dt.days.dropna()
+        if len(gaps) == 0:
+            continue
+        avg_cycle = gaps.mean()
+        days_since_last = (today - dates.iloc[-1]).days
+        if avg_cycle * (1 + DUE_BUFFER) < days_since_last < avg_cycle * ABANDONED_FACTOR:
+            suggestions.append({
+                'product_name': product_name,
+                'days_since_last': int(days_since_last),
+                'avg_cycle': int(round(avg_cycle)),
+            })
+    suggestions.sort(key=lambda x: x['days_since_last'] / x['avg_cycle'], reverse=True)
+    return suggestions[:TOP_K]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the vectorised gap-analysis kernel against the legacy per-product loop (synthetic data, no DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skus', type=int, default=5000)
+        parser.add_argument('--orders-per-sku', type=int, default=8)
+        parser.add_argument('--lookback-days', type=int, default=180)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        today = datetime.date.today()
+        n_skus = options['skus']
+
+        # Each SKU gets its own cycle; lines are drawn around it with some jitter
+        sku_ids = np.repeat(np.arange(n_skus), options['orders_per_sku'])
+        cycles = rng.integers(7, 45, size=n_skus)[sku_ids]
+        position = np.tile(np.arange(options['orders_per_sku']), n_skus)
+        offsets = np.clip(position * cycles + rng.integers(-3, 4, size=len(sku_ids)), 0, options['lookback_days'])
+        stop = rng.integers(0, 60, size=n_skus)[sku_ids]
+        days_ago = np.clip(options['lookback_days'] - offsets + stop, 0, options['lookback_days'])
+        names = [f"SKU-{i:05d}" for i in sku_ids]
+        dates = [today - datetime.timedelta(days=int(d)) for d in days_ago]
+
+        self.stdout.write(f"{n_skus} SKUs, {len(names)} líneas")
+        predictor = ReorderPredictor(pharmacy_id=None)
+
+        timings = {}
+        for label, run in (
+            ('loop', lambda: legacy_suggestions(names, dates, today, predictor.min_orders)),
+            ('kernel', lambda: predictor.rank(names, dates, today)),
+        ):
+            best = float('inf')
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                result = run()
+                best = min(best, time.perf_counter() - started)
+            timings[label] = (best, result)
+            self.stdout.write(f"  {label:<7} {best * 1000:9.1f} ms")
+
+        legacy = [(s['product_name'], s['days_since_last']) for s in timings['loop'][1]]
+        kernel = [(s['product_id'], s['days_since_last']) for s in timings['kernel'][1]]
+        if legacy != kernel:
+            self.stdout.write(self.style.WARNING("Los resultados difieren entre implementaciones"))
+
+        speedup = timings['loop'][0] / timings['kernel'][0]
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {speedup:.1f}x"))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.market_basket import BasketIndex
+
+
+class Command(BaseCommand):
+    help = 'Builds / refreshes the product co-purchase (market basket) index of each tenant'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--full', action='store_true', help='Rebuild from scratch instead of folding new documents')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            index = None if options['full'] else BasketIndex.load(client.id)
+            if index is None:
+                index = BasketIndex()
+            added = index.refresh(client.id)
+            index.save(client.id)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{client.name}: +{added} tickets ({index.n_baskets} total, {len(index)} productos, "
+                f"{index.cooccurrence.nnz} pares) en {elapsed:.2f}s"
+            ))
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.sales_cube import SalesCube
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the pre-aggregated sales cube of each tenant (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            cube = SalesCube.build(client.id)
+            cube.save(client.id)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{client.name}: {len(cube)} celdas en {elapsed:.2f}s"
+            ))
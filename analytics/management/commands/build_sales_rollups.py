@@ -0,0 +1,25 @@
+import datetime
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.rollups import refresh_daily_rollups, rebuild_all_rollups
+
+
+class Command(BaseCommand):
+    help = 'Builds the day x zone sales rollups (totals + HyperLogLog of pharmacies)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--date-from', type=datetime.date.fromisoformat, help='YYYY-MM-DD (default: full history)')
+        parser.add_argument('--date-to', type=datetime.date.fromisoformat, help='YYYY-MM-DD (default: date-from)')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            if options['date_from']:
+                written = refresh_daily_rollups(client.id, options['date_from'], options['date_to'])
+            else:
+                written = rebuild_all_rollups(client.id)
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {written} filas de rollup"))
@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.forecasting import DemandForecaster
+
+
+class Command(BaseCommand):
+    help = 'Forecasts expected units per pharmacy x product (SES / Croston) and stores them in DemandForecast'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--horizon-days', type=int, default=30)
+        parser.add_argument('--lookback-days', type=int, default=364)
+        parser.add_argument('--alpha', type=float, default=0.2)
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes (chunks of pharmacies)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Pharmacies per chunk')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            forecaster = DemandForecaster(
+                client.id,
+                HORIZON_DAYS=options['horizon_days'],
+                LOOKBACK_DAYS=options['lookback_days'],
+                ALPHA=options['alpha'],
+            )
+            written = forecaster.save(workers=options['workers'], chunk_size=options['chunk_size'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {written} pronósticos en {elapsed:.2f}s"))
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.prediction import BatchReorderPredictor
+
+
+class Command(BaseCommand):
+    help = 'Computes the top-K reorder suggestions of every pharmacy and stores them in ReorderSuggestion'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--lookback-days', type=int, default=180)
+        parser.add_argument('--min-orders', type=int, default=2)
+        parser.add_argument('--top-k', type=int, default=5)
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            predictor = BatchReorderPredictor(
+                client.id,
+                LOOKBACK_DAYS=options['lookback_days'],
+                MIN_ORDERS=options['min_orders'],
+                TOP_K=options['top_k'],
+            )
+            written = predictor.save()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {written} sugerencias en {elapsed:.2f}s"))
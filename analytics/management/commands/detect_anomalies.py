@@ -0,0 +1,27 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.anomalies import AnomalyDetector, MIN_SAMPLES, Z_THRESHOLD
+
+
+class Command(BaseCommand):
+    help = 'Scores the days since the last pass for sales / stockout anomalies per pharmacy and zone (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help='YYYY-MM-DD (default: yesterday)')
+        parser.add_argument('--z-threshold', type=float, default=Z_THRESHOLD)
+        parser.add_argument('--min-samples', type=int, default=MIN_SAMPLES)
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            detector = AnomalyDetector(client.id, options['z_threshold'], options['min_samples'])
+            alerts = detector.run(options['until'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {len(alerts)} alertas en {elapsed:.2f}s"))
@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.prediction import BatchReorderPredictor, peak_memory_kb
+
+
+class Command(BaseCommand):
+    help = (
+        'Nightly precompute of ReorderSuggestion: pharmacies are partitioned across worker '
+        'processes and upserted per partition; reports throughput and memory peaks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--partition-size', type=int, default=500, help='Pharmacies per partition')
+        parser.add_argument('--lookback-days', type=int, default=180)
+        parser.add_argument('--min-orders', type=int, default=2)
+        parser.add_argument('--top-k', type=int, default=5)
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            predictor = BatchReorderPredictor(
+                client.id,
+                LOOKBACK_DAYS=options['lookback_days'],
+                MIN_ORDERS=options['min_orders'],
+                TOP_K=options['top_k'],
+            )
+            stats = {'pharmacies': 0, 'lines': 0, 'worker_peak_kb': 0}
+            started = time.perf_counter()
+
+            def report(pharmacies, lines, rows, worker_peak_kb):
+                stats['pharmacies'] += pharmacies
+                stats['lines'] += lines
+                stats['worker_peak_kb'] = max(stats['worker_peak_kb'], worker_peak_kb or 0)
+                rate = stats['pharmacies'] / (time.perf_counter() - started)
+                self.stdout.write(
+                    f"  +{pharmacies} farmacias ({lines} líneas, {rows} sugerencias) - {rate:.0f} farmacias/s"
+                )
+
+            written = predictor.precompute(options['workers'], options['partition_size'], on_partition=report)
+            elapsed = time.perf_counter() - started
+
+            rate = stats['pharmacies'] / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(
+                f"{client.name}: {written} sugerencias, {stats['pharmacies']} farmacias, {stats['lines']} líneas "
+                f"en {elapsed:.2f}s ({rate:.0f} farmacias/s)"
+            ))
+            self.stdout.write(
+                f"  Memoria pico: proceso {(peak_memory_kb() or 0) / 1024:.0f} MB, "
+                f"worker {stats['worker_peak_kb'] / 1024:.0f} MB"
+            )
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client, Pharmacy
+from analytics.services.pharmacy_search import create_search_index, rebuild_search_keys
+
+
+class Command(BaseCommand):
+    help = 'Recomputes pharmacy search keys and reloads the typeahead index (after bulk imports)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+
+    def handle(self, *args, **options):
+        create_search_index()
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            count = rebuild_search_keys(Pharmacy.objects.filter(client=client))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {count} farmacias indexadas en {elapsed:.2f}s"))
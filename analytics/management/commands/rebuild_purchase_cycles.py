@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.purchase_cycles import expire_purchase_cycles, rebuild_purchase_cycles
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds PurchaseCycleState from the sales of the lookback window (initial backfill or repair). '
+        'With --expired only the pairs whose first order left the window are rebuilt (run nightly).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--expired', action='store_true', help='Only rebuild pairs that aged out of the window')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            if options['expired']:
+                written = expire_purchase_cycles(client.id)
+            else:
+                written = rebuild_purchase_cycles(client.id)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {written} ciclos en {elapsed:.2f}s"))
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from analytics.services.segmentation import segment_pharmacies
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the ABC cluster and RFM score (segment_data) of the pharmacies from their sales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--full', action='store_true', help='Re-aggregate every pharmacy, not only the changed ones')
+        parser.add_argument('--window-days', type=int, default=365)
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            updated = segment_pharmacies(client.id, full=options['full'], window_days=options['window_days'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {updated} farmacias actualizadas en {elapsed:.2f}s"))
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0008_commercialagreement"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SalesDailyRollup",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("date", models.DateField()),
+                ("doc_count", models.IntegerField(default=0)),
+                (
+                    "total_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "pharmacy_sketch",
+                    models.BinaryField(
+                        help_text="HyperLogLog de farmacias compradoras"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.client",
+                    ),
+                ),
+                (
+                    "zone",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.zone",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Rollup Diario de Ventas",
+                "indexes": [
+                    models.Index(
+                        fields=["client", "date"], name="analytics_s_client__471c65_idx"
+                    )
+                ],
+                "unique_together": {("client", "date", "zone")},
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0009_salesdailyrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReorderSuggestion",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("rank", models.PositiveSmallIntegerField(default=1)),
+                ("days_since_last", models.IntegerField()),
+                ("avg_cycle", models.IntegerField()),
+                ("urgency", models.FloatField(help_text="days_since_last / avg_cycle")),
+                ("reason", models.CharField(blank=True, max_length=200)),
+                (
+                    "generated_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.client",
+                    ),
+                ),
+                (
+                    "pharmacy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reorder_suggestions",
+                        to="analytics.pharmacy",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.product",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Sugerencia de Reposición",
+                "verbose_name_plural": "Sugerencias de Reposición",
+                "ordering": ["pharmacy", "rank"],
+                "indexes": [
+                    models.Index(
+                        fields=["client", "pharmacy", "rank"],
+                        name="analytics_r_client__eecca2_idx",
+                    )
+                ],
+                "unique_together": {("pharmacy", "product")},
+            },
+        ),
+    ]
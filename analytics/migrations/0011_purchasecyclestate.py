@@ -0,0 +1,69 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0010_reordersuggestion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PurchaseCycleState",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("first_order_date", models.DateField()),
+                ("last_order_date", models.DateField()),
+                ("unique_order_days", models.IntegerField(default=1)),
+                (
+                    "gap_sum",
+                    models.IntegerField(
+                        default=0, help_text="Suma de días entre pedidos consecutivos"
+                    ),
+                ),
+                (
+                    "gap_sumsq",
+                    models.BigIntegerField(
+                        default=0, help_text="Suma de cuadrados de los gaps"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.client",
+                    ),
+                ),
+                (
+                    "pharmacy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="purchase_cycles",
+                        to="analytics.pharmacy",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.product",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Ciclo de Compra",
+                "verbose_name_plural": "Ciclos de Compra",
+                "indexes": [
+                    models.Index(
+                        fields=["pharmacy", "last_order_date"],
+                        name="analytics_p_pharmac_b77d73_idx",
+                    )
+                ],
+                "unique_together": {("pharmacy", "product")},
+            },
+        ),
+    ]
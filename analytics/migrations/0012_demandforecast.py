@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0011_purchasecyclestate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('method', models.CharField(choices=[('SES', 'Suavizado exponencial'), ('CROSTON', 'Croston (demanda intermitente)')], max_length=10)),
+                ('daily_rate', models.FloatField(help_text='Unidades/día desestacionalizadas')),
+                ('horizon_days', models.PositiveSmallIntegerField(default=30)),
+                ('expected_units', models.FloatField(help_text='Unidades esperadas en el horizonte')),
+                ('generated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='analytics.client')),
+                ('pharmacy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='demand_forecasts', to='analytics.pharmacy')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='analytics.product')),
+            ],
+            options={
+                'verbose_name': 'Pronóstico de Demanda',
+                'verbose_name_plural': 'Pronósticos de Demanda',
+                'indexes': [models.Index(fields=['client', 'pharmacy'], name='analytics_d_client__f0bd00_idx')],
+                'unique_together': {('pharmacy', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 6.0.1 on 2026-10-19 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0012_demandforecast"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnomalyAlert",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "scope",
+                    models.CharField(
+                        choices=[("PHARMACY", "Farmacia"), ("ZONE", "Zona")],
+                        max_length=10,
+                    ),
+                ),
+                ("scope_id", models.CharField(max_length=64)),
+                (
+                    "label",
+                    models.CharField(
+                        help_text="Farmacia / zona al momento de la alerta",
+                        max_length=200,
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[("SALES", "Ventas"), ("OOS_RATE", "Tasa de Quiebre")],
+                        max_length=10,
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("value", models.FloatField()),
+                ("expected", models.FloatField(help_text="Media móvil previa")),
+                ("zscore", models.FloatField()),
+                ("is_acknowledged", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.client",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Alerta de Anomalía",
+                "verbose_name_plural": "Alertas de Anomalías",
+                "ordering": ["-date", "zscore"],
+                "indexes": [
+                    models.Index(
+                        fields=["client", "is_acknowledged", "date"],
+                        name="analytics_a_client__2a52f2_idx",
+                    )
+                ],
+                "unique_together": {("client", "scope", "scope_id", "metric", "date")},
+            },
+        ),
+        migrations.CreateModel(
+            name="AnomalyState",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "scope",
+                    models.CharField(
+                        choices=[("PHARMACY", "Farmacia"), ("ZONE", "Zona")],
+                        max_length=10,
+                    ),
+                ),
+                ("scope_id", models.CharField(max_length=64)),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[("SALES", "Ventas"), ("OOS_RATE", "Tasa de Quiebre")],
+                        max_length=10,
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+                ("mean", models.FloatField(default=0)),
+                (
+                    "m2",
+                    models.FloatField(
+                        default=0, help_text="Suma de cuadrados de desvíos (Welford)"
+                    ),
+                ),
+                ("last_date", models.DateField(help_text="Último día procesado")),
+                (
+                    "is_alerting",
+                    models.BooleanField(
+                        default=False,
+                        help_text="El último día procesado estaba en alerta",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.client",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Estado de Anomalías",
+                "verbose_name_plural": "Estados de Anomalías",
+                "unique_together": {("client", "scope", "scope_id", "metric")},
+            },
+        ),
+    ]
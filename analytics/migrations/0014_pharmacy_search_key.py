@@ -0,0 +1,89 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:10
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Frozen copies of analytics.services.search_keys / pharmacy_search: the
+# migration must keep producing the same keys and index if those change.
+FTS_TABLE = "analytics_pharmacy_search"
+NON_ALNUM = re.compile(r"[^0-9A-Z]+")
+
+
+def normalize(text):
+    folded = (
+        unicodedata.normalize("NFKD", text or "")
+        .encode("ascii", "ignore")
+        .decode("ascii")
+    )
+    return NON_ALNUM.sub(" ", folded.upper()).strip()
+
+
+def pharmacy_search_key(code, display_name, name_trade, city):
+    parts = [code, display_name]
+    if normalize(name_trade) != normalize(display_name):
+        parts.append(name_trade)
+    parts.append(city)
+    return normalize(" ".join(p for p in parts if p))
+
+
+def fill_search_keys(apps, schema_editor):
+    Pharmacy = apps.get_model("analytics", "Pharmacy")
+    pharmacies = list(
+        Pharmacy.objects.only(
+            "id", "client_id", "code", "display_name", "name_trade", "city"
+        )
+    )
+    for pharmacy in pharmacies:
+        pharmacy.search_key = pharmacy_search_key(
+            pharmacy.code, pharmacy.display_name, pharmacy.name_trade, pharmacy.city
+        )
+    Pharmacy.objects.bulk_update(pharmacies, ["search_key"], batch_size=2000)
+
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                "USING fts5(search_key, pharmacy_id UNINDEXED, client_id UNINDEXED, "
+                "tokenize='trigram')"
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (search_key, pharmacy_id, client_id) "
+                "VALUES (%s, %s, %s)",
+                [(p.search_key, str(p.id), str(p.client_id)) for p in pharmacies],
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS analytics_pharmacy_search_trgm "
+                "ON analytics_pharmacy USING gin (search_key gin_trgm_ops)"
+            )
+
+
+def remove_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == "postgresql":
+            cursor.execute("DROP INDEX IF EXISTS analytics_pharmacy_search_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0013_anomalies"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pharmacy",
+            name="search_key",
+            field=models.TextField(
+                blank=True, editable=False, verbose_name="Clave de Búsqueda"
+            ),
+        ),
+        migrations.RunPython(fill_search_keys, remove_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing documents were last touched when they were imported: their date is the closest value."""
+    SalesDocument = apps.get_model("analytics", "SalesDocument")
+    SalesDocument.objects.update(updated_at=models.F("date"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0014_pharmacy_search_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="salesdocument",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="salesdocument",
+            index=models.Index(
+                fields=["client", "updated_at"], name="analytics_s_client__f1f106_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.1 on 2026-10-19 16:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0015_salesdocument_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SegmentationState",
+            fields=[
+                (
+                    "client",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="segmentation_state",
+                        serialize=False,
+                        to="analytics.client",
+                    ),
+                ),
+                (
+                    "watermark",
+                    models.DateTimeField(
+                        help_text="Inicio de la última segmentación (SalesDocument.updated_at)"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Estado de Segmentación",
+                "verbose_name_plural": "Estados de Segmentación",
+            },
+        ),
+    ]
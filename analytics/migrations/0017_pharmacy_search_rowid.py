@@ -0,0 +1,50 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:05
+
+import uuid
+
+from django.db import migrations
+
+# Frozen copy of analytics.services.pharmacy_search.search_rowid
+FTS_TABLE = "analytics_pharmacy_search"
+ROWID_MASK = (1 << 63) - 1
+
+
+def search_rowid(pharmacy_id):
+    return uuid.UUID(str(pharmacy_id)).int & ROWID_MASK
+
+
+def rekey_search_index(apps, schema_editor):
+    """Reloads the SQLite FTS rows at rowids derived from the pharmacy ids."""
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    Pharmacy = apps.get_model("analytics", "Pharmacy")
+    entries = [
+        (search_rowid(pk), search_key, str(pk), str(client_id))
+        for pk, client_id, search_key in Pharmacy.objects.values_list(
+            "id", "client_id", "search_key"
+        )
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(search_key, pharmacy_id UNINDEXED, client_id UNINDEXED, "
+            "tokenize='trigram')"
+        )
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, search_key, pharmacy_id, client_id) "
+            "VALUES (%s, %s, %s, %s)",
+            entries,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0016_segmentationstate"),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_search_index, migrations.RunPython.noop),
+    ]
@@ -5,6 +5,8 @@ from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from .services.search_keys import pharmacy_search_key
+
 # Fallback for JSONField
 try:
     from django.db.models import JSONField
@@ -144,9 +146,14 @@ class Pharmacy(models.Model):
     # Classification (JSON for flexibility, or could use Normalized Tables)
     segment_data = JSONField(default=dict, blank=True, help_text="Tags, Cluster, Segmento")
 
+    # Typeahead: normalised code + names + city, indexed by analytics.services.pharmacy_search
+    search_key = models.TextField(_("Clave de Búsqueda"), blank=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    SEARCH_KEY_FIELDS = ('code', 'display_name', 'name_trade', 'city')
+
     class Meta:
         verbose_name = _("Farmacia (PDV)")
         verbose_name_plural = _("Farmacias")
@@ -159,6 +166,13 @@ class Pharmacy(models.Model):
     def __str__(self):
         return f"{self.code} - {self.display_name}"
 
+    def save(self, *args, **kwargs):
+        self.search_key = pharmacy_search_key(self.code, self.display_name, self.name_trade, self.city)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.SEARCH_KEY_FIELDS):
+            kwargs['update_fields'] = set(update_fields) | {'search_key'}
+        super().save(*args, **kwargs)
+
 class ProductBrand(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
@@ -225,7 +239,15 @@ class SalesDocument(models.Model):
     status = models.CharField(max_length=50, default='COMPLETED') 
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     currency = models.CharField(max_length=10, default='USD')
-    
+    # Watermark of the incremental analytics (basket index, segmentation): catches
+    # documents completed after they were first imported
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'updated_at']),
+        ]
+
     def __str__(self):
         return self.external_id
 
@@ -275,3 +297,230 @@ class CommercialAgreement(models.Model):
 
     def __str__(self):
         return f"Acuerdo {self.pharmacy.display_name} ({self.start_date})"
+
+# ==========================================
+# 7. ROLLUPS (Pre-aggregated analytics)
+# ==========================================
+
+class SalesDailyRollup(models.Model):
+    """
+    Daily sales aggregates per zone, maintained by analytics.services.rollups.
+    `pharmacy_sketch` is a HyperLogLog of the buying pharmacies: sketches merge
+    across days and zones, so reach KPIs never need a DISTINCT over raw documents.
+    """
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    date = models.DateField()
+    zone = models.ForeignKey(Zone, on_delete=models.CASCADE, null=True, blank=True)
+
+    doc_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pharmacy_sketch = models.BinaryField(help_text="HyperLogLog de farmacias compradoras")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Rollup Diario de Ventas")
+        unique_together = ('client', 'date', 'zone')
+        indexes = [
+            models.Index(fields=['client', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.zone or 'Sin Zona'}"
+
+# ==========================================
+# 8. PREDICTIONS
+# ==========================================
+
+class ReorderSuggestion(models.Model):
+    """
+    Pre-computed reorder suggestion (top-K per pharmacy), written in batch by
+    analytics.services.prediction.BatchReorderPredictor.
+    """
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='reorder_suggestions')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    rank = models.PositiveSmallIntegerField(default=1)
+    days_since_last = models.IntegerField()
+    avg_cycle = models.IntegerField()
+    urgency = models.FloatField(help_text="days_since_last / avg_cycle")
+    reason = models.CharField(max_length=200, blank=True)
+
+    generated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _("Sugerencia de Reposición")
+        verbose_name_plural = _("Sugerencias de Reposición")
+        unique_together = ('pharmacy', 'product')
+        ordering = ['pharmacy', 'rank']
+        indexes = [
+            models.Index(fields=['client', 'pharmacy', 'rank']),
+        ]
+
+    def __str__(self):
+        return f"{self.pharmacy} -> {self.product} (#{self.rank})"
+
+class PurchaseCycleState(models.Model):
+    """
+    Running purchase-cycle statistics per (pharmacy, product), kept up to date
+    incrementally as sales arrive (analytics.services.purchase_cycles).
+    Mean cycle = gap_sum / (unique_order_days - 1); variance from gap_sumsq.
+    """
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='purchase_cycles')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    first_order_date = models.DateField()
+    last_order_date = models.DateField()
+    unique_order_days = models.IntegerField(default=1)
+    gap_sum = models.IntegerField(default=0, help_text="Suma de días entre pedidos consecutivos")
+    gap_sumsq = models.BigIntegerField(default=0, help_text="Suma de cuadrados de los gaps")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Ciclo de Compra")
+        verbose_name_plural = _("Ciclos de Compra")
+        unique_together = ('pharmacy', 'product')
+        indexes = [
+            models.Index(fields=['pharmacy', 'last_order_date']),
+        ]
+
+    @property
+    def avg_cycle(self):
+        if self.unique_order_days < 2:
+            return None
+        return self.gap_sum / (self.unique_order_days - 1)
+
+    def __str__(self):
+        return f"{self.pharmacy} / {self.product}"
+
+class SegmentationState(models.Model):
+    """
+    Watermark of the incremental pharmacy segmentation of a tenant
+    (analytics.services.segmentation): the segments themselves live in
+    Pharmacy.segment_data.
+    """
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, primary_key=True, related_name='segmentation_state')
+    watermark = models.DateTimeField(help_text="Inicio de la última segmentación (SalesDocument.updated_at)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Estado de Segmentación")
+        verbose_name_plural = _("Estados de Segmentación")
+
+    def __str__(self):
+        return f"{self.client} @ {self.watermark:%Y-%m-%d %H:%M}"
+
+class DemandForecast(models.Model):
+    """
+    Expected units per (pharmacy, product) over the next `horizon_days`,
+    written in batch by analytics.services.forecasting.DemandForecaster.
+    """
+    METHOD_CHOICES = (
+        ('SES', 'Suavizado exponencial'),
+        ('CROSTON', 'Croston (demanda intermitente)'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='demand_forecasts')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    method = models.CharField(max_length=10, choices=METHOD_CHOICES)
+    daily_rate = models.FloatField(help_text="Unidades/día desestacionalizadas")
+    horizon_days = models.PositiveSmallIntegerField(default=30)
+    expected_units = models.FloatField(help_text="Unidades esperadas en el horizonte")
+
+    generated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _("Pronóstico de Demanda")
+        verbose_name_plural = _("Pronósticos de Demanda")
+        unique_together = ('pharmacy', 'product')
+        indexes = [
+            models.Index(fields=['client', 'pharmacy']),
+        ]
+
+    def __str__(self):
+        return f"{self.pharmacy} / {self.product}: {self.expected_units:.1f} u."
+
+# ==========================================
+# 9. ANOMALIES
+# ==========================================
+
+ANOMALY_SCOPES = (
+    ('PHARMACY', 'Farmacia'),
+    ('ZONE', 'Zona'),
+)
+
+ANOMALY_METRICS = (
+    ('SALES', 'Ventas'),
+    ('OOS_RATE', 'Tasa de Quiebre'),
+)
+
+class AnomalyState(models.Model):
+    """
+    Running mean / variance (Welford) of one daily metric of a pharmacy or zone,
+    updated by analytics.services.anomalies with each new day only.
+    """
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    scope = models.CharField(max_length=10, choices=ANOMALY_SCOPES)
+    scope_id = models.CharField(max_length=64)
+    metric = models.CharField(max_length=10, choices=ANOMALY_METRICS)
+
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0, help_text="Suma de cuadrados de desvíos (Welford)")
+    last_date = models.DateField(help_text="Último día procesado")
+    is_alerting = models.BooleanField(default=False, help_text="El último día procesado estaba en alerta")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Estado de Anomalías")
+        verbose_name_plural = _("Estados de Anomalías")
+        unique_together = ('client', 'scope', 'scope_id', 'metric')
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+    def __str__(self):
+        return f"{self.scope}:{self.scope_id} {self.metric} (n={self.count})"
+
+class AnomalyAlert(models.Model):
+    """Day on which a pharmacy / zone metric deviated from its running baseline."""
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    scope = models.CharField(max_length=10, choices=ANOMALY_SCOPES)
+    scope_id = models.CharField(max_length=64)
+    label = models.CharField(max_length=200, help_text="Farmacia / zona al momento de la alerta")
+    metric = models.CharField(max_length=10, choices=ANOMALY_METRICS)
+
+    date = models.DateField()
+    value = models.FloatField()
+    expected = models.FloatField(help_text="Media móvil previa")
+    zscore = models.FloatField()
+
+    is_acknowledged = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Alerta de Anomalía")
+        verbose_name_plural = _("Alertas de Anomalías")
+        unique_together = ('client', 'scope', 'scope_id', 'metric', 'date')
+        ordering = ['-date', 'zscore']
+        indexes = [
+            models.Index(fields=['client', 'is_acknowledged', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.label}: {self.get_metric_display()} z={self.zscore:.1f}"
@@ -0,0 +1,221 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from analytics.models import (
+    AnomalyAlert, AnomalyState, Pharmacy, SalesDailyRollup, SalesDocument, Zone,
+)
+from analytics.services.dashboard_cache import bump_data_version
+from surveys.models import StockoutObservation
+
+# A metric needs this many days of baseline before it can raise alerts
+MIN_SAMPLES = 14
+# |z| at or beyond which a day is flagged
+Z_THRESHOLD = 3.0
+# Pharmacies order every few days, so their sales are tracked as a trailing 7-day sum
+PHARMACY_SALES_WINDOW = 7
+# Sales alert on drops, stockout rates on spikes
+DIRECTIONS = {'SALES': -1, 'OOS_RATE': 1}
+
+
+def welford(count, mean, m2, values):
+    """
+    One vectorised Welford step: folds `values` (NaN = no sample) into the
+    running count / mean / M2 arrays. Returns the updated arrays.
+    """
+    sample = ~np.isnan(values)
+    count = count + sample
+    delta = np.where(sample, values - mean, 0.0)
+    mean = mean + np.where(sample, delta / np.maximum(count, 1), 0.0)
+    m2 = m2 + np.where(sample, delta * (np.nan_to_num(values) - mean), 0.0)
+    return count, mean, m2
+
+
+class AnomalyDetector:
+    """
+    Streaming detector over daily metrics of pharmacies and zones:
+    - SALES of each zone (from the daily rollups) and of each pharmacy (trailing 7 days)
+    - OOS_RATE of each pharmacy and zone (share of StockoutObservation flagged OOS)
+    Each pass reads only the days after the last processed one, scores them
+    against the running mean / std kept in AnomalyState and then folds them in.
+    """
+
+    def __init__(self, client_id, z_threshold=Z_THRESHOLD, min_samples=MIN_SAMPLES):
+        self.client_id = client_id
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+
+    # ------------------------------------------------------------------
+    # Daily series (entities x days, NaN where there is no sample)
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _matrix(df, key, value, days, fill=None):
+        if df.empty:
+            return pd.DataFrame(index=pd.Index([], dtype=object), columns=days, dtype=float)
+        matrix = df.pivot_table(index=key, columns='day', values=value, aggfunc='sum')
+        matrix.index = matrix.index.astype(str)
+        matrix = matrix.reindex(columns=days)
+        return matrix.fillna(fill) if fill is not None else matrix
+
+    def zone_sales(self, days):
+        rows = SalesDailyRollup.objects.filter(
+            client_id=self.client_id, date__gte=days[0], date__lte=days[-1], zone__isnull=False,
+        ).values_list('zone_id', 'date', 'total_amount')
+        df = pd.DataFrame.from_records(rows, columns=['zone_id', 'day', 'amount'])
+        df['amount'] = df['amount'].astype(float)
+        return self._matrix(df, 'zone_id', 'amount', days, fill=0.0)
+
+    def pharmacy_sales(self, days):
+        window_start = days[0] - timedelta(days=PHARMACY_SALES_WINDOW - 1)
+        rows = (
+            SalesDocument.objects
+            .filter(client_id=self.client_id, status='COMPLETED', date__date__gte=window_start, date__date__lte=days[-1])
+            .annotate(day=TruncDate('date'))
+            .values_list('pharmacy_id', 'day')
+            .annotate(amount=Sum('total_amount'))
+            .order_by()
+        )
+        df = pd.DataFrame.from_records(rows, columns=['pharmacy_id', 'day', 'amount'])
+        df['amount'] = df['amount'].astype(float)
+        all_days = [window_start + timedelta(days=i) for i in range((days[-1] - window_start).days + 1)]
+        daily = self._matrix(df, 'pharmacy_id', 'amount', all_days, fill=0.0)
+        trailing = daily.T.rolling(PHARMACY_SALES_WINDOW, min_periods=1).sum().T
+        return trailing[days]
+
+    def oos_rates(self, days):
+        rows = (
+            StockoutObservation.objects
+            .filter(
+                visit__client_id=self.client_id,
+                visit__completed_at__date__gte=days[0],
+                visit__completed_at__date__lte=days[-1],
+            )
+            .annotate(day=TruncDate('visit__completed_at'))
+            .values_list('visit__pharmacy_id', 'visit__pharmacy__territory__zone_id', 'day')
+            .annotate(total=Count('id'), oos=Count('id', filter=Q(is_oos=True)))
+            .order_by()
+        )
+        df = pd.DataFrame.from_records(rows, columns=['pharmacy_id', 'zone_id', 'day', 'total', 'oos'])
+        by_pharmacy = self._matrix(df, 'pharmacy_id', 'oos', days) / self._matrix(df, 'pharmacy_id', 'total', days)
+        zoned = df.dropna(subset=['zone_id'])
+        by_zone = self._matrix(zoned, 'zone_id', 'oos', days) / self._matrix(zoned, 'zone_id', 'total', days)
+        return by_pharmacy, by_zone
+
+    # ------------------------------------------------------------------
+    # Pass
+    # ------------------------------------------------------------------
+
+    def pending_days(self, until):
+        """Days after the last processed one (first pass: from the first day with data)."""
+        last = AnomalyState.objects.filter(client_id=self.client_id).aggregate(last=Max('last_date'))['last']
+        if last:
+            start = last + timedelta(days=1)
+        else:
+            first = SalesDocument.objects.filter(client_id=self.client_id).aggregate(first=Min('date'))['first']
+            if first is None:
+                return []
+            start = timezone.localtime(first).date()
+        return [start + timedelta(days=i) for i in range((until - start).days + 1)]
+
+    def run(self, until=None):
+        """Processes every complete day up to `until` (default: yesterday). Returns the alerts raised."""
+        until = until or timezone.localdate() - timedelta(days=1)
+        days = self.pending_days(until)
+        if not days:
+            return []
+
+        oos_pharmacy, oos_zone = self.oos_rates(days)
+        series = {
+            ('ZONE', 'SALES'): self.zone_sales(days),
+            ('PHARMACY', 'SALES'): self.pharmacy_sales(days),
+            ('PHARMACY', 'OOS_RATE'): oos_pharmacy,
+            ('ZONE', 'OOS_RATE'): oos_zone,
+        }
+
+        existing = {
+            (s.scope, s.metric, s.scope_id): s
+            for s in AnomalyState.objects.filter(client_id=self.client_id)
+        }
+        states, alerts = [], []
+        for (scope, metric), matrix in series.items():
+            known = [key[2] for key in existing if key[:2] == (scope, metric)]
+            matrix = matrix.reindex(matrix.index.union(pd.Index(known, dtype=object)))
+            if metric == 'SALES':
+                matrix = matrix.fillna(0.0)  # no sales that day is a real zero
+            entity_ids = list(matrix.index)
+
+            previous = [existing.get((scope, metric, e)) for e in entity_ids]
+            count = np.array([s.count if s else 0 for s in previous], dtype=float)
+            mean = np.array([s.mean if s else 0.0 for s in previous])
+            m2 = np.array([s.m2 if s else 0.0 for s in previous])
+
+            # One alert per episode: consecutive flagged days only alert on the first
+            ongoing = np.array([bool(s and s.is_alerting) for s in previous], dtype=bool)
+
+            values = matrix.to_numpy(dtype=float)
+            for d, day in enumerate(days):
+                x = values[:, d]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    std = np.sqrt(m2 / (count - 1))
+                    z = (x - mean) / std
+                flagged = (
+                    ~np.isnan(x) & (count >= self.min_samples) & (std > 0)
+                    & (DIRECTIONS[metric] * z >= self.z_threshold)
+                )
+                for i in np.flatnonzero(flagged & ~ongoing):
+                    alerts.append(AnomalyAlert(
+                        client_id=self.client_id, scope=scope, scope_id=entity_ids[i], metric=metric,
+                        date=day, value=float(x[i]), expected=float(mean[i]), zscore=float(z[i]),
+                    ))
+                ongoing = np.where(np.isnan(x), ongoing, flagged)
+                count, mean, m2 = welford(count, mean, m2, x)
+
+            states.extend(
+                AnomalyState(
+                    client_id=self.client_id, scope=scope, scope_id=entity_id, metric=metric,
+                    count=int(count[i]), mean=float(mean[i]), m2=float(m2[i]), last_date=days[-1],
+                    is_alerting=bool(ongoing[i]),
+                )
+                for i, entity_id in enumerate(entity_ids)
+            )
+
+        self._label(alerts)
+        with transaction.atomic():
+            AnomalyState.objects.bulk_create(
+                states,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['client', 'scope', 'scope_id', 'metric'],
+                update_fields=['count', 'mean', 'm2', 'last_date', 'is_alerting', 'updated_at'],
+            )
+            AnomalyAlert.objects.bulk_create(alerts, batch_size=1000, ignore_conflicts=True)
+        if alerts:
+            bump_data_version(self.client_id)
+        return alerts
+
+    @staticmethod
+    def _label(alerts):
+        pharmacy_ids = {a.scope_id for a in alerts if a.scope == 'PHARMACY'}
+        zone_ids = {a.scope_id for a in alerts if a.scope == 'ZONE'}
+        names = {
+            'PHARMACY': {str(pk): name for pk, name in Pharmacy.objects.filter(id__in=pharmacy_ids).values_list('id', 'display_name')},
+            'ZONE': {str(pk): name for pk, name in Zone.objects.filter(id__in=zone_ids).values_list('id', 'name')},
+        }
+        for alert in alerts:
+            alert.label = names[alert.scope].get(alert.scope_id, alert.scope_id)
+
+
+def recent_alerts(client_id, days=14, limit=10):
+    """Open alerts of the last `days` days, most recent first (for the dashboards)."""
+    since = timezone.localdate() - timedelta(days=days)
+    return list(
+        AnomalyAlert.objects.filter(client_id=client_id, is_acknowledged=False, date__gte=since)
+        .order_by('-date', '-created_at')
+        .values('date', 'scope', 'label', 'metric', 'value', 'expected', 'zscore')[:limit]
+    )
@@ -0,0 +1,172 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from analytics.models import SalesLine
+from analytics.services.prediction import BatchReorderPredictor, ReorderPredictor
+from analytics.services.purchase_cycles import LOOKBACK_DAYS as STATE_LOOKBACK_DAYS, STATE_COLUMNS, cycle_states
+
+COLUMNS = BatchReorderPredictor.COLUMNS
+
+# 'batch': nightly BatchReorderPredictor.compute over the whole tenant
+# 'state': live ReorderPredictor, one pharmacy at a time from its PurchaseCycleState rows
+PREDICTORS = ('batch', 'state')
+
+
+def load_history(client_id, date_from, date_to):
+    """(pharmacy_id, product_id, date) of the tenant's completed lines in [date_from, date_to], streamed."""
+    rows = SalesLine.objects.filter(
+        document__client_id=client_id,
+        document__date__date__gte=date_from,
+        document__date__date__lte=date_to,
+        document__status='COMPLETED',
+    ).values_list('document__pharmacy_id', 'product_id', 'document__date__date').order_by()
+    df = pd.DataFrame.from_records(rows.iterator(chunk_size=10000), columns=COLUMNS)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def synthetic_history(pharmacies, products_per_pharmacy, days, end, seed=42, catalog=2000):
+    """
+    Synthetic order history: every (pharmacy, product) pair has its own cycle
+    (7-45 days) with +-3 days of jitter, and 20% of pairs stop buying at a random point.
+    """
+    rng = np.random.default_rng(seed)
+    n_pairs = pharmacies * products_per_pharmacy
+    pharmacy_ids = np.repeat(np.arange(pharmacies), products_per_pharmacy)
+    product_ids = rng.integers(0, catalog, size=n_pairs)
+
+    cycles = rng.integers(7, 46, size=n_pairs)
+    phase = rng.integers(0, 45, size=n_pairs)
+    stop = np.where(rng.random(n_pairs) < 0.2, rng.integers(0, days, size=n_pairs), days)
+
+    n_orders = days // cycles + 1
+    pair = np.repeat(np.arange(n_pairs), n_orders)
+    position = np.arange(len(pair)) - np.repeat(np.cumsum(n_orders) - n_orders, n_orders)
+    day = phase[pair] + position * cycles[pair] + rng.integers(-3, 4, size=len(pair))
+    keep = (day >= 0) & (day < stop[pair])
+    pair, day = pair[keep], day[keep]
+
+    dates = pd.Timestamp(end) - pd.to_timedelta(days - 1 - day, unit='D')
+    df = pd.DataFrame({'pharmacy_id': pharmacy_ids[pair], 'product_id': product_ids[pair], 'date': dates})
+    return df.drop_duplicates(ignore_index=True)
+
+
+class ReplayReorderPredictor(ReorderPredictor):
+    """
+    The state-backed ReorderPredictor with its two reads (PurchaseCycleState rows
+    and the raw lookback history) served from replayed frames instead of the DB.
+    """
+
+    def __init__(self, pharmacy_id, states, lines, **options):
+        super().__init__(pharmacy_id, **options)
+        self.replayed_states = states
+        self.replayed_lines = lines
+
+    def states(self, today):
+        states = self.replayed_states
+        start = today - timedelta(days=self.lookback_days)
+        states = states[(states['last_order_date'] >= start) & (states['last_order_date'] <= today)]
+        return states[STATE_COLUMNS[1:6]].itertuples(index=False, name=None)
+
+    def history(self, today, product_ids=None):
+        lines = self.replayed_lines
+        if product_ids is not None:
+            lines = lines[lines['product_id'].isin(product_ids)]
+        return zip(lines['product_id'], lines['date'])
+
+
+def replay_states(history, cutoff):
+    """
+    PurchaseCycleState rows as rebuild_purchase_cycles would have left them on
+    `cutoff`, as {pharmacy id: frame}.
+    """
+    cutoff_ts = pd.Timestamp(cutoff)
+    window = history[(history['date'] >= cutoff_ts - pd.Timedelta(days=STATE_LOOKBACK_DAYS)) & (history['date'] <= cutoff_ts)]
+    return dict(tuple(cycle_states(window).groupby('pharmacy_id', sort=False)))
+
+
+def state_suggestions(states, past, cutoff, **predictor_options):
+    """Due (pharmacy_id, product_id) pairs of the state-backed predictor, run pharmacy by pharmacy."""
+    lines = dict(tuple(past.groupby('pharmacy_id', sort=False)))
+    no_states, no_lines = pd.DataFrame(columns=STATE_COLUMNS), pd.DataFrame(columns=COLUMNS)
+    today = pd.Timestamp(cutoff).date()
+    rows = []
+    for pharmacy_id in states.keys() | lines.keys():
+        predictor = ReplayReorderPredictor(
+            pharmacy_id, states.get(pharmacy_id, no_states), lines.get(pharmacy_id, no_lines), **predictor_options,
+        )
+        rows.extend((pharmacy_id, s['product_id']) for s in predictor.due_products(today))
+    return pd.DataFrame(rows, columns=COLUMNS[:2])
+
+
+def _pairs(df):
+    return set(zip(df['pharmacy_id'], df['product_id']))
+
+
+def backtest(history, cutoffs, horizon_days=30, predictor='batch', **predictor_options):
+    """
+    Replays `history` at each cutoff: suggestions are generated from the data
+    up to the cutoff and scored against the pairs actually ordered in the next
+    `horizon_days`. Recall only counts reorders of pairs with enough history
+    to be predictable (>= MIN_ORDERS order days in the lookback window).
+    `predictor` is one of PREDICTORS; for 'state' the PurchaseCycleState rows
+    of each cutoff are rebuilt in memory (timed as the 'state' stage).
+    Returns one dict per cutoff with the metrics and per-stage timings (seconds).
+    """
+    if predictor not in PREDICTORS:
+        raise ValueError(f"Predictor desconocido: {predictor}")
+
+    results = []
+    for cutoff in cutoffs:
+        cutoff_ts = pd.Timestamp(cutoff)
+        batch = BatchReorderPredictor(None, as_of=cutoff, **predictor_options)
+        timings = {'state': 0.0}
+
+        started = time.perf_counter()
+        window_start = cutoff_ts - pd.Timedelta(days=batch.lookback_days)
+        past = history[(history['date'] >= window_start) & (history['date'] <= cutoff_ts)]
+        future = history[(history['date'] > cutoff_ts) & (history['date'] <= cutoff_ts + pd.Timedelta(days=horizon_days))]
+        timings['slice'] = time.perf_counter() - started
+
+        if predictor == 'state':
+            started = time.perf_counter()
+            states = replay_states(history, cutoff)
+            timings['state'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            suggestions = state_suggestions(states, past, cutoff, **predictor_options)
+            timings['predict'] = time.perf_counter() - started
+        else:
+            started = time.perf_counter()
+            suggestions = batch.compute(past)
+            timings['predict'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        suggested = _pairs(suggestions)
+        order_days = past.groupby(['pharmacy_id', 'product_id'])['date'].nunique()
+        eligible = set(order_days[order_days >= max(batch.min_orders, 2)].index)
+        reordered = _pairs(future) & eligible
+        hits = len(suggested & reordered)
+        timings['evaluate'] = time.perf_counter() - started
+
+        results.append({
+            'cutoff': cutoff,
+            'pharmacies': past['pharmacy_id'].nunique(),
+            'lines': len(past),
+            'suggested': len(suggested),
+            'reordered': len(reordered),
+            'hits': hits,
+            'precision': hits / len(suggested) if suggested else 0.0,
+            'recall': hits / len(reordered) if reordered else 0.0,
+            'timings': timings,
+        })
+    return results
+
+
+def default_cutoffs(last_date, horizon_days, count, step_days):
+    """`count` cutoffs every `step_days`, the latest leaving a full horizon before last_date."""
+    latest = last_date - timedelta(days=horizon_days)
+    return [latest - timedelta(days=step_days * i) for i in reversed(range(count))]
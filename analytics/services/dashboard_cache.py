@@ -0,0 +1,117 @@
+import hashlib
+import json
+import pickle
+import time
+import zlib
+
+from django.core.cache import caches
+
+from analytics.services import generations
+
+CACHE_ALIAS = 'dashboard'
+# Data versions, stampede locks and freshly computed aggregates live in the cache
+# shared by every worker; CACHE_ALIAS is the per-process copy in front of it
+SHARED_CACHE_ALIAS = 'shared'
+KEY_PREFIX = 'dash'
+
+# Filters that change the result of a dashboard aggregate (multi-valued ones are lists)
+FILTER_PARAMS = ('pharmacy', 'zone', 'date_start', 'date_end')
+
+# Stampede protection: the first miss takes the lock, the rest wait for its result
+LOCK_TIMEOUT = 30  # seconds; upper bound for one recomputation
+LOCK_WAIT = 10  # seconds a waiting request polls before computing on its own
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_shared_cache():
+    return caches[SHARED_CACHE_ALIAS]
+
+
+def normalise_filters(params):
+    """
+    Turns request.GET into a canonical, hashable representation:
+    empty values dropped, multi-valued filters de-duplicated and sorted.
+    """
+    normalised = {}
+    for name in FILTER_PARAMS:
+        values = sorted({v.strip() for v in params.getlist(name) if v and v.strip()})
+        if values:
+            normalised[name] = values
+    return normalised
+
+
+def _version_key(client_id):
+    return f"{KEY_PREFIX}:version:{client_id}"
+
+
+def get_data_version(client_id):
+    """Current data version for a tenant, shared by every worker."""
+    return generations.get_generation(get_shared_cache(), _version_key(client_id))
+
+
+def bump_data_version(client_id):
+    """Invalidates every cached aggregate of the tenant by moving its version forward."""
+    generations.bump_generation(get_shared_cache(), _version_key(client_id))
+
+
+def make_key(name, client_id, filters):
+    filters_hash = hashlib.sha1(
+        json.dumps(filters, sort_keys=True, separators=(',', ':')).encode()
+    ).hexdigest()
+    return f"{KEY_PREFIX}:{name}:{client_id}:{get_data_version(client_id)}:{filters_hash}"
+
+
+def _pack(value):
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _unpack(payload):
+    return pickle.loads(zlib.decompress(payload))
+
+
+def get_or_compute(name, client_id, filters, compute):
+    """
+    Returns the aggregate `name` for (client, filters, data version), computing it
+    with `compute()` on a miss. The result must be plain picklable data
+    (evaluate querysets with list() before returning them).
+    """
+    cache, shared = get_cache(), get_shared_cache()
+    key = make_key(name, client_id, filters)
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = shared.get(key)
+        if payload is not None:
+            cache.set(key, payload)
+    if payload is not None:
+        return _unpack(payload)
+
+    lock_key = f"{key}:lock"
+    if not shared.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        # Another worker is computing this aggregate: wait for it instead of piling on
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            payload = shared.get(key)
+            if payload is not None:
+                cache.set(key, payload)
+                return _unpack(payload)
+        value = compute()
+        _store(cache, shared, key, _pack(value))
+        return value
+
+    try:
+        value = compute()
+        _store(cache, shared, key, _pack(value))
+    finally:
+        shared.delete(lock_key)
+    return value
+
+
+def _store(cache, shared, key, payload):
+    cache.set(key, payload)
+    shared.set(key, payload, cache.default_timeout)
@@ -0,0 +1,209 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+import numpy as np
+import pandas as pd
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from analytics.models import SalesLine, DemandForecast
+from analytics.services.prediction import to_epoch_days
+
+# Demand is bucketed in weekly periods before smoothing
+PERIOD_DAYS = 7
+# Average inter-demand interval (in periods) above which a series is intermittent
+# (Syntetos-Boylan cut-off) and is forecast with Croston instead of SES.
+INTERMITTENT_ADI = 1.32
+
+
+def ses(Y, alpha):
+    """Simple exponential smoothing of every row of Y at once; returns the final level."""
+    level = Y[:, 0].astype(float)
+    for t in range(1, Y.shape[1]):
+        level += alpha * (Y[:, t] - level)
+    return level
+
+
+def croston(Y, alpha):
+    """
+    Croston's method (SBA bias correction) for every row of Y at once.
+    Smooths demand sizes and inter-demand intervals separately, updating
+    only on periods with demand; returns the demand rate per period.
+    """
+    n = Y.shape[0]
+    size = np.zeros(n)
+    interval = np.ones(n)
+    since = np.ones(n)
+    seen = np.zeros(n, dtype=bool)
+    for t in range(Y.shape[1]):
+        y = Y[:, t]
+        demand = y > 0
+        first = demand & ~seen
+        size = np.where(first, y, np.where(demand, size + alpha * (y - size), size))
+        interval = np.where(first, since, np.where(demand, interval + alpha * (since - interval), interval))
+        seen |= demand
+        since = np.where(demand, 1, since + 1)
+    return np.where(seen, (1 - alpha / 2) * size / interval, 0.0)
+
+
+class DemandForecaster:
+    """
+    Quantity-aware forecast of every (pharmacy, product) series of a tenant.
+    Weekly demand is deseasonalised with a tenant-wide month-of-year index, then
+    smoothed with SES (regular series) or Croston (intermittent series),
+    vectorised across series. Chunks of pharmacies run in a process pool.
+    """
+
+    COLUMNS = ['pharmacy_id', 'product_id', 'date', 'quantity']
+
+    def __init__(self, client_id, HORIZON_DAYS=30, LOOKBACK_DAYS=364, ALPHA=0.2, as_of=None):
+        self.client_id = client_id
+        self.horizon_days = HORIZON_DAYS
+        self.lookback_days = LOOKBACK_DAYS
+        self.alpha = ALPHA
+        self.as_of = as_of or timezone.now().date()
+
+    def seasonal_index(self):
+        """Month-of-year multiplicative index (12 floats, mean 1) from the tenant's full history."""
+        monthly = (
+            SalesLine.objects.filter(document__client_id=self.client_id, document__status='COMPLETED')
+            .annotate(month=TruncMonth('document__date'))
+            .values('month')
+            .annotate(units=Sum('quantity'))
+            .order_by()
+        )
+        totals = np.zeros(12)
+        counts = np.zeros(12)
+        for row in monthly:
+            totals[row['month'].month - 1] += row['units'] or 0
+            counts[row['month'].month - 1] += 1
+
+        # Needs every calendar month observed at least once, otherwise no seasonality
+        if not counts.all():
+            return np.ones(12)
+        means = totals / counts
+        if means.mean() <= 0:
+            return np.ones(12)
+        return means / means.mean()
+
+    def load_history(self, pharmacy_ids=None):
+        start_date = self.as_of - timedelta(days=self.lookback_days)
+        lines = SalesLine.objects.filter(
+            document__client_id=self.client_id,
+            document__date__date__gt=start_date,
+            document__date__date__lte=self.as_of,
+            document__status='COMPLETED',
+        )
+        if pharmacy_ids is not None:
+            lines = lines.filter(document__pharmacy_id__in=pharmacy_ids)
+
+        rows = lines.values_list('document__pharmacy_id', 'product_id', 'document__date__date', 'quantity').order_by()
+        return pd.DataFrame.from_records(rows.iterator(chunk_size=10000), columns=self.COLUMNS)
+
+    def compute(self, df, seasonal=None):
+        """Forecast of every (pharmacy, product) pair in df as a DataFrame."""
+        columns = ['pharmacy_id', 'product_id', 'method', 'daily_rate', 'expected_units']
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        if seasonal is None:
+            seasonal = np.ones(12)
+
+        pair_codes, pairs = pd.MultiIndex.from_arrays([df['pharmacy_id'], df['product_id']]).factorize()
+
+        # Periods end on as_of: column -1 is the latest complete week
+        today = to_epoch_days([self.as_of])[0]
+        n_periods = -(-self.lookback_days // PERIOD_DAYS)
+        age = (today - to_epoch_days(df['date'].tolist())) // PERIOD_DAYS
+        Y = np.zeros((len(pairs), n_periods))
+        np.add.at(Y, (pair_codes, n_periods - 1 - age), df['quantity'].to_numpy(dtype=float))
+
+        # Deseasonalise with the month of each period's last day
+        period_end = np.datetime64(self.as_of) - (n_periods - 1 - np.arange(n_periods)) * PERIOD_DAYS
+        period_months = period_end.astype('datetime64[M]').astype(int) % 12
+        Y = Y / seasonal[period_months]
+
+        # Intermittency: mean periods between demands since the first one
+        has_demand = Y > 0
+        first = has_demand.argmax(axis=1)
+        adi = (n_periods - first) / np.maximum(has_demand.sum(axis=1), 1)
+        intermittent = adi > INTERMITTENT_ADI
+
+        rate = np.empty(len(pairs))
+        if intermittent.any():
+            rate[intermittent] = croston(Y[intermittent], self.alpha)
+        if (~intermittent).any():
+            rate[~intermittent] = ses(Y[~intermittent], self.alpha)
+        daily_rate = rate / PERIOD_DAYS
+
+        # Reseasonalise over the horizon days
+        horizon = np.datetime64(self.as_of) + np.arange(1, self.horizon_days + 1)
+        horizon_factor = seasonal[horizon.astype('datetime64[M]').astype(int) % 12].sum()
+
+        return pd.DataFrame({
+            'pharmacy_id': pairs.get_level_values(0),
+            'product_id': pairs.get_level_values(1),
+            'method': np.where(intermittent, 'CROSTON', 'SES'),
+            'daily_rate': daily_rate,
+            'expected_units': daily_rate * horizon_factor,
+        })
+
+    def pharmacy_chunks(self, chunk_size):
+        pharmacy_ids = list(
+            SalesLine.objects.filter(
+                document__client_id=self.client_id,
+                document__date__date__gt=self.as_of - timedelta(days=self.lookback_days),
+                document__status='COMPLETED',
+            ).values_list('document__pharmacy_id', flat=True).distinct().order_by()
+        )
+        return [pharmacy_ids[i:i + chunk_size] for i in range(0, len(pharmacy_ids), chunk_size)]
+
+    def run(self, workers=1, chunk_size=200):
+        """Forecasts the whole tenant, one chunk of pharmacies per task."""
+        seasonal = self.seasonal_index()
+        chunks = self.pharmacy_chunks(chunk_size)
+        if workers <= 1 or len(chunks) <= 1:
+            frames = [self.compute(self.load_history(chunk), seasonal) for chunk in chunks]
+        else:
+            # Children open their own connections; never share the parent's
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                frames = list(pool.map(_forecast_chunk, [(self, chunk, seasonal) for chunk in chunks]))
+
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return self.compute(pd.DataFrame(columns=self.COLUMNS))
+        return pd.concat(frames, ignore_index=True)
+
+    def build_rows(self, forecasts):
+        generated_at = timezone.now()
+        return [
+            DemandForecast(
+                client_id=self.client_id,
+                pharmacy_id=pharmacy_id,
+                product_id=product_id,
+                method=method,
+                daily_rate=float(daily_rate),
+                horizon_days=self.horizon_days,
+                expected_units=float(expected),
+                generated_at=generated_at,
+            )
+            for pharmacy_id, product_id, method, daily_rate, expected in forecasts.itertuples(index=False)
+        ]
+
+    def save(self, forecasts=None, workers=1, chunk_size=200):
+        """Replaces the tenant's DemandForecast rows with a fresh batch."""
+        if forecasts is None:
+            forecasts = self.run(workers, chunk_size)
+        rows = self.build_rows(forecasts)
+        with transaction.atomic():
+            DemandForecast.objects.filter(client_id=self.client_id).delete()
+            DemandForecast.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
+def _forecast_chunk(task):
+    forecaster, pharmacy_ids, seasonal = task
+    return forecaster.compute(forecaster.load_history(pharmacy_ids), seasonal)
@@ -0,0 +1,23 @@
+import time
+
+
+def get_generation(cache, key):
+    """
+    Current value of a generation counter. Seeded from the clock so that a
+    counter lost to eviction never collides with one that older entries were
+    stored under.
+    """
+    generation = cache.get(key)
+    if generation is None:
+        generation = time.time_ns()
+        cache.add(key, generation, None)
+        generation = cache.get(key, generation)
+    return generation
+
+
+def bump_generation(cache, key):
+    """Moves the counter forward, invalidating every entry keyed on the former value."""
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted or never read: reseed past any former value
+        cache.set(key, time.time_ns(), None)
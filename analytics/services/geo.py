@@ -0,0 +1,153 @@
+import math
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+from scipy.spatial import cKDTree
+from django.core.cache import caches
+
+from analytics.models import Pharmacy
+from analytics.services import generations
+
+CACHE_ALIAS = 'shared'
+EARTH_RADIUS_M = 6371008.8
+# Upper bound on how stale a process' tree can be (bulk imports skip the signals)
+LOCATOR_MAX_AGE = 10 * 60
+DEFAULT_RADIUS_M = 2000
+MAX_RADIUS_M = 50000
+DEFAULT_NEAREST = 20
+
+
+def parse_coordinate(value, limit=180):
+    """Decimal degrees (6 places, as stored) from request / payload input; None if empty."""
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Coordenada inválida: {value}")
+    if not number.is_finite() or abs(number) > limit:
+        raise ValueError(f"Coordenada inválida: {value}")
+    return number.quantize(Decimal('0.000001'))
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two points in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_from_target(pharmacy_latitude, pharmacy_longitude, latitude, longitude):
+    """Visit.distance_from_target: whole meters from the check-in to the pharmacy, None if either is unknown."""
+    if None in (pharmacy_latitude, pharmacy_longitude, latitude, longitude):
+        return None
+    return round(haversine_m(pharmacy_latitude, pharmacy_longitude, latitude, longitude))
+
+
+def _unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere: euclidean (chord) distance grows monotonically with the arc."""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def _chord(meters):
+    return 2 * math.sin(min(meters / EARTH_RADIUS_M, math.pi) / 2)
+
+
+def _arc_m(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+
+class PharmacyLocator:
+    """
+    KD-tree over the geolocated active pharmacies of a tenant. Coordinates are
+    mapped to 3D unit vectors so nearest neighbours by chord length are the
+    nearest by great-circle distance, with no distortion near the poles or the
+    antimeridian. Built with one query and cached per process (see get_locator).
+    """
+
+    def __init__(self, pharmacy_ids, latitudes, longitudes):
+        self.pharmacy_ids = list(pharmacy_ids)
+        self.tree = cKDTree(_unit_vectors(latitudes, longitudes)) if self.pharmacy_ids else None
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.pharmacy_ids)
+
+    @classmethod
+    def build(cls, client_id):
+        rows = list(
+            Pharmacy.objects.filter(client_id=client_id, is_active=True, latitude__isnull=False, longitude__isnull=False)
+            .values_list('id', 'latitude', 'longitude')
+        )
+        return cls([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+    def nearest(self, latitude, longitude, k=DEFAULT_NEAREST, radius_m=DEFAULT_RADIUS_M):
+        """[(pharmacy id, meters)] of the k closest pharmacies within radius_m, closest first."""
+        if self.tree is None:
+            return []
+        k = min(k, len(self.pharmacy_ids))
+        chords, positions = self.tree.query(
+            _unit_vectors([latitude], [longitude])[0], k=k, distance_upper_bound=_chord(radius_m),
+        )
+        chords, positions = np.atleast_1d(chords), np.atleast_1d(positions)
+        found = np.isfinite(chords)  # misses beyond the radius come back as inf
+        return [
+            (self.pharmacy_ids[position], float(meters))
+            for position, meters in zip(positions[found], _arc_m(chords[found]))
+        ]
+
+
+# ----------------------------------------------------------------------
+# Per-process cache, invalidated across workers through a generation in
+# the shared cache (bumped by analytics.signals when coordinates change).
+# ----------------------------------------------------------------------
+
+_locators = {}
+_locators_lock = threading.Lock()
+
+
+def _generation_key(client_id):
+    return f"pharmacy_locator:gen:{client_id}"
+
+
+def get_generation(client_id):
+    return generations.get_generation(caches[CACHE_ALIAS], _generation_key(client_id))
+
+
+def invalidate_locator(client_id):
+    generations.bump_generation(caches[CACHE_ALIAS], _generation_key(client_id))
+
+
+def get_locator(client_id):
+    generation = get_generation(client_id)
+    with _locators_lock:
+        cached = _locators.get(client_id)
+    if cached is not None:
+        cached_generation, locator = cached
+        if cached_generation == generation and time.monotonic() - locator.built_at < LOCATOR_MAX_AGE:
+            return locator
+
+    locator = PharmacyLocator.build(client_id)
+    with _locators_lock:
+        _locators[client_id] = (generation, locator)
+    return locator
+
+
+def nearby_pharmacies(client_id, latitude, longitude, radius_m=DEFAULT_RADIUS_M, limit=DEFAULT_NEAREST):
+    """Closest pharmacies to a point: dicts with id, code, display_name, city and distance (meters)."""
+    hits = get_locator(client_id).nearest(latitude, longitude, k=limit, radius_m=radius_m)
+    if not hits:
+        return []
+    rows = {
+        row['id']: row
+        for row in Pharmacy.objects.filter(id__in=[pk for pk, _ in hits]).values('id', 'code', 'display_name', 'city')
+    }
+    return [
+        {**rows[pk], 'distance': round(meters)}
+        for pk, meters in hits
+        if pk in rows
+    ]
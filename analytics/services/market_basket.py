@@ -0,0 +1,271 @@
+import datetime
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from analytics.models import Product, SalesDocument, SalesLine
+
+# Rules need at least this many baskets with both products to be reported
+MIN_COOCCURRENCE = 3
+# Only positive associations (bought together more often than by chance)
+MIN_LIFT = 1.0
+# Lines streamed per chunk while building (baskets never straddle two chunks)
+CHUNK_LINES = 200000
+# Documents updated this long before the last refresh are re-read: a transaction
+# that commits late still carries the updated_at of its save
+WATERMARK_OVERLAP = datetime.timedelta(hours=1)
+
+
+def index_path(client_id):
+    return os.path.join(settings.ANALYTICS_DATA_DIR, 'baskets', f'baskets_{client_id}.npz')
+
+
+class BasketIndex:
+    """
+    Product co-purchase index of a tenant: each completed SalesDocument is a basket.
+    Keeps a sparse symmetric product x product co-occurrence matrix (baskets that
+    contain both), per-product basket counts and the total number of baskets, so
+    support / confidence / lift of any pair is a lookup. Documents are folded in
+    incrementally: the watermark is SalesDocument.updated_at (re-read with an
+    overlap), so documents completed after they were imported are caught, and the
+    ids of the folded documents make re-reads idempotent. Documents that leave
+    COMPLETED are taken back out; deleted documents or edited lines need --full.
+    """
+
+    _loaded = {}
+    _lock = threading.Lock()
+
+    def __init__(self, product_ids=None, item_counts=None, cooccurrence=None, n_baskets=0, document_ids=None,
+                 watermark=None, built_at=None):
+        self.product_ids = np.asarray(product_ids if product_ids is not None else [], dtype=str)
+        self.item_counts = item_counts if item_counts is not None else np.zeros(0, dtype=np.int64)
+        n = len(self.product_ids)
+        self.cooccurrence = cooccurrence if cooccurrence is not None else sparse.csr_matrix((n, n), dtype=np.int64)
+        self.n_baskets = n_baskets
+        # Sorted ids of the documents folded in
+        self.document_ids = document_ids if document_ids is not None else np.zeros(0, dtype=np.int64)
+        self.watermark = watermark
+        self.built_at = built_at
+        self._position = {pid: i for i, pid in enumerate(self.product_ids)}
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    # ------------------------------------------------------------------
+    # Build / refresh
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def build(cls, client_id):
+        index = cls()
+        index.refresh(client_id)
+        return index
+
+    def refresh(self, client_id):
+        """
+        Folds the completed documents updated since the watermark that are not in
+        the index yet, and takes out the indexed ones that are no longer completed.
+        Returns the net number of baskets added.
+        """
+        started = timezone.now()
+        documents = SalesDocument.objects.filter(client_id=client_id)
+        if self.watermark is not None:
+            documents = documents.filter(updated_at__gte=self.watermark - WATERMARK_OVERLAP)
+
+        added = self._stream(
+            SalesLine.objects.filter(document__in=documents.filter(status='COMPLETED')), sign=1,
+        )
+        withdrawn = np.intersect1d(
+            np.fromiter(documents.exclude(status='COMPLETED').values_list('id', flat=True), dtype=np.int64),
+            self.document_ids,
+        )
+        if len(withdrawn):
+            added -= self._stream(SalesLine.objects.filter(document_id__in=withdrawn.tolist()), sign=-1)
+
+        self.watermark = self.built_at = started
+        return added
+
+    def _stream(self, lines, sign):
+        """Folds SalesLine rows in chunks of whole baskets; returns the baskets folded."""
+        rows = lines.values_list('document_id', 'product_id').order_by('document_id')
+        folded = 0
+        pending = []
+        for row in rows.iterator(chunk_size=10000):
+            pending.append(row)
+            if len(pending) >= CHUNK_LINES and pending[-1][0] != pending[-2][0]:
+                # Keep the last (maybe incomplete) basket for the next chunk
+                folded += self._fold(pending[:-1], sign)
+                pending = pending[-1:]
+        return folded + self._fold(pending, sign)
+
+    def _fold(self, rows, sign=1):
+        """
+        Adds (sign=1) or removes (sign=-1) one chunk of (document_id, product_id)
+        lines, grouped by document. Documents already in (or not in) the index are skipped.
+        """
+        if not rows:
+            return 0
+        documents, products = zip(*rows)
+        documents = np.asarray(documents, dtype=np.int64)
+        indexed = np.isin(documents, self.document_ids)
+        keep = indexed if sign < 0 else ~indexed
+        if not keep.any():
+            return 0
+        documents = documents[keep]
+        products = [str(p) for p, k in zip(products, keep) if k]
+
+        # Map products to matrix positions, appending unseen ones
+        for pid in products:
+            if pid not in self._position:
+                self._position[pid] = len(self._position)
+        if len(self._position) > len(self.product_ids):
+            n = len(self._position)
+            self.product_ids = np.array(list(self._position), dtype=str)
+            self.item_counts = np.r_[self.item_counts, np.zeros(n - len(self.item_counts), dtype=np.int64)]
+            self.cooccurrence.resize((n, n))
+        n = len(self.product_ids)
+
+        # Binary basket x product incidence matrix; B.T @ B counts baskets per pair
+        basket_codes, basket_ids = pd.factorize(documents)
+        product_codes = np.fromiter((self._position[p] for p in products), dtype=np.int64, count=len(products))
+        incidence = sparse.csr_matrix(
+            (np.ones(len(products), dtype=np.int64), (basket_codes, product_codes)),
+            shape=(len(basket_ids), n),
+        )
+        incidence.data[:] = 1  # a product repeated in one basket counts once
+
+        pairs = (incidence.T @ incidence).tocsr()
+        self.item_counts += sign * pairs.diagonal()
+        pairs.setdiag(0)
+        pairs.eliminate_zeros()
+        self.cooccurrence = (self.cooccurrence + sign * pairs).tocsr()
+        self.cooccurrence.eliminate_zeros()
+
+        self.n_baskets += sign * len(basket_ids)
+        basket_ids = np.asarray(basket_ids, dtype=np.int64)
+        if sign < 0:
+            self.document_ids = np.setdiff1d(self.document_ids, basket_ids)
+        else:
+            self.document_ids = np.union1d(self.document_ids, basket_ids)
+        return len(basket_ids)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, client_id):
+        path = index_path(client_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        matrix = self.cooccurrence.tocsr()
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            product_ids=self.product_ids,
+            item_counts=self.item_counts,
+            data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+            n_baskets=np.array(self.n_baskets),
+            document_ids=self.document_ids,
+            watermark=np.array(self.watermark.isoformat() if self.watermark else ''),
+            built_at=np.array(self.built_at.isoformat() if self.built_at else ''),
+        )
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._loaded.pop(client_id, None)
+
+    @classmethod
+    def load(cls, client_id):
+        """Tenant index memoised per process (reloaded when the file changes); None if not built."""
+        path = index_path(client_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        with cls._lock:
+            cached = cls._loaded.get(client_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with np.load(path) as data:
+            n = len(data['product_ids'])
+            index = cls(
+                product_ids=data['product_ids'],
+                item_counts=data['item_counts'],
+                cooccurrence=sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=(n, n)),
+                n_baskets=int(data['n_baskets']),
+                document_ids=data['document_ids'],
+                watermark=parse_datetime(str(data['watermark'])) if 'watermark' in data else None,
+                built_at=str(data['built_at']),
+            )
+        with cls._lock:
+            cls._loaded[client_id] = (mtime, index)
+        return index
+
+    # ------------------------------------------------------------------
+    # Association rules
+    # ------------------------------------------------------------------
+
+    def rules(self, antecedent_ids, k=5, min_cooccurrence=MIN_COOCCURRENCE, min_lift=MIN_LIFT):
+        """
+        Best rules {antecedent} -> product for the given products, ranked by lift.
+        confidence = P(product | antecedent), lift = confidence / P(product).
+        Each consequent keeps its best antecedent; antecedents themselves are excluded.
+        """
+        seeds = [self._position[str(pid)] for pid in antecedent_ids if str(pid) in self._position]
+        if not seeds or not self.n_baskets:
+            return []
+
+        block = self.cooccurrence[seeds].tocoo()
+        keep = (block.data >= min_cooccurrence) & ~np.isin(block.col, seeds)
+        rows, cols, together = block.row[keep], block.col[keep], block.data[keep]
+        if len(cols) == 0:
+            return []
+
+        antecedent_counts = self.item_counts[np.asarray(seeds)[rows]]
+        confidence = together / antecedent_counts
+        lift = confidence / (self.item_counts[cols] / self.n_baskets)
+        positive = lift > min_lift
+        rows, cols, together = rows[positive], cols[positive], together[positive]
+        confidence, lift = confidence[positive], lift[positive]
+        if len(cols) == 0:
+            return []
+
+        # Best lift per consequent, then top-k
+        order = np.lexsort((-confidence, -lift))
+        _, first = np.unique(cols[order], return_index=True)
+        best = order[first]
+        best = best[np.lexsort((-confidence[best], -lift[best]))][:k]
+
+        return [
+            {
+                'product_id': str(self.product_ids[cols[i]]),
+                'baskets': int(together[i]),
+                'support': float(together[i] / self.n_baskets),
+                'confidence': float(confidence[i]),
+                'lift': float(lift[i]),
+            }
+            for i in best
+        ]
+
+
+def frequently_bought_with(client_id, product_ids, k=5):
+    """'Frequently bought with' list for a set of products, with sku / name joined."""
+    index = BasketIndex.load(client_id)
+    if index is None:
+        return []
+    rules = index.rules(product_ids, k=k)
+    products = {str(pk): p for pk, p in Product.objects.in_bulk([r['product_id'] for r in rules]).items()}
+    for rule in rules:
+        product = products.get(rule['product_id'])
+        rule['sku'] = product.sku if product else ""
+        rule['product_name'] = product.name if product else ""
+        rule['lift'] = round(rule['lift'], 2)
+        rule['confidence'] = round(rule['confidence'], 3)
+        rule['support'] = round(rule['support'], 4)
+    return rules
@@ -0,0 +1,164 @@
+import uuid
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from analytics.models import Pharmacy
+from analytics.services.search_keys import normalize, pharmacy_search_key
+
+DEFAULT_LIMIT = 20
+# Trigram indexes only answer substrings of 3+ characters
+MIN_TRIGRAM = 3
+
+# SQLite: FTS5 trigram table kept in sync by analytics.signals
+FTS_TABLE = 'analytics_pharmacy_search'
+# FTS5 only indexes the rowid: each pharmacy's row lives at a rowid derived from its UUID
+ROWID_MASK = (1 << 63) - 1
+
+
+def search_rowid(pharmacy_id):
+    """Stable FTS rowid of a pharmacy (the low 63 bits of its UUID)."""
+    return uuid.UUID(str(pharmacy_id)).int & ROWID_MASK
+
+
+# ----------------------------------------------------------------------
+# Index management (vendor specific; called from migrations and commands)
+# ----------------------------------------------------------------------
+
+def create_search_index(schema_editor=None):
+    conn = schema_editor.connection if schema_editor else connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(search_key, pharmacy_id UNINDEXED, client_id UNINDEXED, tokenize='trigram')"
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS analytics_pharmacy_search_trgm "
+                "ON analytics_pharmacy USING gin (search_key gin_trgm_ops)"
+            )
+
+
+def drop_search_index(schema_editor=None):
+    conn = schema_editor.connection if schema_editor else connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS analytics_pharmacy_search_trgm")
+
+
+def rebuild_search_keys(pharmacies=None, batch_size=2000):
+    """
+    Recomputes search_key (for rows written with bulk_create / update) and
+    reloads the SQLite FTS table (emptied first on a full rebuild, otherwise
+    the given pharmacies' rows are replaced by rowid). Returns the number of
+    pharmacies indexed.
+    """
+    full = pharmacies is None
+    pharmacies = pharmacies if pharmacies is not None else Pharmacy.objects.all()
+    rows = pharmacies.values_list('id', 'client_id', *Pharmacy.SEARCH_KEY_FIELDS, 'search_key')
+    changed, entries = [], []
+    for pk, client_id, code, display_name, name_trade, city, search_key in rows.iterator(chunk_size=batch_size):
+        key = pharmacy_search_key(code, display_name, name_trade, city)
+        if key != search_key:
+            changed.append(Pharmacy(id=pk, search_key=key))
+        entries.append((search_rowid(pk), key, str(pk), str(client_id)))
+    Pharmacy.objects.bulk_update(changed, ['search_key'], batch_size=batch_size)
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            if full:
+                cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            else:
+                cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(e[0],) for e in entries])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, search_key, pharmacy_id, client_id) VALUES (%s, %s, %s, %s)",
+                entries,
+            )
+    return len(entries)
+
+
+def index_pharmacy(pharmacy):
+    """Keeps the SQLite FTS row of one pharmacy in sync (no-op elsewhere: pg_trgm indexes the column)."""
+    if connection.vendor != 'sqlite':
+        return
+    rowid = search_rowid(pharmacy.pk)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [rowid])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, search_key, pharmacy_id, client_id) VALUES (%s, %s, %s, %s)",
+            [rowid, pharmacy.search_key, str(pharmacy.pk), str(pharmacy.client_id)],
+        )
+
+
+def unindex_pharmacy(pharmacy_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [search_rowid(pharmacy_id)])
+
+
+# ----------------------------------------------------------------------
+# Search
+# ----------------------------------------------------------------------
+
+def _fts_candidates(client_id, terms):
+    """
+    Subquery of the tenant's pharmacy ids whose key contains every 3+ char
+    term (SQLite FTS5). Left unbounded so the caller ranks and limits the
+    whole match set in the same statement.
+    """
+    match = ' '.join('"{}"'.format(term.replace('"', '')) for term in terms)
+    # The FTS table keeps str(uuid); Django stores UUIDs on SQLite as 32 hex chars
+    return RawSQL(
+        f"SELECT replace(pharmacy_id, '-', '') FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND client_id = %s",
+        [match, str(client_id)],
+    )
+
+
+def search_pharmacies(client_id, query, limit=DEFAULT_LIMIT):
+    """
+    Typeahead over the active pharmacies of a tenant: every word of `query`
+    must appear in the search key; code prefixes rank first, then word prefixes.
+    Returns dicts with id, code, display_name and city.
+    """
+    text = normalize(query)
+    terms = text.split()
+    if not terms:
+        return []
+
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM]
+    short_terms = [t for t in terms if len(t) < MIN_TRIGRAM]
+
+    if long_terms and connection.vendor == 'sqlite':
+        # The FTS rows are already scoped to the tenant: filtering client_id again would
+        # make SQLite walk the (client_id, ...) index instead of the primary key.
+        pharmacies = Pharmacy.objects.filter(id__in=_fts_candidates(client_id, long_terms), is_active=True)
+    else:
+        # pg_trgm serves LIKE '%term%' from the GIN index; other backends scan
+        pharmacies = Pharmacy.objects.filter(client_id=client_id, is_active=True)
+        for term in long_terms:
+            pharmacies = pharmacies.filter(search_key__contains=term)
+
+    for term in short_terms:
+        pharmacies = pharmacies.filter(search_key__contains=term)
+    if not long_terms:
+        # One or two letters: code / word prefixes only, anything else is noise
+        pharmacies = pharmacies.filter(Q(search_key__startswith=text) | Q(search_key__contains=f' {text}'))
+
+    rows = (
+        pharmacies
+        .annotate(prefix=Case(
+            When(search_key__startswith=text, then=Value(0)),  # code prefix
+            When(search_key__contains=f' {text}', then=Value(1)),  # word prefix
+            default=Value(2),
+            output_field=IntegerField(),
+        ))
+        .order_by('prefix', 'display_name')
+        .values('id', 'code', 'display_name', 'city')[:limit]
+    )
+    return list(rows)
@@ -1,95 +1,436 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
 import pandas as pd
-from django.db.models import F
+from django.db import connections, transaction
 from django.utils import timezone
 from datetime import timedelta
-from analytics.models import SalesLine
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from analytics.models import Pharmacy, Product, SalesLine, ReorderSuggestion, PurchaseCycleState, DemandForecast
+
+# Detection thresholds, shared by the per-pharmacy and batch predictors.
+# Due when time since last order > avg cycle + 20%; abandoned beyond 4x the cycle.
+DUE_BUFFER = 0.2
+ABANDONED_FACTOR = 4
+TOP_K = 5
+
+def gap_analysis(group_codes, days, today, min_orders=2, due_buffer=DUE_BUFFER, abandoned_factor=ABANDONED_FACTOR):
+    """
+    Vectorised purchase-cycle kernel over many series at once.
+
+    group_codes: int array, one series id per order line (e.g. a factorized product)
+    days: int array, order day (days since epoch) per line
+    today: int, reference day (days since epoch)
+
+    Same-day orders collapse into one purchase event. The mean of consecutive gaps
+    telescopes to (last - first) / (events - 1), so no per-series diff is needed.
+    Returns a dict of per-series arrays plus the `due` boolean mask.
+    """
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    if len(group_codes) == 0:
+        empty = np.array([], dtype=np.int64)
+        return {'group': empty, 'first': empty, 'last': empty, 'events': empty, 'gap_sumsq': empty.astype(float),
+                'avg_cycle': empty.astype(float), 'days_since_last': empty, 'due': empty.astype(bool)}
+
+    order = np.lexsort((days, group_codes))
+    codes, days = group_codes[order], days[order]
+
+    # Unique (series, day) events
+    new_event = np.ones(len(codes), dtype=bool)
+    new_event[1:] = (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])
+    codes, days = codes[new_event], days[new_event]
+
+    # Series boundaries in the sorted event arrays
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)] - 1
+
+    first, last = days[starts], days[ends]
+    events = ends - starts + 1
+
+    # Sum of squared consecutive gaps (for cycle variance), gaps never cross series
+    same_series = codes[1:] == codes[:-1]
+    gaps = np.diff(days)[same_series]
+    gap_series = np.cumsum(np.r_[True, ~same_series])[1:][same_series] - 1
+    gap_sumsq = np.bincount(gap_series, weights=gaps.astype(float) ** 2, minlength=len(starts))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_cycle = np.where(events > 1, (last - first) / np.maximum(events - 1, 1), np.nan)
+    days_since_last = today - last
+
+    # Detection threshold: overdue by more than the buffer, but not abandoned
+    due = (
+        (events >= max(min_orders, 2))
+        & (days_since_last > avg_cycle * (1 + due_buffer))
+        & (days_since_last < avg_cycle * abandoned_factor)
+    )
+    return {
+        'group': codes[starts],
+        'first': first,
+        'last': last,
+        'events': events,
+        'gap_sumsq': gap_sumsq,
+        'avg_cycle': avg_cycle,
+        'days_since_last': days_since_last,
+        'due': due,
+    }
+
+
+def to_epoch_days(dates):
+    """datetime.date / datetime64 values -> int64 days since 1970-01-01."""
+    if isinstance(dates, pd.Series) and pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.to_numpy(dtype='datetime64[D]').astype(np.int64)
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
 
 class ReorderPredictor:
     """
     Local AI Service for predicting reorder needs based on purchase cycles.
-    Optimized for performance: uses vectorized Pandas operations.
+    Optimized for performance: one vectorised gap-analysis pass for all products.
     """
     
-    def __init__(self, pharmacy_id, LOOKBACK_DAYS=180, MIN_ORDERS=2):
+    def __init__(self, pharmacy_id, LOOKBACK_DAYS=180, MIN_ORDERS=2, TOP_K=TOP_K,
+                 DUE_BUFFER=DUE_BUFFER, ABANDONED_FACTOR=ABANDONED_FACTOR):
         self.pharmacy_id = pharmacy_id
         self.lookback_days = LOOKBACK_DAYS
         self.min_orders = MIN_ORDERS
+        self.top_k = TOP_K
+        self.due_buffer = DUE_BUFFER
+        self.abandoned_factor = ABANDONED_FACTOR
 
-    def get_suggestions(self):
+    def get_suggestions(self, today=None):
         """
         Returns a list of products that are 'due' for reordering.
-        Structure: [{'product_name': str, 'days_since_last': int, 'avg_cycle': int, 'confidence': str}]
+        Structure: [{'product_id': str, 'sku': str, 'product_name': str, 'expected_units': int | None, 'horizon_days': int | None,
+                     'days_since_last': int, 'avg_cycle': int, 'reason': str}]
         """
-        start_date = timezone.now().date() - timedelta(days=self.lookback_days)
-        
-        # 1. Efficient DB Query: Fetch only necessary fields
+        return self.attach_products(self.due_products(today or timezone.now().date()))
+
+    def due_products(self, today):
+        """
+        Top-K due products as of `today`, before joining product data.
+
+        Served from PurchaseCycleState (one indexed read). Pharmacies whose state
+        has not been built yet fall back to scanning the lookback window, as do
+        the pairs whose first order has left the window since their state was
+        written (until expire_purchase_cycles rebuilds them).
+        """
+        start_date = today - timedelta(days=self.lookback_days)
+
+        states = list(self.states(today))
+        if not states:
+            return self.rank_history(today)
+
+        fresh = [state for state in states if state[1] >= start_date]
+        expired = [state[0] for state in states if state[1] < start_date]
+
+        product_ids, events, last_days, gap_sums = [], [], [], []
+        if fresh:
+            fresh_ids, _, last_dates, fresh_events, fresh_gaps = zip(*fresh)
+            product_ids.extend(fresh_ids)
+            events.extend(fresh_events)
+            last_days.extend(to_epoch_days(last_dates))
+            gap_sums.extend(fresh_gaps)
+        if expired:
+            rows = list(self.history(today, product_ids=expired))
+            if rows:
+                codes, labels = pd.factorize(pd.Series([r[0] for r in rows]), sort=True)
+                result = gap_analysis(codes, to_epoch_days([r[1] for r in rows]), 0)
+                product_ids.extend(labels[result['group']])
+                events.extend(result['events'])
+                last_days.extend(result['last'])
+                gap_sums.extend(result['last'] - result['first'])
+
+        events = np.array(events, dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg_cycle = np.where(events > 1, np.array(gap_sums) / np.maximum(events - 1, 1), np.nan)
+        days_since = to_epoch_days([today])[0] - np.array(last_days, dtype=np.int64)
+
+        due = (
+            (events >= max(self.min_orders, 2))
+            & (days_since > avg_cycle * (1 + self.due_buffer))
+            & (days_since < avg_cycle * self.abandoned_factor)
+        )
+        codes, labels = pd.factorize(pd.Series(product_ids), sort=True)
+        return self._top_due(labels, codes[due], days_since[due], avg_cycle[due])
+
+    def states(self, today):
+        """(product id, first order, last order, order days, gap sum) of the pairs ordered in the lookback window."""
+        return PurchaseCycleState.objects.filter(
+            pharmacy_id=self.pharmacy_id,
+            last_order_date__gte=today - timedelta(days=self.lookback_days),
+            last_order_date__lte=today,
+        ).values_list('product_id', 'first_order_date', 'last_order_date', 'unique_order_days', 'gap_sum')
+
+    def get_stored_suggestions(self):
+        """
+        Same structure, read from the ReorderSuggestion rows of the nightly batch
+        (BatchReorderPredictor). Empty if the batch has not covered the pharmacy.
+        """
+        suggestions = [
+            {'product_id': product_id, 'days_since_last': days_since, 'avg_cycle': cycle, 'reason': reason}
+            for product_id, days_since, cycle, reason in ReorderSuggestion.objects.filter(
+                pharmacy_id=self.pharmacy_id,
+            ).order_by('rank', 'product_id').values_list(
+                'product_id', 'days_since_last', 'avg_cycle', 'reason',
+            )[:self.top_k]
+        ]
+        return self.attach_products(suggestions)
+
+    def history(self, today, product_ids=None):
+        """(product id, order day) of the completed sales of the lookback window."""
+        start_date = today - timedelta(days=self.lookback_days)
         # Filter by date range first to minimize memory usage
         lines = SalesLine.objects.filter(
             document__pharmacy_id=self.pharmacy_id,
             document__date__date__gte=start_date,
+            document__date__date__lte=today,
             document__status='COMPLETED' # Only consider actual consumption
-        ).values(
-            prod_name=F('product__name'),
-            date=F('document__date__date')
-        ).order_by('product__id', 'document__date')
+        )
+        if product_ids is not None:
+            lines = lines.filter(product_id__in=product_ids)
+        return lines.values_list('product_id', 'document__date__date').order_by()
 
-        if not lines:
-            return []
+    def get_suggestions_from_history(self, today=None):
+        """Same suggestions computed from the raw SalesLine history of the lookback window."""
+        return self.attach_products(self.rank_history(today or timezone.now().date()))
 
-        # 2. Convert to Pandas DataFrame
-        df = pd.DataFrame(lines)
-        
-        if df.empty:
+    def rank_history(self, today):
+        rows = list(self.history(today))
+        if not rows:
             return []
+        product_ids, dates = zip(*rows)
+        return self.rank(product_ids, dates, today)
 
-        # 3. Pre-process
-        df['date'] = pd.to_datetime(df['date'])
-        
-        # 4. Group by Product and Calculate Cycles
-        # We need products with at least N orders to establish a cycle
-        order_counts = df.groupby('prod_name')['date'].nunique()
-        recurring_products = order_counts[order_counts >= self.min_orders].index
-        
-        if len(recurring_products) == 0:
+    def rank(self, product_ids, dates, today):
+        """
+        Gap analysis + ranking over raw (product key, order date) pairs.
+        Keys are categorical-coded, so distinct SKUs sharing a name stay apart.
+        """
+        codes, labels = pd.factorize(pd.Series(product_ids), sort=True)
+        result = gap_analysis(
+            codes, to_epoch_days(dates), to_epoch_days([today])[0], self.min_orders,
+            self.due_buffer, self.abandoned_factor,
+        )
+
+        due = result['due']
+        return self._top_due(labels, result['group'][due], result['days_since_last'][due], result['avg_cycle'][due])
+
+    def _top_due(self, labels, groups, days_since, avg_cycle):
+        if len(groups) == 0:
             return []
-            
-        df_filtered = df[df['prod_name'].isin(recurring_products)]
-        
-        # 5. Core Logic: Gap Analysis
+
+        # Sort by most urgent (highest ratio of days_since / rounded avg_cycle), ties by product key
+        order = np.lexsort((groups, -(days_since / np.round(avg_cycle))))[:self.top_k]
+
         suggestions = []
-        today = pd.Timestamp.now().normalize()
-        
-        for product_name, group in df_filtered.groupby('prod_name'):
-            # clean duplicates on same day if any (multiple orders same day count as 1 event)
-            dates = group['date'].drop_duplicates().sort_values()
-            
-            # Calculate gaps (diff between dates)
-            gaps = dates.diff().dt.days.dropna()
-            
-            if len(gaps) == 0:
-                continue
-                
-            avg_cycle = gaps.mean()
-            last_order_date = dates.iloc[-1]
-            days_since_last = (today - last_order_date).days
-
-            # 6. Detection Threshold
-            # If time passed > average cycle + buffer (e.g. 20%), it's due.
-            # But not TOO long ago (e.g. 3x cycle), which implies they stopped buying it.
-            
-            buffer = 0.2
-            threshold = avg_cycle * (1 + buffer)
-            abandoned_threshold = avg_cycle * 4 
-
-            if days_since_last > threshold and days_since_last < abandoned_threshold:
-                suggestions.append({
-                    'product_name': product_name,
-                    'days_since_last': int(days_since_last),
-                    'avg_cycle': int(round(avg_cycle)),
-                    'reason': f"Solía pedir cada {int(round(avg_cycle))} días"
-                })
-        
-        # Sort by most urgent (highest ratio of days_since / avg_cycle)
-        suggestions.sort(key=lambda x: x['days_since_last'] / x['avg_cycle'], reverse=True)
-        
-        return suggestions[:5] # Top 5 only
+        for i in order:
+            cycle = int(round(avg_cycle[i]))
+            suggestions.append({
+                'product_id': labels[groups[i]],
+                'days_since_last': int(days_since[i]),
+                'avg_cycle': cycle,
+                'reason': f"Solía pedir cada {cycle} días"
+            })
+        return suggestions
+
+    def attach_products(self, suggestions):
+        """Joins sku / name and the demand forecast onto the final top-K (two queries)."""
+        if not suggestions:
+            return suggestions
+        product_ids = [s['product_id'] for s in suggestions]
+        products = Product.objects.in_bulk(product_ids)
+        forecasts = {
+            product_id: (expected, horizon)
+            for product_id, expected, horizon in DemandForecast.objects.filter(
+                pharmacy_id=self.pharmacy_id, product_id__in=product_ids
+            ).values_list('product_id', 'expected_units', 'horizon_days')
+        }
+        for s in suggestions:
+            product = products.get(s['product_id'])
+            expected, horizon = forecasts.get(s['product_id'], (None, None))
+            s['sku'] = product.sku if product else ""
+            s['product_name'] = product.name if product else ""
+            s['expected_units'] = max(1, round(expected)) if expected is not None else None
+            s['horizon_days'] = horizon
+            s['product_id'] = str(s['product_id'])
+        return suggestions
+
+
+class BatchReorderPredictor:
+    """
+    Fleet-wide variant of ReorderPredictor: one streamed query for every pharmacy
+    of a tenant and a single groupby/diff over all (pharmacy, product) pairs.
+    """
+
+    COLUMNS = ['pharmacy_id', 'product_id', 'date']
+
+    def __init__(self, client_id, LOOKBACK_DAYS=180, MIN_ORDERS=2, TOP_K=TOP_K, as_of=None,
+                 DUE_BUFFER=DUE_BUFFER, ABANDONED_FACTOR=ABANDONED_FACTOR):
+        self.client_id = client_id
+        self.lookback_days = LOOKBACK_DAYS
+        self.min_orders = MIN_ORDERS
+        self.top_k = TOP_K
+        self.due_buffer = DUE_BUFFER
+        self.abandoned_factor = ABANDONED_FACTOR
+        self.as_of = as_of or timezone.now().date()
+
+    def load_history(self, pharmacy_ids=None):
+        """Streams the lookback window of the tenant (or of a subset of pharmacies)."""
+        start_date = self.as_of - timedelta(days=self.lookback_days)
+        lines = SalesLine.objects.filter(
+            document__client_id=self.client_id,
+            document__date__date__gte=start_date,
+            document__date__date__lte=self.as_of,
+            document__status='COMPLETED',
+        )
+        if pharmacy_ids is not None:
+            lines = lines.filter(document__pharmacy_id__in=pharmacy_ids)
+
+        rows = lines.values_list('document__pharmacy_id', 'product_id', 'document__date__date').order_by()
+        return pd.DataFrame.from_records(rows.iterator(chunk_size=10000), columns=self.COLUMNS)
+
+    def compute(self, df):
+        """
+        Gap analysis for every (pharmacy, product) pair at once.
+        Returns the top-K due products per pharmacy as a DataFrame.
+        """
+        columns = self.COLUMNS[:2] + ['days_since_last', 'avg_cycle', 'urgency', 'rank']
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+
+        # One integer code per (pharmacy, product) pair
+        pair_codes, pairs = pd.MultiIndex.from_arrays(
+            [df['pharmacy_id'], df['product_id']]
+        ).factorize()
+        result = gap_analysis(
+            pair_codes, to_epoch_days(df['date']),
+            to_epoch_days([self.as_of])[0], self.min_orders,
+            self.due_buffer, self.abandoned_factor,
+        )
+
+        due = result['due']
+        due_pairs = pairs[result['group'][due]]
+        stats = pd.DataFrame({
+            'pharmacy_id': due_pairs.get_level_values(0),
+            'product_id': due_pairs.get_level_values(1),
+            'days_since_last': result['days_since_last'][due],
+            'avg_cycle': result['avg_cycle'][due],
+        })
+        stats['urgency'] = stats['days_since_last'] / stats['avg_cycle'].round()
+
+        # Most urgent first (highest ratio of days_since / avg_cycle), ties by product, top-K per pharmacy
+        stats = stats.sort_values(['pharmacy_id', 'urgency', 'product_id'], ascending=[True, False, True])
+        stats['rank'] = stats.groupby('pharmacy_id', sort=False).cumcount() + 1
+        stats = stats[stats['rank'] <= self.top_k]
+
+        return stats[columns].reset_index(drop=True)
+
+    def get_suggestions(self, pharmacy_ids=None):
+        return self.compute(self.load_history(pharmacy_ids))
+
+    def build_rows(self, suggestions, generated_at=None):
+        generated_at = generated_at or timezone.now()
+        rows = []
+        for pharmacy_id, product_id, days_since, avg_cycle, urgency, rank in suggestions.itertuples(index=False):
+            cycle = int(round(avg_cycle))
+            rows.append(ReorderSuggestion(
+                client_id=self.client_id,
+                pharmacy_id=pharmacy_id,
+                product_id=product_id,
+                rank=int(rank),
+                days_since_last=int(days_since),
+                avg_cycle=cycle,
+                urgency=float(urgency),
+                reason=f"Solía pedir cada {cycle} días",
+                generated_at=generated_at,
+            ))
+        return rows
+
+    def save(self, suggestions=None):
+        """Replaces the tenant's ReorderSuggestion rows with a fresh batch."""
+        if suggestions is None:
+            suggestions = self.get_suggestions()
+        rows = self.build_rows(suggestions)
+        with transaction.atomic():
+            ReorderSuggestion.objects.filter(client_id=self.client_id).delete()
+            ReorderSuggestion.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    def upsert(self, suggestions, pharmacy_ids=None):
+        """
+        Inserts or updates suggestions in place, keyed on (pharmacy, product).
+        With `pharmacy_ids`, the rows of those pharmacies this batch did not
+        refresh are dropped in the same transaction, so readers never see a
+        pharmacy with both generations (more than K rows, duplicate ranks).
+        """
+        generated_at = timezone.now()
+        rows = self.build_rows(suggestions, generated_at)
+        with transaction.atomic():
+            ReorderSuggestion.objects.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['pharmacy', 'product'],
+                update_fields=['rank', 'days_since_last', 'avg_cycle', 'urgency', 'reason', 'generated_at'],
+            )
+            if pharmacy_ids is not None:
+                ReorderSuggestion.objects.filter(pharmacy_id__in=pharmacy_ids, generated_at__lt=generated_at).delete()
+        return len(rows)
+
+    def partitions(self, partition_size):
+        pharmacy_ids = list(
+            Pharmacy.objects.filter(client_id=self.client_id).order_by('id').values_list('id', flat=True)
+        )
+        return [pharmacy_ids[i:i + partition_size] for i in range(0, len(pharmacy_ids), partition_size)]
+
+    def precompute(self, workers=1, partition_size=500, on_partition=None):
+        """
+        Nightly batch: partitions are computed in a process pool (each streams its
+        own history) and upserted by this process as they complete, each partition
+        replacing its pharmacies' rows in one transaction. Rows of pharmacies no
+        partition covered are dropped at the end.
+        on_partition(pharmacies, lines, rows, worker_peak_kb) is called per partition.
+        """
+        started_at = timezone.now()
+        partitions = self.partitions(partition_size)
+        tasks = [(self, ids) for ids in partitions]
+
+        def consume(results):
+            written = 0
+            for ids, (suggestions, lines, peak_kb) in zip(partitions, results):
+                rows = self.upsert(suggestions, ids)
+                written += rows
+                if on_partition:
+                    on_partition(len(ids), lines, rows, peak_kb)
+            return written
+
+        if workers <= 1 or len(partitions) <= 1:
+            written = consume(map(_predict_partition, tasks))
+        else:
+            # Children open their own connections; never share the parent's
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                written = consume(pool.map(_predict_partition, tasks))
+
+        ReorderSuggestion.objects.filter(client_id=self.client_id, generated_at__lt=started_at).delete()
+        return written
+
+
+def peak_memory_kb():
+    """Peak resident set size of the current process, in KB (None if unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _predict_partition(task):
+    predictor, pharmacy_ids = task
+    history = predictor.load_history(pharmacy_ids)
+    return predictor.compute(history), len(history), peak_memory_kb()
@@ -0,0 +1,212 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from analytics.models import SalesLine, PurchaseCycleState
+from analytics.services.prediction import gap_analysis, to_epoch_days
+
+# The state covers the purchases of the predictor's lookback window only, so the
+# state-backed ReorderPredictor and the raw-history scan see the same orders.
+LOOKBACK_DAYS = 180
+
+STATE_COLUMNS = [
+    'pharmacy_id', 'product_id', 'first_order_date', 'last_order_date', 'unique_order_days', 'gap_sum', 'gap_sumsq',
+]
+
+
+def window_start(today=None):
+    """First order day still inside the lookback window ending on `today`."""
+    today = today or timezone.now().date()
+    return today - datetime.timedelta(days=LOOKBACK_DAYS)
+
+
+def _pair_order_days(pharmacy_id, product_id, today):
+    return sorted(set(
+        SalesLine.objects.filter(
+            document__pharmacy_id=pharmacy_id,
+            product_id=product_id,
+            document__status='COMPLETED',
+            document__date__date__gte=window_start(today),
+            document__date__date__lte=today,
+        ).values_list('document__date__date', flat=True)
+    ))
+
+
+def rebuild_pair(client_id, pharmacy_id, product_id, today=None):
+    """Recomputes one (pharmacy, product) state from the orders of its lookback window."""
+    today = today or timezone.now().date()
+    days = _pair_order_days(pharmacy_id, product_id, today)
+    if not days:
+        PurchaseCycleState.objects.filter(pharmacy_id=pharmacy_id, product_id=product_id).delete()
+        return None
+
+    gaps = [(b - a).days for a, b in zip(days, days[1:])]
+    state, _ = PurchaseCycleState.objects.update_or_create(
+        pharmacy_id=pharmacy_id,
+        product_id=product_id,
+        defaults={
+            'client_id': client_id,
+            'first_order_date': days[0],
+            'last_order_date': days[-1],
+            'unique_order_days': len(days),
+            'gap_sum': sum(gaps),
+            'gap_sumsq': sum(g * g for g in gaps),
+        },
+    )
+    return state
+
+
+def rebuild_pairs(client_id, pharmacy_ids, product_ids):
+    """Rebuilds every (pharmacy, product) combination given (a document changed or went away)."""
+    today = timezone.now().date()
+    for pharmacy_id in set(pharmacy_ids):
+        for product_id in set(product_ids):
+            rebuild_pair(client_id, pharmacy_id, product_id, today)
+
+
+def record_purchase(client_id, pharmacy_id, product_id, day):
+    """
+    Folds one purchase day into the (pharmacy, product) state in O(1).
+    Days after the last or before the first order add a single gap; a day in
+    between splits an unknown gap, and a state whose first order has left the
+    lookback window must drop it, so those cases rebuild the pair.
+    Days outside the window are ignored.
+    """
+    today = timezone.now().date()
+    start = window_start(today)
+    if not start <= day <= today:
+        return
+
+    with transaction.atomic():
+        state = (
+            PurchaseCycleState.objects.select_for_update()
+            .filter(pharmacy_id=pharmacy_id, product_id=product_id)
+            .first()
+        )
+        if state is None:
+            PurchaseCycleState.objects.create(
+                client_id=client_id,
+                pharmacy_id=pharmacy_id,
+                product_id=product_id,
+                first_order_date=day,
+                last_order_date=day,
+            )
+            return
+
+        if day in (state.first_order_date, state.last_order_date):
+            return
+
+        if state.first_order_date < start or state.first_order_date < day < state.last_order_date:
+            rebuild_pair(client_id, pharmacy_id, product_id, today)
+            return
+
+        if day > state.last_order_date:
+            gap = (day - state.last_order_date).days
+            state.last_order_date = day
+        else:
+            gap = (state.first_order_date - day).days
+            state.first_order_date = day
+
+        state.unique_order_days += 1
+        state.gap_sum += gap
+        state.gap_sumsq += gap * gap
+        state.save(update_fields=[
+            'first_order_date', 'last_order_date', 'unique_order_days', 'gap_sum', 'gap_sumsq', 'updated_at'
+        ])
+
+
+def record_document(document):
+    """Folds every product of a SalesDocument that became COMPLETED into the purchase-cycle state."""
+    if document.status != 'COMPLETED':
+        return
+    day = timezone.localtime(document.date).date()
+    product_ids = set(document.lines.values_list('product_id', flat=True))
+    for product_id in product_ids:
+        record_purchase(document.client_id, document.pharmacy_id, product_id, day)
+
+
+def expire_purchase_cycles(client_id, today=None):
+    """
+    Rebuilds the states whose first order has left the lookback window
+    (nightly; until then the predictor reads those pairs from the history).
+    Returns the number of pairs rebuilt.
+    """
+    today = today or timezone.now().date()
+    expired = PurchaseCycleState.objects.filter(client_id=client_id, first_order_date__lt=window_start(today))
+    pairs = list(expired.values_list('pharmacy_id', 'product_id'))
+    for pharmacy_id, product_id in pairs:
+        rebuild_pair(client_id, pharmacy_id, product_id, today)
+    return len(pairs)
+
+
+def cycle_states(df):
+    """
+    PurchaseCycleState columns for every (pharmacy, product) pair of a
+    pharmacy_id / product_id / date frame, from the vectorised gap-analysis kernel.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=STATE_COLUMNS)
+
+    pair_codes, pairs = pd.MultiIndex.from_arrays([df['pharmacy_id'], df['product_id']]).factorize()
+    result = gap_analysis(pair_codes, to_epoch_days(df['date']), 0)
+
+    epoch = np.datetime64('1970-01-01', 'D')
+    groups = pairs[result['group']]
+    return pd.DataFrame({
+        'pharmacy_id': groups.get_level_values(0),
+        'product_id': groups.get_level_values(1),
+        'first_order_date': (epoch + result['first']).astype(object),
+        'last_order_date': (epoch + result['last']).astype(object),
+        'unique_order_days': result['events'],
+        'gap_sum': result['last'] - result['first'],
+        'gap_sumsq': np.round(result['gap_sumsq']).astype(np.int64),
+    }, columns=STATE_COLUMNS)
+
+
+def rebuild_purchase_cycles(client_id, pharmacy_ids=None, batch_size=2000):
+    """
+    Full rebuild of the tenant's states (backfill / repair) from one streamed query
+    over the lookback window, with the vectorised gap-analysis kernel.
+    """
+    today = timezone.now().date()
+    lines = SalesLine.objects.filter(
+        document__client_id=client_id,
+        document__status='COMPLETED',
+        document__date__date__gte=window_start(today),
+        document__date__date__lte=today,
+    )
+    if pharmacy_ids is not None:
+        lines = lines.filter(document__pharmacy_id__in=pharmacy_ids)
+    rows = lines.values_list('document__pharmacy_id', 'product_id', 'document__date__date').order_by()
+    df = pd.DataFrame.from_records(rows.iterator(chunk_size=10000), columns=['pharmacy_id', 'product_id', 'date'])
+
+    existing = PurchaseCycleState.objects.filter(client_id=client_id)
+    if pharmacy_ids is not None:
+        existing = existing.filter(pharmacy_id__in=pharmacy_ids)
+
+    if df.empty:
+        existing.delete()
+        return 0
+
+    states = [
+        PurchaseCycleState(
+            client_id=client_id,
+            pharmacy_id=pharmacy_id,
+            product_id=product_id,
+            first_order_date=first_order,
+            last_order_date=last_order,
+            unique_order_days=int(events),
+            gap_sum=int(gap_sum),
+            gap_sumsq=int(gap_sumsq),
+        )
+        for pharmacy_id, product_id, first_order, last_order, events, gap_sum, gap_sumsq
+        in cycle_states(df).itertuples(index=False)
+    ]
+
+    with transaction.atomic():
+        existing.delete()
+        PurchaseCycleState.objects.bulk_create(states, batch_size=batch_size)
+    return len(states)
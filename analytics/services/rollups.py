@@ -0,0 +1,125 @@
+import weakref
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.functions import TruncDate
+
+from analytics.models import SalesDocument, SalesDailyRollup
+from analytics.services.hll import HyperLogLog
+
+
+def refresh_daily_rollups(client_id, date_from, date_to=None):
+    """
+    Recomputes the day x zone rollups of a tenant for [date_from, date_to]
+    from SalesDocument. Days are rebuilt whole, so the call is idempotent.
+    """
+    date_to = date_to or date_from
+
+    docs = (
+        SalesDocument.objects
+        .filter(client_id=client_id, date__date__gte=date_from, date__date__lte=date_to)
+        .annotate(day=TruncDate('date'))
+        .values_list('day', 'pharmacy__territory__zone_id', 'pharmacy_id', 'total_amount')
+        .order_by()
+    )
+
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    pharmacies = defaultdict(set)
+    for day, zone_id, pharmacy_id, amount in docs.iterator(chunk_size=5000):
+        key = (day, zone_id)
+        totals[key][0] += 1
+        totals[key][1] += amount or 0
+        pharmacies[key].add(pharmacy_id)
+
+    rows = [
+        SalesDailyRollup(
+            client_id=client_id,
+            date=day,
+            zone_id=zone_id,
+            doc_count=doc_count,
+            total_amount=amount,
+            pharmacy_sketch=HyperLogLog().update(pharmacies[(day, zone_id)]).to_bytes(),
+        )
+        for (day, zone_id), (doc_count, amount) in totals.items()
+    ]
+
+    with transaction.atomic():
+        SalesDailyRollup.objects.filter(
+            client_id=client_id, date__gte=date_from, date__lte=date_to
+        ).delete()
+        SalesDailyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+class _PendingRefresh:
+    """(client, day) pairs whose rollups a transaction touched; refreshed once, on commit."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.days = set()
+
+    def __call__(self):
+        self.connection._pending_rollup_refresh = None
+        for client_id, day in sorted(self.days):
+            refresh_daily_rollups(client_id, day)
+
+
+def schedule_rollup_refresh(client_id, *days):
+    """
+    Queues a rollup refresh of the given days after the current transaction
+    commits (at once in autocommit). All the days queued during one transaction
+    share a single on_commit callback, so a document import refreshes each
+    (client, day) once instead of once per document.
+    """
+    connection = transaction.get_connection()
+    # The connection only keeps a weak reference: the on_commit queue owns the batch,
+    # so a rollback that discards the callback also ends the batch
+    ref = getattr(connection, '_pending_rollup_refresh', None)
+    pending = ref() if ref is not None else None
+    if pending is not None:
+        pending.days.update((client_id, day) for day in days)
+        return
+    pending = _PendingRefresh(connection)
+    pending.days.update((client_id, day) for day in days)
+    connection._pending_rollup_refresh = weakref.ref(pending)
+    transaction.on_commit(pending)
+
+
+def rebuild_all_rollups(client_id, chunk_days=31):
+    """Backfills every day with sales, one month-sized window at a time."""
+    bounds = SalesDocument.objects.filter(client_id=client_id).order_by('date').values_list('date', flat=True)
+    first, last = bounds.first(), bounds.last()
+    if not first:
+        SalesDailyRollup.objects.filter(client_id=client_id).delete()
+        return 0
+
+    written = 0
+    start = first.date()
+    while start <= last.date():
+        end = min(start + timedelta(days=chunk_days - 1), last.date())
+        written += refresh_daily_rollups(client_id, start, end)
+        start = end + timedelta(days=1)
+    return written
+
+
+def has_rollups(client_id):
+    return SalesDailyRollup.objects.filter(client_id=client_id).exists()
+
+
+def approx_distinct_pharmacies(client_id, date_from=None, date_to=None, zone_ids=None):
+    """
+    Approximate number of distinct buying pharmacies (~1.6% error) for any
+    date range / zone selection, by merging the HyperLogLog sketches of the rollups.
+    """
+    rows = SalesDailyRollup.objects.filter(client_id=client_id)
+    if date_from:
+        rows = rows.filter(date__gte=date_from)
+    if date_to:
+        rows = rows.filter(date__lte=date_to)
+    if zone_ids:
+        rows = rows.filter(zone_id__in=zone_ids)
+
+    sketches = rows.values_list('pharmacy_sketch', flat=True).iterator(chunk_size=2000)
+    return HyperLogLog.merged(sketches).count()
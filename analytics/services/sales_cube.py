@@ -0,0 +1,269 @@
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum, Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from analytics.models import SalesLine
+
+# Base dimensions stored in the cube, with the SalesLine path they come from
+DIMENSIONS = {
+    'month': 'month',
+    'region': 'document__pharmacy__territory__zone__region__name',
+    'zone': 'document__pharmacy__territory__zone__name',
+    'territory': 'document__pharmacy__territory__name',
+    'category': 'product__category__name',
+    'brand': 'product__brand__name',
+    'source': 'document__order_source',
+    'channel': 'document__channel',
+}
+
+# Levels derived from a base dimension (level -> (base dimension, label function))
+DERIVED_LEVELS = {
+    'quarter': ('month', lambda m: f"{m[:4]}-Q{(int(m[5:7]) - 1) // 3 + 1}"),
+    'year': ('month', lambda m: m[:4]),
+}
+
+# Drill paths, coarsest level first
+HIERARCHIES = {
+    'time': ('year', 'quarter', 'month'),
+    'geo': ('region', 'zone', 'territory'),
+    'product': ('category', 'brand'),
+}
+
+# Additive measures only, so any roll-up is a plain sum of cells
+MEASURES = ('units', 'amount', 'lines')
+
+EMPTY_LABEL = 'Sin Dato'
+
+
+def cube_path(client_id):
+    return os.path.join(settings.ANALYTICS_DATA_DIR, 'cubes', f'sales_{client_id}.npz')
+
+
+class SalesCube:
+    """
+    Pre-aggregated sales cube (month x geography x product x source x channel).
+    Stored column-wise: one integer code array per dimension plus a label table,
+    and one array per measure. Roll-ups are answered in memory with NumPy.
+    """
+
+    _loaded = {}
+    _lock = threading.Lock()
+
+    def __init__(self, codes, labels, measures, built_at=None):
+        self.codes = codes        # {dim: np.ndarray[int32]} one entry per cell
+        self.labels = labels      # {dim: np.ndarray[str]} code -> label
+        self.measures = measures  # {measure: np.ndarray} one entry per cell
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.measures['units'])
+
+    # ------------------------------------------------------------------
+    # Build / persistence
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def build(cls, client_id):
+        """Computes every cell with a single GROUP BY over SalesLine."""
+        rows = (
+            SalesLine.objects
+            .filter(document__client_id=client_id)
+            .annotate(month=TruncMonth('document__date'))
+            .values(*DIMENSIONS.values())
+            .annotate(units=Sum('quantity'), amount=Sum('total_price'), lines=Count('id'))
+            .order_by()
+        )
+
+        columns = {dim: [] for dim in DIMENSIONS}
+        values = {measure: [] for measure in MEASURES}
+        for row in rows.iterator(chunk_size=5000):
+            for dim, path in DIMENSIONS.items():
+                label = row[path]
+                if dim == 'month':
+                    label = label.strftime('%Y-%m') if label else None
+                columns[dim].append(label or EMPTY_LABEL)
+            for measure in MEASURES:
+                values[measure].append(row[measure] or 0)
+
+        codes, labels = {}, {}
+        for dim, column in columns.items():
+            dim_labels, dim_codes = np.unique(np.array(column, dtype=str), return_inverse=True)
+            codes[dim] = dim_codes.astype(np.int32)
+            labels[dim] = dim_labels
+
+        measures = {
+            'units': np.array(values['units'], dtype=np.int64),
+            'amount': np.array(values['amount'], dtype=np.float64),
+            'lines': np.array(values['lines'], dtype=np.int64),
+        }
+        return cls(codes, labels, measures, built_at=timezone.now())
+
+    def save(self, client_id):
+        path = cube_path(client_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {'built_at': np.array(self.built_at.isoformat())}
+        for dim in DIMENSIONS:
+            arrays[f'codes__{dim}'] = self.codes[dim]
+            arrays[f'labels__{dim}'] = self.labels[dim]
+        for measure in MEASURES:
+            arrays[f'measure__{measure}'] = self.measures[measure]
+
+        # Write to a temp file and swap it in so readers never see a partial cube
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._loaded.pop(client_id, None)
+
+    @classmethod
+    def load(cls, client_id, build_missing=True):
+        """
+        Returns the tenant cube, memoised per process and reloaded when the file
+        on disk changes. Builds it on first use if it does not exist yet.
+        """
+        path = cube_path(client_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            if not build_missing:
+                return None
+            cube = cls.build(client_id)
+            cube.save(client_id)
+            mtime = os.path.getmtime(path)
+            with cls._lock:
+                cls._loaded[client_id] = (mtime, cube)
+            return cube
+
+        with cls._lock:
+            cached = cls._loaded.get(client_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with np.load(path) as data:
+            codes = {dim: data[f'codes__{dim}'] for dim in DIMENSIONS}
+            labels = {dim: data[f'labels__{dim}'] for dim in DIMENSIONS}
+            measures = {m: data[f'measure__{m}'] for m in MEASURES}
+            built_at = str(data['built_at'])
+        cube = cls(codes, labels, measures, built_at=built_at)
+        with cls._lock:
+            cls._loaded[client_id] = (mtime, cube)
+        return cube
+
+    # ------------------------------------------------------------------
+    # Query API
+    # ------------------------------------------------------------------
+
+    def level_codes(self, level):
+        """Per-cell codes and the label table for a base dimension or derived level."""
+        if level in DIMENSIONS:
+            return self.codes[level], self.labels[level]
+        if level not in DERIVED_LEVELS:
+            raise ValueError(f"Unknown dimension: {level}")
+
+        base, to_label = DERIVED_LEVELS[level]
+        derived = np.array([to_label(label) for label in self.labels[base]], dtype=str)
+        level_labels, base_to_level = np.unique(derived, return_inverse=True)
+        return base_to_level[self.codes[base]].astype(np.int32), level_labels
+
+    def dice(self, **filters):
+        """
+        Sub-cube with the given filters, e.g. dice(zone=['CABA', 'GBA'], year='2025').
+        A filter value may be a label, a list of labels, or a (from, to) range
+        given as a dict {'from': ..., 'to': ...} (inclusive, compared on labels).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for level, wanted in filters.items():
+            if wanted is None or wanted == []:
+                continue
+            level_codes, level_labels = self.level_codes(level)
+            if isinstance(wanted, dict):
+                selected = np.ones(len(level_labels), dtype=bool)
+                if wanted.get('from'):
+                    selected &= level_labels >= wanted['from']
+                if wanted.get('to'):
+                    selected &= level_labels <= wanted['to']
+            else:
+                if isinstance(wanted, str):
+                    wanted = [wanted]
+                selected = np.isin(level_labels, list(wanted))
+            mask &= selected[level_codes]
+
+        return SalesCube(
+            {dim: codes[mask] for dim, codes in self.codes.items()},
+            self.labels,
+            {measure: values[mask] for measure, values in self.measures.items()},
+            built_at=self.built_at,
+        )
+
+    def slice(self, level, label):
+        """Sub-cube fixed on one member of one dimension."""
+        return self.dice(**{level: [label]})
+
+    def rollup(self, by=(), measures=MEASURES, order_by=None):
+        """
+        Aggregates the cube to the given levels.
+        Returns a list of dicts {level: label, ..., measure: total, ...}.
+        """
+        by = list(by)
+        if not by:
+            return [{measure: self._to_python(self.measures[measure].sum(), measure) for measure in measures}]
+
+        # Mixed-radix key over the group-by codes, then one bincount per measure
+        keys = np.zeros(len(self), dtype=np.int64)
+        level_labels = []
+        for level in by:
+            codes, labels = self.level_codes(level)
+            keys = keys * len(labels) + codes
+            level_labels.append(labels)
+
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        totals = {
+            measure: np.bincount(inverse, weights=self.measures[measure], minlength=len(unique_keys))
+            for measure in measures
+        }
+
+        # Decode the group keys back into per-level codes
+        decoded = []
+        remainder = unique_keys
+        for labels in reversed(level_labels):
+            decoded.append(remainder % len(labels))
+            remainder = remainder // len(labels)
+        decoded.reverse()
+
+        result = []
+        for i in range(len(unique_keys)):
+            row = {level: str(level_labels[j][decoded[j][i]]) for j, level in enumerate(by)}
+            for measure in measures:
+                row[measure] = self._to_python(totals[measure][i], measure)
+            result.append(row)
+
+        if order_by:
+            reverse = order_by.startswith('-')
+            key = order_by.lstrip('-')
+            result.sort(key=lambda r: r[key], reverse=reverse)
+        return result
+
+    def drill(self, hierarchy, path=(), **filters):
+        """
+        Drill-down along a hierarchy: with path=('Buenos Aires',) on 'geo'
+        returns the zones of that region; with an empty path, the regions.
+        """
+        levels = HIERARCHIES[hierarchy]
+        path = list(path)
+        if len(path) >= len(levels):
+            raise ValueError(f"'{hierarchy}' has only {len(levels)} levels")
+
+        for level, label in zip(levels, path):
+            filters[level] = [label]
+        return self.dice(**filters).rollup(by=[levels[len(path)]])
+
+    @staticmethod
+    def _to_python(value, measure=None):
+        if measure == 'amount':
+            return round(float(value), 2)
+        return int(round(float(value)))
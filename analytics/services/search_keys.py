@@ -0,0 +1,19 @@
+import re
+import unicodedata
+
+_NON_ALNUM = re.compile(r'[^0-9A-Z]+')
+
+
+def normalize(text):
+    """Accent-folded, upper-cased, punctuation collapsed to single spaces: 'Farmacia Peña S.A.' -> 'FARMACIA PENA S A'."""
+    folded = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+    return _NON_ALNUM.sub(' ', folded.upper()).strip()
+
+
+def pharmacy_search_key(code, display_name, name_trade, city):
+    """Searchable text of a pharmacy; the trade name is dropped when it repeats the display name."""
+    parts = [code, display_name]
+    if normalize(name_trade) != normalize(display_name):
+        parts.append(name_trade)
+    parts.append(city)
+    return normalize(' '.join(p for p in parts if p))
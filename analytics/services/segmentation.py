@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from analytics.models import Pharmacy, SalesDocument, SegmentationState
+from analytics.services.dashboard_cache import bump_data_version
+
+# ABC cut-offs on the cumulative share of revenue (A: first 80%, B: next 15%, C: rest)
+ABC_CUTS = (0.80, 0.95)
+# Recency / frequency / monetary are scored 1-5 by quintile
+RFM_BINS = 5
+# Documents updated this long before the last run are looked at again (late commits);
+# re-aggregating a pharmacy is idempotent, so the overlap only costs time
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+
+def rfm_features(client_id, pharmacy_ids=None, window_days=365, as_of=None):
+    """Last order date, order count and revenue per pharmacy over the window (one GROUP BY)."""
+    as_of = as_of or timezone.now().date()
+    docs = SalesDocument.objects.filter(
+        client_id=client_id,
+        status='COMPLETED',
+        date__date__gt=as_of - timedelta(days=window_days),
+        date__date__lte=as_of,
+    )
+    if pharmacy_ids is not None:
+        docs = docs.filter(pharmacy_id__in=pharmacy_ids)
+    rows = docs.values('pharmacy_id').annotate(
+        last_order=Max('date'), frequency=Count('id'), monetary=Sum('total_amount')
+    ).order_by()
+    return {
+        row['pharmacy_id']: {
+            'last_order': timezone.localtime(row['last_order']).date().isoformat(),
+            'frequency': row['frequency'],
+            'monetary': float(row['monetary'] or 0),
+        }
+        for row in rows
+    }
+
+
+def _quintile_scores(values, higher_is_better=True):
+    """1-5 score per value by percentile rank (ties share a score)."""
+    ranks = pd.Series(values).rank(method='average', pct=True, ascending=higher_is_better).to_numpy()
+    return np.clip(np.ceil(ranks * RFM_BINS), 1, RFM_BINS).astype(int)
+
+
+def assign_segments(features, as_of):
+    """
+    Vectorised RFM scores and ABC class for every pharmacy of a tenant.
+    features: DataFrame indexed by pharmacy id with last_order / frequency / monetary.
+    """
+    monetary = features['monetary'].to_numpy(dtype=float)
+    frequency = features['frequency'].to_numpy(dtype=float)
+    last_order = pd.to_datetime(features['last_order'], errors='coerce')
+    recency = (pd.Timestamp(as_of) - last_order).dt.days.to_numpy(dtype=float)
+    recency = np.where(np.isnan(recency), np.inf, recency)
+
+    # ABC: pharmacies sorted by revenue, classed by cumulative share
+    order = np.argsort(-monetary, kind='stable')
+    total = monetary.sum()
+    share_before = np.empty(len(monetary))
+    share_before[order] = (np.cumsum(monetary[order]) - monetary[order]) / total if total > 0 else 1.0
+    abc = np.where(share_before < ABC_CUTS[0], 'A', np.where(share_before < ABC_CUTS[1], 'B', 'C'))
+    abc = np.where(monetary > 0, abc, 'C')
+
+    r = _quintile_scores(recency, higher_is_better=False)
+    f = _quintile_scores(frequency)
+    m = _quintile_scores(monetary)
+    return pd.DataFrame({
+        'cluster': abc,
+        'rfm_score': [f"{a}{b}{c}" for a, b, c in zip(r, f, m)],
+    }, index=features.index)
+
+
+def segment_pharmacies(client_id, full=False, window_days=365, as_of=None, batch_size=500):
+    """
+    Recomputes segment_data['cluster'] (ABC) and segment_data['rfm'] of a tenant.
+    Incremental by default: sales are re-aggregated only for pharmacies with
+    documents created or updated (e.g. completed) since the last run, per the
+    SegmentationState watermark; scoring then runs over the stored features of
+    every pharmacy, and only rows whose segment changed are written.
+    `full=True` re-aggregates every pharmacy (lets old sales age out of the
+    window, and catches deleted documents). Returns the number of pharmacies updated.
+    """
+    started = timezone.now()
+    as_of = as_of or started.date()
+    state = None if full else SegmentationState.objects.filter(client_id=client_id).first()
+
+    changed_ids = None
+    if state is not None:
+        changed_ids = set(
+            SalesDocument.objects.filter(client_id=client_id, updated_at__gte=state.watermark - WATERMARK_OVERLAP)
+            .values_list('pharmacy_id', flat=True).distinct().order_by()
+        )
+    fresh = rfm_features(client_id, changed_ids, window_days, as_of) if changed_ids != set() else {}
+
+    pharmacies = list(Pharmacy.objects.filter(client_id=client_id).only('id', 'segment_data'))
+    if not pharmacies:
+        return 0
+
+    # Stored features for the untouched pharmacies, fresh ones for the rest
+    empty = {'last_order': None, 'frequency': 0, 'monetary': 0.0}
+    rows = []
+    for pharmacy in pharmacies:
+        if changed_ids is None or pharmacy.id in changed_ids:
+            rows.append(fresh.get(pharmacy.id, empty))
+        else:
+            stored = (pharmacy.segment_data or {}).get('rfm') or {}
+            rows.append({key: stored.get(key, default) for key, default in empty.items()})
+    features = pd.DataFrame(rows, index=[p.id for p in pharmacies])
+    segments = assign_segments(features, as_of)
+
+    to_update = []
+    for pharmacy, feature, segment in zip(pharmacies, features.itertuples(), segments.itertuples()):
+        data = dict(pharmacy.segment_data or {})
+        data['cluster'] = segment.cluster
+        data['rfm'] = {
+            'last_order': feature.last_order if pd.notna(feature.last_order) else None,  # NaN is not JSON
+            'frequency': int(feature.frequency),
+            'monetary': round(float(feature.monetary), 2),
+            'score': segment.rfm_score,
+        }
+        if data != pharmacy.segment_data:
+            pharmacy.segment_data = data
+            to_update.append(pharmacy)
+
+    with transaction.atomic():
+        Pharmacy.objects.bulk_update(to_update, ['segment_data'], batch_size=batch_size)
+        SegmentationState.objects.update_or_create(client_id=client_id, defaults={'watermark': started})
+    if to_update:
+        bump_data_version(client_id)
+    return len(to_update)
@@ -0,0 +1,18 @@
+from analytics.models import Client
+
+
+def get_request_client(request):
+    """
+    Resolves the tenant (Client) for the current user.
+    Reps belong to a Client; staff without a rep profile fall back to the first Client.
+    """
+    client = None
+    if hasattr(request.user, 'rep_profile'):
+        rep = request.user.rep_profile.select_related('client').first()
+        if rep:
+            client = rep.client
+
+    if not client:
+        client = Client.objects.first()
+
+    return client
@@ -0,0 +1,124 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Pharmacy, SalesDocument, SalesLine
+from .services.dashboard_cache import bump_data_version
+from .services.geo import invalidate_locator
+from .services.pharmacy_search import create_search_index, index_pharmacy, unindex_pharmacy
+from .services.purchase_cycles import rebuild_pairs, record_document, record_purchase
+from .services.rollups import schedule_rollup_refresh
+from surveys.models import Visit, StockoutObservation
+
+
+@receiver([post_save, post_delete], sender=SalesDocument)
+@receiver([post_save, post_delete], sender=Visit)
+def invalidate_dashboards_for_client(sender, instance, **kwargs):
+    bump_data_version(instance.client_id)
+
+
+# Child rows only listen to saves: deletes cascade from their parent, which already
+# bumps the version, and a post_delete receiver would disable fast cascade deletes.
+@receiver(post_save, sender=SalesLine)
+def invalidate_dashboards_for_line(sender, instance, **kwargs):
+    bump_data_version(instance.document.client_id)
+
+
+@receiver(post_save, sender=StockoutObservation)
+def invalidate_dashboards_for_stockout(sender, instance, **kwargs):
+    bump_data_version(instance.visit.client_id)
+
+
+@receiver([post_save, post_delete], sender=SalesDocument)
+def refresh_rollups_for_document(sender, instance, **kwargs):
+    days = {timezone.localtime(instance.date).date()}
+    previous = getattr(instance, '_previous_state', None)
+    if previous is not None:
+        days.add(timezone.localtime(previous['date']).date())  # moved documents leave their old day too
+    schedule_rollup_refresh(instance.client_id, *days)
+
+
+@receiver(pre_save, sender=SalesDocument)
+def remember_document_state(sender, instance, raw=False, **kwargs):
+    """Stashes the stored status / date / pharmacy so post_save receivers can see what changed."""
+    previous = None
+    if instance.pk is not None and not raw:
+        previous = (
+            SalesDocument.objects.filter(pk=instance.pk)
+            .values('status', 'date', 'pharmacy_id')
+            .first()
+        )
+    instance._previous_state = previous
+
+
+@receiver(post_save, sender=SalesLine)
+def update_purchase_cycle(sender, instance, created, **kwargs):
+    document = instance.document
+    if not created or document.status != 'COMPLETED':
+        return
+    args = (document.client_id, document.pharmacy_id, instance.product_id, timezone.localtime(document.date).date())
+    transaction.on_commit(lambda: record_purchase(*args))
+
+
+@receiver(post_save, sender=SalesDocument)
+def update_purchase_cycles_for_document(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_state', None)
+    if created or previous is None:
+        return  # new documents are folded in line by line
+    was_completed = previous['status'] == 'COMPLETED'
+    is_completed = instance.status == 'COMPLETED'
+    if not (was_completed or is_completed):
+        return
+    moved = previous['date'] != instance.date or previous['pharmacy_id'] != instance.pharmacy_id
+    if is_completed and not was_completed and not moved:
+        document = instance
+        transaction.on_commit(lambda: record_document(document))
+    elif moved or was_completed != is_completed:
+        # Leaving COMPLETED or moving removes purchase days: only a rebuild can take them out
+        client_id = instance.client_id
+        pharmacy_ids = {previous['pharmacy_id'], instance.pharmacy_id}
+        product_ids = set(instance.lines.values_list('product_id', flat=True))
+        transaction.on_commit(lambda: rebuild_pairs(client_id, pharmacy_ids, product_ids))
+
+
+# pre_delete: the lines are still there (and SalesLine keeps fast cascade deletes)
+@receiver(pre_delete, sender=SalesDocument)
+def update_purchase_cycles_for_deleted_document(sender, instance, **kwargs):
+    if instance.status != 'COMPLETED':
+        return
+    client_id, pharmacy_ids = instance.client_id, {instance.pharmacy_id}
+    product_ids = set(instance.lines.values_list('product_id', flat=True))
+    if product_ids:
+        transaction.on_commit(lambda: rebuild_pairs(client_id, pharmacy_ids, product_ids))
+
+
+@receiver(post_save, sender=Pharmacy)
+def index_pharmacy_search_key(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'search_key' in update_fields:
+        index_pharmacy(instance)
+
+
+@receiver(post_delete, sender=Pharmacy)
+def unindex_pharmacy_search_key(sender, instance, **kwargs):
+    unindex_pharmacy(instance.pk)
+
+
+# Databases built without migrations (tests) never run 0014; IF NOT EXISTS makes this a no-op elsewhere
+@receiver(post_migrate)
+def ensure_pharmacy_search_index(sender, using, **kwargs):
+    if sender.name == 'analytics':
+        with connections[using].schema_editor() as schema_editor:
+            create_search_index(schema_editor)
+
+
+# Fields the nearby-pharmacies KD-tree is built from
+LOCATOR_FIELDS = {'latitude', 'longitude', 'is_active'}
+
+
+@receiver(post_save, sender=Pharmacy)
+@receiver(post_delete, sender=Pharmacy)
+def invalidate_pharmacy_locator(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or LOCATOR_FIELDS & set(update_fields):
+        client_id = instance.client_id
+        transaction.on_commit(lambda: invalidate_locator(client_id))
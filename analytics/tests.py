@@ -1,3 +1,699 @@
-from django.test import TestCase
+import datetime
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics.models import (
+    AnomalyAlert, AnomalyState, Client, Pharmacy, Product, Rep, Territory, Zone, PurchaseCycleState, ReorderSuggestion, SalesDailyRollup, SalesDocument, SalesLine,
+    SegmentationState, ProductBrand, ProductCategory, Region,
+)
+from analytics.services.anomalies import Z_THRESHOLD, AnomalyDetector, welford
+from analytics.services.prediction import BatchReorderPredictor, ReorderPredictor
+from analytics.services import backtesting, dashboard_cache, generations, rollups, segmentation
+from analytics.services.market_basket import BasketIndex
+from analytics.services.pharmacy_search import FTS_TABLE, rebuild_search_keys, search_pharmacies, search_rowid
+from analytics.services.purchase_cycles import expire_purchase_cycles, rebuild_purchase_cycles
+from analytics.services.sales_cube import SalesCube
+from analytics.services.segmentation import segment_pharmacies
+from surveys.services.pharmacy_context import build_pharmacy_context
+
+# Every cache alias in memory: tests must not read or leave entries in analytics_data/
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+    for alias in ('default', 'dashboard', 'shared')
+}
+
+
+class SalesFixtures:
+    """Tenant, pharmacy, product and sales builders shared by the analytics tests."""
+
+    @classmethod
+    def make_tenant(cls, code='acme'):
+        client = Client.objects.create(name=code.title(), code=code)
+        pharmacy = cls.make_pharmacy(client, 'PH-1')
+        return client, pharmacy
+
+    @classmethod
+    def make_pharmacy(cls, client, code, **fields):
+        fields = {'name_legal': f'{code} SA', 'name_trade': code, 'display_name': code,
+                  'address': 'Calle 1', 'city': 'CABA', **fields}
+        return Pharmacy.objects.create(client=client, code=code, **fields)
+
+    @classmethod
+    def make_products(cls, client, *skus):
+        return [Product.objects.create(client=client, sku=sku, name=f'Producto {sku}') for sku in skus]
+
+    def sell(self, pharmacy, days_ago, products, status='COMPLETED'):
+        """One sales document of `products`, dated `days_ago` days before now; on_commit hooks run."""
+        with self.captureOnCommitCallbacks(execute=True):
+            document = SalesDocument.objects.create(
+                client=pharmacy.client, pharmacy=pharmacy, external_id=f'T-{pharmacy.code}-{days_ago}-{status}',
+                date=timezone.now() - datetime.timedelta(days=days_ago), status=status,
+            )
+            for product in products:
+                SalesLine.objects.create(document=document, product=product, quantity=1, total_price=10)
+        return document
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PurchaseCycleStateTests(SalesFixtures, TestCase):
+    """The state-backed ReorderPredictor must agree with the raw-history scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        cls.steady, cls.frequent, cls.slow = cls.make_products(cls.client_obj, 'STEADY', 'FREQUENT', 'SLOW')
+
+    def setUp(self):
+        # STEADY: every 20 days, last order 30 days ago -> due
+        for days_ago in (90, 70, 50, 30):
+            self.sell(self.pharmacy, days_ago, [self.steady])
+        # FREQUENT: every 10 days, last order 5 days ago -> not due yet
+        for days_ago in (45, 35, 25, 15, 5):
+            self.sell(self.pharmacy, days_ago, [self.frequent])
+        # SLOW: the 190-day order is outside the lookback window and must not count
+        for days_ago in (190, 160, 120, 80):
+            self.sell(self.pharmacy, days_ago, [self.slow])
+
+    def suggestions(self):
+        predictor = ReorderPredictor(self.pharmacy.id)
+        return predictor.get_suggestions(), predictor.get_suggestions_from_history()
+
+    def assertStateAgrees(self):
+        from_state, from_history = self.suggestions()
+        self.assertEqual(from_state, from_history)
+        return from_state
+
+    def test_incremental_state_matches_history(self):
+        suggestions = self.assertStateAgrees()
+        self.assertEqual({s['product_id'] for s in suggestions}, {str(self.steady.id), str(self.slow.id)})
+        slow = PurchaseCycleState.objects.get(pharmacy=self.pharmacy, product=self.slow)
+        self.assertEqual((slow.unique_order_days, slow.gap_sum), (3, 80))
+
+    def test_backtest_replays_the_state_predictor(self):
+        today = timezone.localdate()
+        history = backtesting.load_history(self.client_obj.id, today - datetime.timedelta(days=365), today)
+        past = history[history['date'] >= pd.Timestamp(today - datetime.timedelta(days=180))]
+        replayed = backtesting.state_suggestions(backtesting.replay_states(history, today), past, today)
+        live = ReorderPredictor(self.pharmacy.id).due_products(today)
+        self.assertEqual(list(replayed['product_id']), [s['product_id'] for s in live])
+
+    def test_full_rebuild_matches_incremental_state(self):
+        fields = ('product_id', 'first_order_date', 'last_order_date', 'unique_order_days', 'gap_sum', 'gap_sumsq')
+        incremental = set(PurchaseCycleState.objects.values_list(*fields))
+        self.assertEqual(rebuild_purchase_cycles(self.client_obj.id), 3)
+        self.assertEqual(set(PurchaseCycleState.objects.values_list(*fields)), incremental)
+        self.assertStateAgrees()
+
+    def test_cancelling_and_restoring_a_document(self):
+        last = SalesDocument.objects.get(external_id=f'T-{self.pharmacy.code}-30-COMPLETED')
+        last.status = 'CANCELLED'
+        with self.captureOnCommitCallbacks(execute=True):
+            last.save()
+        suggestions = self.assertStateAgrees()
+        # STEADY now last ordered 50 days ago, 2.5 cycles: still due, but less urgent than before
+        self.assertEqual(PurchaseCycleState.objects.get(product=self.steady).last_order_date,
+                         (timezone.now() - datetime.timedelta(days=50)).date())
+
+        last.status = 'COMPLETED'
+        with self.captureOnCommitCallbacks(execute=True):
+            last.save()
+        self.assertNotEqual(self.assertStateAgrees(), suggestions)
+
+    def test_pending_document_completed_later(self):
+        document = self.sell(self.pharmacy, 10, [self.steady], status='PENDING')
+        self.assertStateAgrees()
+        document.status = 'COMPLETED'
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+        suggestions = self.assertStateAgrees()
+        self.assertNotIn(str(self.steady.id), {s['product_id'] for s in suggestions})
+
+    def test_moving_a_document_to_another_day_and_pharmacy(self):
+        other = self.make_pharmacy(self.client_obj, 'PH-2')
+        document = SalesDocument.objects.get(external_id=f'T-{self.pharmacy.code}-80-COMPLETED')
+        document.date -= datetime.timedelta(days=15)
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+        self.assertStateAgrees()
+
+        document.pharmacy = other
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+        self.assertStateAgrees()
+        self.assertTrue(PurchaseCycleState.objects.filter(pharmacy=other, product=self.slow).exists())
+
+    def test_deleting_a_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SalesDocument.objects.get(external_id=f'T-{self.pharmacy.code}-30-COMPLETED').delete()
+        self.assertStateAgrees()
+
+    def test_orders_aging_out_of_the_window(self):
+        later = timezone.now() + datetime.timedelta(days=35)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            # SLOW's 160-day order is now 195 days old, but its state still starts there
+            self.assertStateAgrees()
+            self.assertEqual(expire_purchase_cycles(self.client_obj.id), 1)
+            self.assertEqual(PurchaseCycleState.objects.get(product=self.slow).unique_order_days, 2)
+            self.assertStateAgrees()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RollupRefreshTests(SalesFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+
+    def document(self, days_ago, number):
+        return SalesDocument.objects.create(
+            client=self.client_obj, pharmacy=self.pharmacy, external_id=f'T-{days_ago}-{number}',
+            date=timezone.now() - datetime.timedelta(days=days_ago), total_amount=10,
+        )
+
+    def doc_counts(self):
+        return dict(SalesDailyRollup.objects.filter(client=self.client_obj).values_list('date', 'doc_count'))
+
+    def day(self, days_ago):
+        return (timezone.now() - datetime.timedelta(days=days_ago)).date()
+
+    def test_one_refresh_per_day_per_transaction(self):
+        with mock.patch.object(rollups, 'refresh_daily_rollups', wraps=rollups.refresh_daily_rollups) as refresh:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                for number in range(5):
+                    self.document(1, number)
+                for number in range(3):
+                    self.document(2, number)
+        self.assertEqual(len([c for c in callbacks if isinstance(c, rollups._PendingRefresh)]), 1)
+        self.assertEqual(refresh.call_count, 2)
+        self.assertEqual(self.doc_counts(), {self.day(1): 5, self.day(2): 3})
+
+    def test_moved_document_refreshes_old_and_new_day(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            document = self.document(1, 0)
+        self.assertEqual(self.doc_counts(), {self.day(1): 1})
+
+        document.date -= datetime.timedelta(days=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+        self.assertEqual(self.doc_counts(), {self.day(4): 1})
+
+    def test_rolled_back_batch_does_not_swallow_later_refreshes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.document(1, 0)
+                raise RuntimeError
+            self.document(2, 0)
+        self.assertEqual(self.doc_counts(), {self.day(2): 1})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReorderSuggestionTests(SalesFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        cls.products = cls.make_products(cls.client_obj, 'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7')
+
+    def setUp(self):
+        # Identical histories: every product is due with the same urgency
+        for days_ago in (70, 50, 30):
+            self.sell(self.pharmacy, days_ago, self.products)
+
+    def test_batch_ties_are_broken_by_product(self):
+        BatchReorderPredictor(self.client_obj.id).save()
+        stored = list(ReorderSuggestion.objects.order_by('rank').values_list('product_id', flat=True))
+        self.assertEqual(stored, sorted(p.id for p in self.products)[:5])
+
+        BatchReorderPredictor(self.client_obj.id).precompute()
+        self.assertEqual(list(ReorderSuggestion.objects.order_by('rank').values_list('product_id', flat=True)), stored)
+
+    def test_stored_suggestions_match_live_ones(self):
+        BatchReorderPredictor(self.client_obj.id).save()
+        predictor = ReorderPredictor(self.pharmacy.id)
+        self.assertEqual(predictor.get_stored_suggestions(), predictor.get_suggestions_from_history())
+
+    def test_stored_suggestions_honour_top_k(self):
+        BatchReorderPredictor(self.client_obj.id, TOP_K=7).save()
+        self.assertEqual(len(ReorderPredictor(self.pharmacy.id).get_stored_suggestions()), 5)
+        self.assertEqual(len(ReorderPredictor(self.pharmacy.id, TOP_K=3).get_stored_suggestions()), 3)
+
+    def test_partition_upsert_replaces_the_pharmacy_rows(self):
+        predictor = BatchReorderPredictor(self.client_obj.id)
+        predictor.save()
+        newer = pd.DataFrame({
+            'pharmacy_id': [self.pharmacy.id] * 2, 'product_id': [self.products[6].id, self.products[5].id],
+            'days_since_last': [30, 30], 'avg_cycle': [20.0, 20.0], 'urgency': [1.5, 1.5], 'rank': [1, 2],
+        })
+        predictor.upsert(newer, [self.pharmacy.id])
+        stored = list(ReorderSuggestion.objects.order_by('rank').values_list('rank', 'product_id'))
+        self.assertEqual(stored, [(1, self.products[6].id), (2, self.products[5].id)])
+
+    def test_pharmacy_context_reads_stored_suggestions(self):
+        BatchReorderPredictor(self.client_obj.id).save()
+        with mock.patch.object(ReorderPredictor, 'get_suggestions', side_effect=AssertionError):
+            context = build_pharmacy_context(self.pharmacy)
+        self.assertEqual(len(context['predictions']), 5)
+
+    def test_pharmacy_context_falls_back_to_live_prediction(self):
+        context = build_pharmacy_context(self.pharmacy)
+        self.assertEqual(context['predictions'], ReorderPredictor(self.pharmacy.id).get_suggestions_from_history())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BasketIndexTests(SalesFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        cls.shampoo, cls.conditioner, cls.soap = cls.make_products(cls.client_obj, 'SHAMPOO', 'CONDITIONER', 'SOAP')
+
+    def together(self, index, first, second):
+        return index.cooccurrence[index._position[str(first.id)], index._position[str(second.id)]]
+
+    def test_documents_completed_after_the_last_refresh_are_folded(self):
+        late = self.sell(self.pharmacy, 3, [self.shampoo, self.conditioner], status='PENDING')
+        self.sell(self.pharmacy, 2, [self.shampoo, self.conditioner])
+        index = BasketIndex.build(self.client_obj.id)
+        self.assertEqual(index.n_baskets, 1)
+
+        # Older id than the last folded document: an id watermark would never see it
+        late.status = 'COMPLETED'
+        late.save()
+        self.assertEqual(index.refresh(self.client_obj.id), 1)
+        self.assertEqual((index.n_baskets, self.together(index, self.shampoo, self.conditioner)), (2, 2))
+
+    def test_refresh_is_idempotent_within_the_overlap(self):
+        self.sell(self.pharmacy, 2, [self.shampoo, self.soap])
+        index = BasketIndex.build(self.client_obj.id)
+        self.assertEqual(index.refresh(self.client_obj.id), 0)
+        self.assertEqual(index.n_baskets, 1)
+        self.assertEqual(index.item_counts.tolist(), [1, 1])
+
+    def test_documents_leaving_completed_are_taken_out(self):
+        cancelled = self.sell(self.pharmacy, 2, [self.shampoo, self.conditioner])
+        self.sell(self.pharmacy, 1, [self.shampoo, self.conditioner, self.soap])
+        index = BasketIndex.build(self.client_obj.id)
+
+        cancelled.status = 'CANCELLED'
+        cancelled.save()
+        self.assertEqual(index.refresh(self.client_obj.id), -1)
+        self.assertEqual((index.n_baskets, self.together(index, self.shampoo, self.conditioner)), (1, 1))
+        self.assertEqual(index.document_ids.tolist(), [cancelled.id + 1])
+
+    def test_saved_index_keeps_its_watermark(self):
+        self.sell(self.pharmacy, 2, [self.shampoo, self.soap])
+        with tempfile.TemporaryDirectory() as data_dir, override_settings(ANALYTICS_DATA_DIR=data_dir):
+            index = BasketIndex.build(self.client_obj.id)
+            index.save(self.client_obj.id)
+            loaded = BasketIndex.load(self.client_obj.id)
+        self.assertEqual(loaded.watermark, index.watermark)
+        self.assertEqual(loaded.document_ids.tolist(), index.document_ids.tolist())
+        self.assertEqual(loaded.refresh(self.client_obj.id), 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SegmentationTests(SalesFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        cls.other = cls.make_pharmacy(cls.client_obj, 'PH-2')
+
+    def rfm(self, pharmacy):
+        pharmacy.refresh_from_db()
+        return pharmacy.segment_data['rfm']
+
+    def test_watermark_is_kept_in_the_database(self):
+        self.sell(self.pharmacy, 5, [])
+        segment_pharmacies(self.client_obj.id)
+        state = SegmentationState.objects.get(client=self.client_obj)
+        self.assertLessEqual(state.watermark, timezone.now())
+        self.assertEqual(self.rfm(self.pharmacy)['frequency'], 1)
+
+    def test_documents_completed_after_the_last_run_are_counted(self):
+        late = self.sell(self.other, 5, [], status='PENDING')
+        self.sell(self.pharmacy, 4, [])
+        segment_pharmacies(self.client_obj.id)
+        self.assertEqual(self.rfm(self.other)['frequency'], 0)
+
+        late.status = 'COMPLETED'
+        late.save()
+        with mock.patch('analytics.services.segmentation.rfm_features', wraps=segmentation.rfm_features) as features:
+            segment_pharmacies(self.client_obj.id)
+        self.assertEqual(self.rfm(self.other)['frequency'], 1)
+        # Only pharmacies with documents updated since the watermark (minus the overlap) are re-aggregated
+        self.assertEqual(features.call_args.args[1], {self.pharmacy.id, self.other.id})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PharmacySearchTests(SalesFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        for n in range(25):
+            cls.make_pharmacy(cls.client_obj, f'PH-{n + 10}', display_name=f'Farmacia Central {n}')
+        # Indexed last: the first FTS rows are all word-prefix matches
+        cls.best = cls.make_pharmacy(cls.client_obj, 'CENTRAL-1', display_name='Drogueria Norte')
+        other, _ = cls.make_tenant('other')
+        cls.make_pharmacy(other, 'CENTRAL-2')
+
+    def test_code_prefix_ranks_first_over_the_whole_match_set(self):
+        rows = search_pharmacies(self.client_obj.id, 'central', limit=2)
+        self.assertEqual(rows[0]['id'], self.best.id)
+        self.assertEqual(len(rows), 2)
+
+    def test_short_terms_and_tenant_filter_the_matches(self):
+        rows = search_pharmacies(self.client_obj.id, 'central 2', limit=50)
+        expected = {
+            pharmacy.id for pharmacy in Pharmacy.objects.filter(client=self.client_obj)
+            if 'CENTRAL' in pharmacy.search_key and '2' in pharmacy.search_key
+        }
+        self.assertTrue(expected)
+        self.assertEqual({row['id'] for row in rows}, expected)
+
+    def fts_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid, pharmacy_id, search_key FROM {FTS_TABLE}")
+            return {pharmacy_id: (rowid, key) for rowid, pharmacy_id, key in cursor.fetchall()}
+
+    def test_index_keeps_one_row_per_pharmacy_at_its_rowid(self):
+        self.best.display_name = 'Drogueria Sur'
+        self.best.save()
+        rows = self.fts_rows()
+        self.assertEqual(len(rows), Pharmacy.objects.count())
+        self.assertEqual(rows[str(self.best.id)], (search_rowid(self.best.id), self.best.search_key))
+        self.assertIn('SUR', rows[str(self.best.id)][1])
+
+        self.best.delete()
+        self.assertNotIn(str(self.best.id), self.fts_rows())
+
+    def test_rebuild_replaces_the_given_pharmacies_only(self):
+        before = self.fts_rows()
+        Pharmacy.objects.filter(id=self.pharmacy.id).update(display_name='Renombrada')  # no signals
+        self.assertEqual(rebuild_search_keys(Pharmacy.objects.filter(id=self.pharmacy.id)), 1)
+        after = self.fts_rows()
+        self.assertEqual(len(after), len(before))
+        self.assertIn('RENOMBRADA', after[str(self.pharmacy.id)][1])
+        self.assertEqual(rebuild_search_keys(), len(before))
+        self.assertEqual(self.fts_rows(), after)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DashboardViewTests(SalesFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        cls.user = User.objects.create_user('rep1', password='x')
+        Rep.objects.create(client=cls.client_obj, user=cls.user, external_id='R1')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def dashboard(self, name='analytics:dashboard'):
+        return self.client.get(reverse(name)).context
+
+    def test_acknowledged_alerts_leave_the_cached_dashboards(self):
+        alert = AnomalyAlert.objects.create(
+            client=self.client_obj, scope='PHARMACY', scope_id=str(self.pharmacy.id), label='PH-1',
+            metric='SALES', date=timezone.localdate(), value=10, expected=100, zscore=-4,
+        )
+        for name in ('analytics:dashboard', 'analytics:ops_dashboard'):
+            self.assertEqual(len(self.dashboard(name)['anomaly_alerts']), 1)
+
+        alert.is_acknowledged = True
+        alert.save()
+        for name in ('analytics:dashboard', 'analytics:ops_dashboard'):
+            self.assertEqual(self.dashboard(name)['anomaly_alerts'], [])
+
+    def test_filter_choices_belong_to_the_tenant(self):
+        zone = Zone.objects.create(client=self.client_obj, name='Norte')
+        self.pharmacy.territory = Territory.objects.create(client=self.client_obj, name='T1', zone=zone)
+        self.pharmacy.save()
+        other, other_pharmacy = self.make_tenant('other')
+        other_zone = Zone.objects.create(client=other, name='Sur')
+        other_pharmacy.territory = Territory.objects.create(client=other, name='T2', zone=other_zone)
+        other_pharmacy.save()
+
+        context = self.dashboard()
+        self.assertEqual(list(context['filter_zones']), [('Norte', zone.id)])
+        self.assertEqual(list(context['filter_pharmacies']), [('PH-1', self.pharmacy.id)])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SalesCubeTests(SalesFixtures, TestCase):
+    """Totals below are summed by hand from the four documents of setUpTestData."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, uncharted = cls.make_tenant()
+        region = Region.objects.create(client=cls.client_obj, name='Buenos Aires')
+        territories = {
+            name: Territory.objects.create(
+                client=cls.client_obj, name=f'T-{name}',
+                zone=Zone.objects.create(client=cls.client_obj, name=name, region=region),
+            )
+            for name in ('CABA', 'GBA')
+        }
+        caba = cls.make_pharmacy(cls.client_obj, 'PH-CABA', territory=territories['CABA'])
+        gba = cls.make_pharmacy(cls.client_obj, 'PH-GBA', territory=territories['GBA'])
+        category = ProductCategory.objects.create(client=cls.client_obj, name='Cuidado')
+        alfa, beta, loose = cls.make_products(cls.client_obj, 'ALFA', 'BETA', 'SUELTO')
+        for product, brand in ((alfa, 'Alfa'), (beta, 'Beta')):
+            product.category = category
+            product.brand = ProductBrand.objects.create(client=cls.client_obj, name=brand)
+            product.save()
+
+        cls.document(caba, '2025-01-15', [(alfa, 2, 20), (beta, 1, 15)])
+        cls.document(gba, '2025-02-10', [(alfa, 3, 30)])
+        cls.document(caba, '2025-04-05', [(beta, 4, 40)], channel='ONLINE')
+        cls.document(uncharted, '2025-04-20', [(loose, 1, 5)])
+
+        cls.other, other_pharmacy = cls.make_tenant('other')
+        other_pharmacy.territory = Territory.objects.create(
+            client=cls.other, name='T-CABA', zone=Zone.objects.create(client=cls.other, name='CABA'),
+        )
+        other_pharmacy.save()
+        other_product, = cls.make_products(cls.other, 'ALFA')
+        cls.document(other_pharmacy, '2025-01-15', [(other_product, 100, 1000)])
+
+    @classmethod
+    def document(cls, pharmacy, day, lines, **fields):
+        document = SalesDocument.objects.create(
+            client=pharmacy.client, pharmacy=pharmacy, external_id=f'T-{pharmacy.code}-{day}',
+            date=datetime.datetime.fromisoformat(f'{day}T12:00:00+00:00'), **fields,
+        )
+        for product, quantity, amount in lines:
+            SalesLine.objects.create(document=document, product=product, quantity=quantity, total_price=amount)
+
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        settings_override = override_settings(ANALYTICS_DATA_DIR=data_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.cube = SalesCube.build(self.client_obj.id)
+
+    def test_rollup_matches_hand_computed_totals(self):
+        self.assertEqual(self.cube.rollup(), [{'units': 11, 'amount': 110.0, 'lines': 5}])
+        self.assertEqual(self.cube.rollup(by=['zone'], order_by='-amount'), [
+            {'zone': 'CABA', 'units': 7, 'amount': 75.0, 'lines': 3},
+            {'zone': 'GBA', 'units': 3, 'amount': 30.0, 'lines': 1},
+            {'zone': 'Sin Dato', 'units': 1, 'amount': 5.0, 'lines': 1},
+        ])
+        self.assertEqual(self.cube.rollup(by=['quarter', 'channel'], measures=['units']), [
+            {'quarter': '2025-Q1', 'channel': 'OFFLINE', 'units': 6},
+            {'quarter': '2025-Q2', 'channel': 'OFFLINE', 'units': 1},
+            {'quarter': '2025-Q2', 'channel': 'ONLINE', 'units': 4},
+        ])
+
+    def test_dice_by_labels_and_ranges(self):
+        self.assertEqual(
+            self.cube.dice(zone='CABA', month={'from': '2025-02'}).rollup(),
+            [{'units': 4, 'amount': 40.0, 'lines': 1}],
+        )
+        self.assertEqual(
+            self.cube.dice(brand=['Alfa', 'Beta'], year='2025').rollup(by=['brand'], measures=['amount']),
+            [{'brand': 'Alfa', 'amount': 50.0}, {'brand': 'Beta', 'amount': 55.0}],
+        )
+        with self.assertRaises(ValueError):
+            self.cube.dice(semester='2025-S1')
+
+    def test_drill_walks_down_each_hierarchy(self):
+        self.assertEqual(
+            [(r['region'], r['units']) for r in self.cube.drill('geo')], [('Buenos Aires', 10), ('Sin Dato', 1)],
+        )
+        self.assertEqual(
+            [(r['zone'], r['amount']) for r in self.cube.drill('geo', ['Buenos Aires'])], [('CABA', 75.0), ('GBA', 30.0)],
+        )
+        self.assertEqual(
+            [(r['month'], r['lines']) for r in self.cube.drill('time', ['2025', '2025-Q1'])],
+            [('2025-01', 2), ('2025-02', 1)],
+        )
+        with self.assertRaises(ValueError):
+            self.cube.drill('product', ['Cuidado', 'Alfa'])
+
+    def test_saved_cube_loads_the_same_cells(self):
+        self.cube.save(self.client_obj.id)
+        loaded = SalesCube.load(self.client_obj.id, build_missing=False)
+        self.assertEqual(loaded.rollup(by=['territory']), self.cube.rollup(by=['territory']))
+
+    def test_view_answers_from_the_tenant_cube(self):
+        self.client.force_login(
+            Rep.objects.create(client=self.other, user=User.objects.create_user('rep-other'), external_id='R1').user
+        )
+        rows = self.client.get(reverse('analytics:sales_cube'), {'by': 'zone'}).json()['rows']
+        self.assertEqual(rows, [{'zone': 'CABA', 'units': 100, 'amount': 1000.0, 'lines': 1}])
+
+        self.client.force_login(
+            Rep.objects.create(client=self.client_obj, user=User.objects.create_user('rep-acme'), external_id='R1').user
+        )
+        url = reverse('analytics:sales_cube')
+        response = self.client.get(url, {'hierarchy': 'geo', 'path': 'Buenos Aires', 'month_to': '2025-01'})
+        self.assertEqual(response.json()['rows'], [{'zone': 'CABA', 'units': 3, 'amount': 35.0, 'lines': 2}])
+        self.assertEqual(self.client.get(url, {'by': 'zone', 'order_by': 'zone'}).json()['rows'][-1]['zone'], 'Sin Dato')
+        self.assertEqual(self.client.get(url, {'order_by': 'zone'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'zone': 'CABA', 'zone_from': 'A'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'hierarchy': 'canal'}).status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AnomalyDetectorTests(SalesFixtures, TestCase):
+    """Zone sales fed straight into the daily rollups; the one document only anchors the first day."""
+
+    START = datetime.date(2026, 1, 1)
+    BASELINE = [100.0, 110.0] * 20  # mean 105, sample std ~5.1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.pharmacy = cls.make_tenant()
+        cls.zone = Zone.objects.create(client=cls.client_obj, name='Norte')
+        SalesDocument.objects.create(
+            client=cls.client_obj, pharmacy=cls.pharmacy, external_id='T-ANCHOR',
+            date=datetime.datetime.combine(cls.START, datetime.time(12), tzinfo=datetime.timezone.utc),
+        )
+
+    def zone_sales(self, amounts):
+        SalesDailyRollup.objects.bulk_create(
+            SalesDailyRollup(
+                client=self.client_obj, zone=self.zone, date=self.day(i), total_amount=amount, pharmacy_sketch=b'',
+            )
+            for i, amount in enumerate(amounts)
+        )
+
+    def day(self, i):
+        return self.START + datetime.timedelta(days=i)
+
+    def run_detector(self, until, **options):
+        return AnomalyDetector(self.client_obj.id, **options).run(until=self.day(until))
+
+    def test_welford_matches_the_batch_statistics(self):
+        samples = np.array([[3.0, np.nan], [5.0, 2.0], [np.nan, 4.0], [10.0, 9.0]])
+        count, mean, m2 = np.zeros(2), np.zeros(2), np.zeros(2)
+        for row in samples:
+            count, mean, m2 = welford(count, mean, m2, row)
+        for column in range(2):
+            values = samples[:, column][~np.isnan(samples[:, column])]
+            self.assertEqual(count[column], len(values))
+            self.assertAlmostEqual(mean[column], values.mean())
+            self.assertAlmostEqual(m2[column] / (count[column] - 1), values.var(ddof=1))
+
+    def test_a_drop_beyond_the_threshold_raises_one_alert_per_episode(self):
+        # Days 40-41 are one episode (z -18.8 and -5.9); back to normal, then a second drop on 45
+        self.zone_sales(self.BASELINE + [10.0, 10.0, 105.0, 105.0, 105.0, 0.0])
+        alerts = self.run_detector(45)
+
+        self.assertEqual([(a.scope, a.metric, a.date) for a in alerts], [
+            ('ZONE', 'SALES', self.day(40)), ('ZONE', 'SALES', self.day(45)),
+        ])
+        first = alerts[0]
+        self.assertEqual((first.label, first.value, first.expected), ('Norte', 10.0, 105.0))
+        self.assertLessEqual(first.zscore, -Z_THRESHOLD)
+        self.assertEqual(AnomalyAlert.objects.count(), 2)
+
+    def test_an_episode_spanning_two_passes_alerts_once(self):
+        self.zone_sales(self.BASELINE + [10.0, 10.0])
+        self.assertEqual([a.date for a in self.run_detector(40)], [self.day(40)])
+        self.assertEqual(self.run_detector(41), [])
+
+        state = AnomalyState.objects.get(scope='ZONE', metric='SALES', scope_id=str(self.zone.id))
+        self.assertEqual((state.count, state.last_date, state.is_alerting), (42, self.day(41), True))
+
+    def test_no_alerts_before_the_warm_up_minimum(self):
+        self.zone_sales([100.0, 110.0] * 3 + [10.0])  # a drop after only 6 days of baseline
+        self.assertEqual(self.run_detector(6), [])
+
+        AnomalyState.objects.all().delete()
+        self.assertEqual([a.date for a in self.run_detector(6, min_samples=6)], [self.day(6)])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DashboardCacheTests(TestCase):
+    """The 'dashboard' alias stands for one worker's memory, 'shared' for what every worker sees."""
+
+    def setUp(self):
+        for alias in ('dashboard', 'shared'):
+            caches[alias].clear()
+
+    def test_aggregates_are_shared_between_workers(self):
+        self.assertEqual(dashboard_cache.get_or_compute('kpis', 1, {}, lambda: {'total': 10}), {'total': 10})
+        caches['dashboard'].clear()  # another worker
+
+        compute = mock.Mock(return_value={'total': 99})
+        self.assertEqual(dashboard_cache.get_or_compute('kpis', 1, {}, compute), {'total': 10})
+        compute.assert_not_called()
+
+        dashboard_cache.bump_data_version(1)
+        self.assertEqual(dashboard_cache.get_or_compute('kpis', 1, {}, compute), {'total': 99})
+
+    def test_waits_for_the_worker_holding_the_lock(self):
+        key = dashboard_cache.make_key('kpis', 1, {})
+        self.assertTrue(caches['shared'].add(f"{key}:lock", 1))
+
+        def other_worker_finishes(seconds):
+            caches['shared'].set(key, dashboard_cache._pack({'total': 10}))
+
+        compute = mock.Mock(return_value={'total': 99})
+        with mock.patch.object(dashboard_cache.time, 'sleep', side_effect=other_worker_finishes):
+            self.assertEqual(dashboard_cache.get_or_compute('kpis', 1, {}, compute), {'total': 10})
+        compute.assert_not_called()
+
+    def test_generation_survives_eviction_without_colliding(self):
+        cache = caches['shared']
+        first = generations.get_generation(cache, 'gen')
+        generations.bump_generation(cache, 'gen')
+        self.assertEqual(generations.get_generation(cache, 'gen'), first + 1)
+
+        cache.delete('gen')
+        generations.bump_generation(cache, 'gen')
+        self.assertGreater(generations.get_generation(cache, 'gen'), first + 1)
+
+
+class BacktestTests(TestCase):
+
+    def test_state_and_batch_predictors_score_alike(self):
+        end = datetime.date(2026, 6, 30)
+        history = backtesting.synthetic_history(40, 10, 300, end, catalog=50)
+        cutoffs = backtesting.default_cutoffs(end, 30, 3, 30)
+        for options in ({}, {'LOOKBACK_DAYS': 90, 'DUE_BUFFER': 0.1}):
+            batch = backtesting.backtest(history, cutoffs, 30, 'batch', **options)
+            state = backtesting.backtest(history, cutoffs, 30, 'state', **options)
+            metrics = ('suggested', 'reordered', 'hits')
+            self.assertEqual([[r[m] for m in metrics] for r in state], [[r[m] for m in metrics] for r in batch])
+            self.assertTrue(any(r['suggested'] for r in state))
+            self.assertTrue(all(r['timings']['state'] > 0 for r in state))
+
+    def test_unknown_predictor(self):
+        with self.assertRaises(ValueError):
+            backtesting.backtest(pd.DataFrame(columns=backtesting.COLUMNS), [], predictor='nightly')
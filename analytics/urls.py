@@ -11,6 +11,7 @@ urlpatterns = [
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
     path('dashboard/ventas/', views.SalesDashboardView.as_view(), name='sales_dashboard'),
     path('dashboard/operaciones/', views.OpsDashboardView.as_view(), name='ops_dashboard'),
+    path('api/cubo-ventas/', views.SalesCubeView.as_view(), name='sales_cube'),
     path('farmacias/', views.PharmacyListView.as_view(), name='pharmacy_list'),
     path('productos/', views.ProductListView.as_view(), name='product_list'),
     path('reportes/detallado/', views.OrderMasterListView.as_view(), name='order_master_list'),
@@ -7,11 +7,17 @@ from .models import Pharmacy, SalesDocument, SalesLine, Product, Zone, Client
 from surveys.models import Visit, StockoutObservation, FormDefinition, FormFieldDefinition, FormSubmission, FormAnswer
 
 import csv
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views import View
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.views.generic import CreateView, UpdateView
 from django.urls import reverse_lazy
 from .forms import CustomUserCreationForm, CustomUserUpdateForm
+from .services.anomalies import recent_alerts
+from .services.dashboard_cache import get_or_compute, normalise_filters
+from .services.rollups import approx_distinct_pharmacies, has_rollups
+from .services.sales_cube import SalesCube, DIMENSIONS, DERIVED_LEVELS, HIERARCHIES, MEASURES
+from .services.tenancy import get_request_client
 from django.contrib.auth.models import User
 
 class SuperUserRequiredMixin(UserPassesTestMixin):
@@ -146,6 +152,15 @@ class OrderMasterListView(LoginRequiredMixin, ListView):
 
 class DashboardContextMixin:
     """Mixin to handle common dashboard filtering and initial context."""
+    def get_cached_aggregates(self, name, data, compute):
+        """Serves `compute()` from the per-tenant dashboard cache (see services.dashboard_cache)."""
+        client_id = data['client'].pk if data['client'] else None
+        return get_or_compute(name, client_id, data['filters'], compute)
+
+    def get_anomaly_alerts(self, data):
+        """Read outside the aggregate cache: acknowledging an alert must hide it right away."""
+        return recent_alerts(data['client'].pk) if data['client'] else []
+
     def get_dashboard_context(self, request):
         # --- Filters ---
         pharmacy_ids = request.GET.getlist('pharmacy')
@@ -153,10 +168,17 @@ class DashboardContextMixin:
         date_start = request.GET.get('date_start')
         date_end = request.GET.get('date_end')
 
-        # Base QuerySets
+        # Base QuerySets (scoped to the user's tenant)
+        client = get_request_client(request)
         sales_qs = SalesDocument.objects.all()
         visit_qs = Visit.objects.all()
         oos_qs = StockoutObservation.objects.all()
+        pharmacy_qs = Pharmacy.objects.all()
+        if client:
+            sales_qs = sales_qs.filter(client=client)
+            visit_qs = visit_qs.filter(client=client)
+            oos_qs = oos_qs.filter(visit__client=client)
+            pharmacy_qs = pharmacy_qs.filter(client=client)
         
         # Filter out empty strings if any
         pharmacy_ids = [pid for pid in pharmacy_ids if pid]
@@ -183,13 +205,17 @@ class DashboardContextMixin:
             oos_qs = oos_qs.filter(visit__started_at__date__lte=date_end)
 
         return {
+            'client': client,
+            'filters': normalise_filters(request.GET),
             'sales_qs': sales_qs,
             'visit_qs': visit_qs,
             'oos_qs': oos_qs,
-            'filter_zones': Pharmacy.objects.values_list('territory__zone__name', 'territory__zone__id').distinct().exclude(territory__zone__isnull=True).order_by('territory__zone__name'),
-            'filter_pharmacies': Pharmacy.objects.values_list('display_name', 'id').order_by('display_name'),
+            'filter_zones': pharmacy_qs.values_list('territory__zone__name', 'territory__zone__id').distinct().exclude(territory__zone__isnull=True).order_by('territory__zone__name'),
+            'filter_pharmacies': pharmacy_qs.values_list('display_name', 'id').order_by('display_name'),
             'selected_zones': zone_ids,
             'selected_pharmacies': pharmacy_ids,
+            'date_start': date_start,
+            'date_end': date_end,
         }
 
 class DashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
@@ -199,31 +225,54 @@ class DashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
         context = super().get_context_data(**kwargs)
         data = self.get_dashboard_context(self.request)
         
+        context.update(self.get_cached_aggregates('general', data, lambda: self.compute_aggregates(data)))
+        context.update({
+            'anomaly_alerts': self.get_anomaly_alerts(data),
+            'filter_zones': data['filter_zones'],
+            'filter_pharmacies': data['filter_pharmacies'],
+            'selected_zones': data['selected_zones'],
+            'selected_pharmacies': data['selected_pharmacies'],
+        })
+        return context
+
+    def count_active_pharmacies(self, data):
+        """
+        Distinct buying pharmacies. Zone/date selections are answered by merging the
+        HyperLogLog sketches of the daily rollups (~1.6% error); an explicit pharmacy
+        filter, or a tenant without rollups yet, uses the exact DISTINCT query.
+        """
+        client = data['client']
+        if client and not data['selected_pharmacies'] and has_rollups(client.pk):
+            return approx_distinct_pharmacies(
+                client.pk,
+                date_from=data['date_start'],
+                date_to=data['date_end'],
+                zone_ids=data['selected_zones'],
+            )
+        return data['sales_qs'].values('pharmacy_id').distinct().count()
+
+    def compute_aggregates(self, data):
         sales_qs = data['sales_qs']
         visit_qs = data['visit_qs']
         oos_qs = data['oos_qs']
 
         # --- KPIs Globales ---
-        context.update({
+        aggregates = {
             'kpi_total_sales': sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0,
-            'kpi_pharmacies': sales_qs.values('pharmacy_id').distinct().count(),
+            'kpi_pharmacies': self.count_active_pharmacies(data),
             'kpi_visits': visit_qs.count(),
             'kpi_oos': oos_qs.count(),
-            'filter_zones': data['filter_zones'],
-            'filter_pharmacies': data['filter_pharmacies'],
-            'selected_zones': data['selected_zones'],
-            'selected_pharmacies': data['selected_pharmacies'],
-        })
+        }
 
         # --- Top Farmacias (General View) ---
-        context['top_pharmacies'] = sales_qs.values(
+        aggregates['top_pharmacies'] = list(sales_qs.values(
             'pharmacy__display_name', 'pharmacy__segment_data'
         ).annotate(
             total_sales=Sum('total_amount'),
             ticket_count=Count('id')
-        ).order_by('-total_sales')[:10]
-        
-        return context
+        ).order_by('-total_sales')[:10])
+
+        return aggregates
 
 class SalesDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
     template_name = "analytics/dashboard_sales.html"
@@ -231,6 +280,16 @@ class SalesDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         data = self.get_dashboard_context(self.request)
+        context.update(self.get_cached_aggregates('sales', data, lambda: self.compute_aggregates(data)))
+        context.update({
+            'filter_zones': data['filter_zones'],
+            'filter_pharmacies': data['filter_pharmacies'],
+            'selected_zones': data['selected_zones'],
+            'selected_pharmacies': data['selected_pharmacies'],
+        })
+        return context
+
+    def compute_aggregates(self, data):
         sales_qs = data['sales_qs']
         line_qs = SalesLine.objects.filter(document__in=sales_qs)
 
@@ -246,7 +305,7 @@ class SalesDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin
         # --- Gráfico 4: Origen de Pedidos ---
         sales_by_source = sales_qs.values('order_source').annotate(count=Count('id')).order_by('-count')
 
-        context.update({
+        return {
             'sales_months': [s['month'].strftime('%Y-%m') for s in sales_by_month if s['month']],
             'sales_values': [float(s['total']) for s in sales_by_month if s['month']],
             'zone_labels': [z['pharmacy__territory__zone__name'] or 'Sin Zona' for z in orders_by_zone],
@@ -255,12 +314,7 @@ class SalesDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin
             'combo_values': [c['units'] for c in top_combos],
             'source_labels': [s['order_source'] for s in sales_by_source],
             'source_values': [s['count'] for s in sales_by_source],
-            'filter_zones': data['filter_zones'],
-            'filter_pharmacies': data['filter_pharmacies'],
-            'selected_zones': data['selected_zones'],
-            'selected_pharmacies': data['selected_pharmacies'],
-        })
-        return context
+        }
 
 class OpsDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
     template_name = "analytics/dashboard_ops.html"
@@ -268,6 +322,17 @@ class OpsDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         data = self.get_dashboard_context(self.request)
+        context.update(self.get_cached_aggregates('ops', data, lambda: self.compute_aggregates(data)))
+        context.update({
+            'anomaly_alerts': self.get_anomaly_alerts(data),
+            'filter_zones': data['filter_zones'],
+            'filter_pharmacies': data['filter_pharmacies'],
+            'selected_zones': data['selected_zones'],
+            'selected_pharmacies': data['selected_pharmacies'],
+        })
+        return context
+
+    def compute_aggregates(self, data):
         visit_qs = data['visit_qs']
         oos_qs = data['oos_qs']
 
@@ -277,7 +342,7 @@ class OpsDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
         # --- Gráfico 2: Quiebres por Fuente (OOS) ---
         oos_by_source = oos_qs.values('cluster_source').annotate(count=Count('id')).order_by('-count')
 
-        context.update({
+        return {
              # KPIs Específicos Ops
             'kpi_visits': visit_qs.count(),
             'kpi_oos': oos_qs.count(),
@@ -287,12 +352,62 @@ class OpsDashboardView(LoginRequiredMixin, TemplateView, DashboardContextMixin):
             'visits_zone_values': [z['count'] for z in visits_by_zone],
             'oos_source_labels': [o['cluster_source'] for o in oos_by_source],
             'oos_source_values': [o['count'] for o in oos_by_source],
-            'filter_zones': data['filter_zones'],
-            'filter_pharmacies': data['filter_pharmacies'],
-            'selected_zones': data['selected_zones'],
-            'selected_pharmacies': data['selected_pharmacies'],
+        }
+
+class SalesCubeView(LoginRequiredMixin, View):
+    """
+    Slice/dice/drill API over the tenant's pre-computed sales cube.
+      ?by=zone&by=quarter            roll-up levels
+      &zone=CABA&zone=GBA            dice on any level (repeatable)
+      &month_from=2025-01&month_to=2025-06
+      &hierarchy=geo&path=Buenos Aires   drill-down (overrides `by`)
+      &order_by=-amount
+    """
+    def get(self, request):
+        client = get_request_client(request)
+        if not client:
+            return JsonResponse({'error': 'Sin cliente asociado'}, status=404)
+
+        cube = SalesCube.load(client.id)
+        levels = list(DIMENSIONS) + list(DERIVED_LEVELS)
+
+        filters = {}
+        for level in levels:
+            values = [v for v in request.GET.getlist(level) if v]
+            if values:
+                filters[level] = values
+            bounds = {'from': request.GET.get(f'{level}_from'), 'to': request.GET.get(f'{level}_to')}
+            if bounds['from'] or bounds['to']:
+                if level in filters:
+                    return JsonResponse({'error': f"'{level}' admite lista o rango, no ambos"}, status=400)
+                filters[level] = bounds
+
+        hierarchy = request.GET.get('hierarchy')
+        by = [b for b in request.GET.getlist('by') if b]
+        order_by = request.GET.get('order_by') or None
+        if order_by and order_by.lstrip('-') not in MEASURES + tuple(by):
+            return JsonResponse({'error': f"order_by inválido: {order_by}"}, status=400)
+
+        try:
+            if hierarchy:
+                if hierarchy not in HIERARCHIES:
+                    return JsonResponse({'error': f"Jerarquía desconocida: {hierarchy}"}, status=400)
+                path = [p for p in request.GET.getlist('path') if p]
+                rows = cube.drill(hierarchy, path, **filters)
+                if order_by:
+                    reverse = order_by.startswith('-')
+                    rows.sort(key=lambda r: r[order_by.lstrip('-')], reverse=reverse)
+            else:
+                rows = cube.dice(**filters).rollup(by=by, order_by=order_by)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse({
+            'built_at': str(cube.built_at),
+            'levels': levels,
+            'hierarchies': HIERARCHIES,
+            'rows': rows,
         })
-        return context
 
 class UserProfileView(LoginRequiredMixin, TemplateView):
     template_name = "analytics/profile.html"
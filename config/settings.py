@@ -82,6 +82,10 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # The test database is created from the current models: replaying the
+        # early analytics -> surveys move (0007) is not needed to run the tests.
+        # The pharmacy search index is created by a post_migrate handler instead.
+        "TEST": {"MIGRATE": False},
     }
 }
 
@@ -125,5 +129,45 @@ STATIC_URL = "/static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "default",
+    },
+    # Dashboard aggregates (see analytics.services.dashboard_cache), per-process
+    # copy of the ones published in "shared" (where versions and locks live too).
+    # LocMemCache evicts least-recently-used entries once MAX_ENTRIES is hit.
+    "dashboard": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "dashboard",
+        "TIMEOUT": 15 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 2000, "CULL_FREQUENCY": 10},
+    },
+    # Shared between the web workers and management commands (prewarming)
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "analytics_data" / "cache",
+        "TIMEOUT": 5 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
+# Seconds a pharmacy context panel (form_fill.html) is served from cache
+PHARMACY_CONTEXT_TTL = 5 * 60
+# Prewarmed contexts (prewarm_pharmacy_context, run before the route starts) must last the
+# working day; sales / visit changes still invalidate them through the signals
+PHARMACY_CONTEXT_PREWARM_TTL = 16 * 60 * 60
+
+# Evidence photos (see surveys.services.evidence)
+EVIDENCE_MAX_UPLOAD_SIZE = 25 * 1024 * 1024
+# Background threads per process making thumbnails / previews
+EVIDENCE_WORKERS = 2
+
+# Pre-computed analytics artifacts (sales cubes, indexes), one file per tenant
+ANALYTICS_DATA_DIR = BASE_DIR / "analytics_data"
+
 LOGIN_REDIRECT_URL = "analytics:home"
 LOGOUT_REDIRECT_URL = "login"
@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     Catalog, CatalogOption, FormDefinition, FormFieldDefinition,
     Visit, FormSubmission, FormAnswer, EvidenceFile,
-    PopType, PopPlacement, StockoutObservation
+    PopType, PopPlacement, StockoutObservation, FormFieldDailyStat
 )
 
 class FormFieldInline(admin.TabularInline):
@@ -40,7 +40,18 @@ class VisitAdmin(admin.ModelAdmin):
     list_filter = ('status', 'client')
     search_fields = ('pharmacy__name_trade', 'rep__user__username')
 
-admin.site.register(EvidenceFile)
+@admin.register(EvidenceFile)
+class EvidenceFileAdmin(admin.ModelAdmin):
+    list_display = ('submission', 'file_type', 'processing_status', 'size', 'timestamp')
+    list_filter = ('processing_status', 'file_type')
+    readonly_fields = ('content_hash', 'size', 'thumbnail', 'preview')
+
 admin.site.register(PopType)
 admin.site.register(PopPlacement)
 admin.site.register(StockoutObservation)
+
+@admin.register(FormFieldDailyStat)
+class FormFieldDailyStatAdmin(admin.ModelAdmin):
+    list_display = ('field_definition', 'date', 'zone', 'answer_count', 'true_count', 'value_sum')
+    list_filter = ('client', 'date')
+    readonly_fields = ('value_counts', 'updated_at')
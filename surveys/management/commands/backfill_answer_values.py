@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from surveys.services.submissions import backfill_typed_values
+
+
+class Command(BaseCommand):
+    help = 'Fills the typed value_* columns and catalog-option links of existing FormAnswers from raw_value'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all clients)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Answers per SELECT / bulk UPDATE')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.all()
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            updated, linked = backfill_typed_values(client.id, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{client.name}: {updated} respuestas tipadas, {linked} opciones vinculadas"
+            ))
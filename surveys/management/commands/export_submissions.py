@@ -0,0 +1,47 @@
+import datetime
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Client
+from surveys.services.export import SubmissionPivot
+from surveys.services.form_schema import get_form_schema
+
+
+class Command(BaseCommand):
+    help = 'Exports the submissions of a form as a wide table (one column per question) to CSV or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('form', help='Form code')
+        parser.add_argument('--client', required=True, help='Client code')
+        parser.add_argument('--form-version', type=int, help='Form version whose questions become columns (default: active)')
+        parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+        parser.add_argument('--output', help='Output file (default: stdout for CSV)')
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help='YYYY-MM-DD, submitted on or after')
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help='YYYY-MM-DD, submitted before')
+
+    def handle(self, *args, **options):
+        client = Client.objects.filter(code=options['client']).first()
+        if client is None:
+            raise CommandError(f"Cliente {options['client']} no encontrado")
+        schema = get_form_schema(client.id, options['form'], options['form_version'])
+        if schema is None:
+            raise CommandError(f"Formulario {options['form']} no encontrado")
+
+        pivot = SubmissionPivot(schema, since=options['since'], until=options['until'])
+        started = time.perf_counter()
+        if options['format'] == 'parquet':
+            if not options['output']:
+                raise CommandError("--output es obligatorio para Parquet")
+            try:
+                count = pivot.write_parquet(options['output'])
+            except ImportError as exc:
+                raise CommandError(str(exc))
+        elif options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                count = pivot.write_csv(f)
+        else:
+            count = pivot.write_csv(sys.stdout)
+
+        self.stderr.write(self.style.SUCCESS(
+            f"{count} respuestas x {len(pivot.fields)} preguntas en {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,29 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from analytics.models import Client, Rep
+from surveys.services.pharmacy_context import prewarm_pharmacy_contexts, scheduled_pharmacies
+
+
+class Command(BaseCommand):
+    help = 'Prewarms the pharmacy context cache for the pharmacies on the reps\' scheduled route of the day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all active clients)')
+        parser.add_argument('--rep', help='Rep external_id (default: every rep)')
+        parser.add_argument('--date', type=datetime.date.fromisoformat, help='YYYY-MM-DD (default: today)')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate()
+        clients = Client.objects.filter(is_active=True)
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            rep = None
+            if options['rep']:
+                rep = Rep.objects.filter(client=client, external_id=options['rep']).first()
+                if rep is None:
+                    continue
+            warmed = prewarm_pharmacy_contexts(scheduled_pharmacies(day, rep=rep, client=client))
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {warmed} farmacias precalentadas ({day})"))
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Client
+from surveys.models import EvidenceFile
+from surveys.services import evidence as evidence_service
+
+
+class Command(BaseCommand):
+    help = 'Makes the thumbnails / WebP previews of evidence photos still PENDING (after restarts or backfills)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all clients)')
+        parser.add_argument('--workers', type=int, help='Worker threads (default: settings.EVIDENCE_WORKERS)')
+
+    def handle(self, *args, **options):
+        if evidence_service.Image is None:
+            raise CommandError("Las miniaturas requieren Pillow")
+
+        clients = Client.objects.all()
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            started = time.perf_counter()
+            counts = evidence_service.process_pending_evidence(
+                EvidenceFile.objects.filter(submission__visit__client=client), workers=options['workers'],
+            )
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{client.name}: {counts.get('READY', 0)} listas, {counts.get('FAILED', 0)} fallidas en {elapsed:.2f}s"
+            ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from analytics.models import Client
+from surveys.services.form_stats import rebuild_form_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the per-question daily answer statistics from FormAnswer. Needed for the backfill and after '
+        'answers are added to or removed from existing submissions one by one; new and deleted submissions '
+        'and edited answers update them on commit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', help='Client code (default: all clients)')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.all()
+        if options['client']:
+            clients = clients.filter(code=options['client'])
+
+        for client in clients:
+            written = rebuild_form_stats(client.id)
+            self.stdout.write(self.style.SUCCESS(f"{client.name}: {written} buckets de estadísticas"))
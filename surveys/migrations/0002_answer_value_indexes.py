@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("surveys", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="formanswer",
+            index=models.Index(
+                fields=["field_definition", "value_bool"],
+                name="surveys_for_field_d_bdc859_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="formanswer",
+            index=models.Index(
+                fields=["field_definition", "value_int"],
+                name="surveys_for_field_d_edfe8b_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0013_anomalies"),
+        ("surveys", "0002_answer_value_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FormFieldDailyStat",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("date", models.DateField()),
+                ("answer_count", models.IntegerField(default=0)),
+                ("true_count", models.IntegerField(default=0)),
+                ("value_sum", models.FloatField(default=0)),
+                (
+                    "value_counts",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        help_text="{valor numérico u opción: cantidad}",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.client",
+                    ),
+                ),
+                (
+                    "field_definition",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="surveys.formfielddefinition",
+                    ),
+                ),
+                (
+                    "zone",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.zone",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Estadística Diaria de Pregunta",
+                "indexes": [
+                    models.Index(
+                        fields=["field_definition", "date"],
+                        name="surveys_for_field_d_f42402_idx",
+                    ),
+                    models.Index(
+                        fields=["client", "date"], name="surveys_for_client__3acac0_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
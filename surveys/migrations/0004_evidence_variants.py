@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("surveys", "0003_formfielddailystat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="evidencefile",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="SHA-256 of the file",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="evidencefile",
+            name="preview",
+            field=models.FileField(blank=True, upload_to="evidence/previews/%Y/%m/%d/"),
+        ),
+        migrations.AddField(
+            model_name="evidencefile",
+            name="processing_status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "Pendiente"),
+                    ("READY", "Lista"),
+                    ("FAILED", "Fallida"),
+                ],
+                default="PENDING",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="evidencefile",
+            name="size",
+            field=models.PositiveBigIntegerField(
+                blank=True, help_text="Bytes", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="evidencefile",
+            name="thumbnail",
+            field=models.FileField(blank=True, upload_to="evidence/thumbs/%Y/%m/%d/"),
+        ),
+    ]
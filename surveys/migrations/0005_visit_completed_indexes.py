@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0014_pharmacy_search_key"),
+        ("surveys", "0004_evidence_variants"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(
+                fields=["client", "completed_at"], name="surveys_vis_client__ec4f85_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(
+                fields=["client", "rep", "completed_at"],
+                name="surveys_vis_client__d7f031_idx",
+            ),
+        ),
+    ]
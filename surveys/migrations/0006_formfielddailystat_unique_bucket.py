@@ -0,0 +1,62 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:40
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def merge_duplicate_buckets(apps, schema_editor):
+    """Folds buckets duplicated by concurrent first writers into one row."""
+    FormFieldDailyStat = apps.get_model("surveys", "FormFieldDailyStat")
+    kept, merged = {}, set()
+    duplicates = []
+    for stat in FormFieldDailyStat.objects.order_by("id").iterator():
+        key = (stat.client_id, stat.field_definition_id, stat.date, stat.zone_id)
+        first = kept.setdefault(key, stat)
+        if first is stat:
+            continue
+        first.answer_count += stat.answer_count
+        first.true_count += stat.true_count
+        first.value_sum += stat.value_sum
+        counts = Counter(first.value_counts or {})
+        counts.update(stat.value_counts or {})
+        first.value_counts = dict(counts)
+        duplicates.append(stat.id)
+        merged.add(key)
+
+    for key in merged:
+        kept[key].save(
+            update_fields=[
+                "answer_count",
+                "true_count",
+                "value_sum",
+                "value_counts",
+            ]
+        )
+    FormFieldDailyStat.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("surveys", "0005_visit_completed_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_buckets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="formfielddailystat",
+            constraint=models.UniqueConstraint(
+                fields=("client", "field_definition", "date", "zone"),
+                name="formfielddailystat_bucket_unique",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="formfielddailystat",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("zone__isnull", True)),
+                fields=("client", "field_definition", "date"),
+                name="formfielddailystat_bucket_no_zone_unique",
+            ),
+        ),
+    ]
@@ -3,7 +3,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from analytics.models import Client, Rep, Pharmacy, Product, Territory  # Importing from Analytics
+from analytics.models import Client, Rep, Pharmacy, Product, Territory, Zone  # Importing from Analytics
 
 try:
     from django.db.models import JSONField
@@ -147,6 +147,9 @@ class Visit(models.Model):
         indexes = [
             models.Index(fields=['client', 'rep', 'started_at']),
             models.Index(fields=['client', 'pharmacy']),
+            # Submission list: newest first, optionally per rep (keyset on completed_at)
+            models.Index(fields=['client', 'completed_at']),
+            models.Index(fields=['client', 'rep', 'completed_at']),
         ]
 
     def __str__(self):
@@ -186,22 +189,49 @@ class FormAnswer(models.Model):
 
     class Meta:
         unique_together = ('submission', 'field_definition')
+        indexes = [
+            models.Index(fields=['field_definition', 'value_bool']),
+            models.Index(fields=['field_definition', 'value_int']),
+        ]
 
 class EvidenceFile(models.Model):
     """
     Photos or files attached to a submission.
+    Uploads are stored once per tenant and content hash (see surveys.services.evidence);
+    thumbnail and preview are downscaled WebP variants made in the background.
     """
+    PROCESSING_CHOICES = [
+        ('PENDING', 'Pendiente'),
+        ('READY', 'Lista'),
+        ('FAILED', 'Fallida'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     submission = models.ForeignKey(FormSubmission, on_delete=models.CASCADE, related_name="evidence")
     answer = models.ForeignKey(FormAnswer, on_delete=models.SET_NULL, null=True, blank=True, related_name="photos")
     
     file = models.FileField(upload_to="evidence/%Y/%m/%d/")
     file_type = models.CharField(max_length=20, default='PHOTO') 
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text="SHA-256 of the file")
+    size = models.PositiveBigIntegerField(null=True, blank=True, help_text="Bytes")
+
+    # Variants
+    thumbnail = models.FileField(upload_to="evidence/thumbs/%Y/%m/%d/", blank=True)
+    preview = models.FileField(upload_to="evidence/previews/%Y/%m/%d/", blank=True)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='PENDING')
     
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    @property
+    def thumbnail_url(self):
+        return (self.thumbnail or self.file).url
+
+    @property
+    def preview_url(self):
+        return (self.preview or self.file).url
+
 # ==========================================
 # 3. SPECIALIZED DOMAINS (POP & OOS)
 # ==========================================
@@ -242,3 +272,49 @@ class StockoutObservation(models.Model):
         indexes = [
             models.Index(fields=['visit', 'product', 'is_oos']),
         ]
+
+
+# ==========================================
+# 4. RESULTS (Materialised answer statistics)
+# ==========================================
+
+class FormFieldDailyStat(models.Model):
+    """
+    Answer statistics of one question per visit day and zone, maintained incrementally
+    by surveys.services.form_stats as submissions arrive. Every column is an
+    additive counter, so any date range / zone selection is a merge of rows and
+    the results dashboard never scans FormAnswer.
+    """
+    id = models.AutoField(primary_key=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    field_definition = models.ForeignKey(FormFieldDefinition, on_delete=models.CASCADE, related_name="daily_stats")
+    date = models.DateField()
+    zone = models.ForeignKey(Zone, on_delete=models.CASCADE, null=True, blank=True)
+
+    answer_count = models.IntegerField(default=0)
+    true_count = models.IntegerField(default=0)
+    value_sum = models.FloatField(default=0)
+    value_counts = JSONField(default=dict, blank=True, help_text="{valor numérico u opción: cantidad}")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Estadística Diaria de Pregunta")
+        indexes = [
+            models.Index(fields=['field_definition', 'date']),
+            models.Index(fields=['client', 'date']),
+        ]
+        # One bucket per (client, field, day, zone), "no zone" included. Same as
+        # nulls_distinct=False, which SQLite does not support.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['client', 'field_definition', 'date', 'zone'], name='formfielddailystat_bucket_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['client', 'field_definition', 'date'], condition=models.Q(zone__isnull=True),
+                name='formfielddailystat_bucket_no_zone_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.field_definition.code} {self.date} - {self.zone or 'Sin Zona'}"
@@ -0,0 +1,95 @@
+import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+# FormAnswer column that stores each field type (SELECT / MULTI_SELECT use the option links)
+VALUE_COLUMNS = {
+    'TEXT': 'value_text',
+    'TEXT_AREA': 'value_text',
+    'INT': 'value_int',
+    'DECIMAL': 'value_decimal',
+    'BOOL': 'value_bool',
+    'DATE': 'value_date',
+}
+TYPED_COLUMNS = ('value_text', 'value_int', 'value_decimal', 'value_bool', 'value_date')
+
+TRUE_VALUES = ('true', 'on', '1', 'si', 'sí', 'yes')
+FALSE_VALUES = ('false', 'off', '0', 'no')
+
+# Bounds of FormAnswer.value_int / value_decimal (IntegerField, DecimalField(12, 2))
+INT_RANGE = (-2**31, 2**31 - 1)
+DECIMAL_LIMIT = Decimal('1e10')
+CENT = Decimal('0.01')
+
+
+def coerce_value(field_type, raw):
+    """
+    Parses one raw answer into the Python type of its field.
+    Returns None for empty answers; raises ValueError with a user-facing message
+    when the string does not parse. SELECT / MULTI_SELECT return the option codes.
+    """
+    if isinstance(raw, str):
+        raw = raw.strip()
+    if raw in (None, '', []):
+        return None
+
+    if field_type == 'BOOL':
+        if isinstance(raw, bool):
+            return raw
+        value = str(raw).lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        raise ValueError("Valor Sí/No inválido")
+
+    if field_type in ('INT', 'DECIMAL'):
+        try:
+            number = Decimal(str(raw).replace(',', '.'))
+        except InvalidOperation:
+            raise ValueError("Número inválido")
+        if not number.is_finite():
+            raise ValueError("Número inválido")
+        if field_type == 'INT':
+            if number != number.to_integral_value():
+                raise ValueError("Debe ser un número entero")
+            number = int(number)
+            if not INT_RANGE[0] <= number <= INT_RANGE[1]:
+                raise ValueError("Número fuera de rango")
+            return number
+        if abs(number) >= DECIMAL_LIMIT:
+            raise ValueError("Número fuera de rango")
+        return number.quantize(CENT, rounding=ROUND_HALF_UP)
+
+    if field_type == 'DATE':
+        if isinstance(raw, datetime.date):
+            return raw
+        try:
+            return datetime.date.fromisoformat(str(raw))
+        except ValueError:
+            raise ValueError("Fecha inválida (AAAA-MM-DD)")
+
+    if field_type in ('SELECT', 'MULTI_SELECT'):
+        if isinstance(raw, (list, tuple)):
+            codes = raw
+        elif field_type == 'MULTI_SELECT':
+            codes = str(raw).split(',')
+        else:
+            codes = [raw]
+        return [str(c).strip() for c in codes if str(c).strip()]
+
+    return str(raw)
+
+
+def typed_values(field_type, raw):
+    """
+    {column: value} to store alongside raw_value. Unparseable answers keep only
+    raw_value (every typed column None), so a bad legacy string never blocks a write.
+    """
+    values = dict.fromkeys(TYPED_COLUMNS)
+    column = VALUE_COLUMNS.get(field_type)
+    if column:
+        try:
+            values[column] = coerce_value(field_type, raw)
+        except ValueError:
+            pass
+    return values
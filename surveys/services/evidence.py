@@ -0,0 +1,202 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, transaction
+
+from surveys.models import EvidenceFile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Variants are optional: without Pillow the original file is served
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+THUMBNAIL_SIZE = (320, 320)
+PREVIEW_SIZE = (1600, 1600)
+WEBP_QUALITY = 80
+DEFAULT_EXTENSION = '.jpg'
+
+
+def content_hash(fileobj):
+    """SHA-256 of a Django File / UploadedFile, read in chunks (never the whole file in memory)."""
+    digest = hashlib.sha256()
+    for chunk in fileobj.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def check_upload(uploaded):
+    """Raises ValueError if an upload cannot be stored as evidence."""
+    if uploaded.size > settings.EVIDENCE_MAX_UPLOAD_SIZE:
+        limit = settings.EVIDENCE_MAX_UPLOAD_SIZE // (1024 * 1024)
+        raise ValueError(f"La foto '{uploaded.name}' supera el máximo de {limit} MB")
+
+
+def store_evidence(submission, uploaded, answer=None, latitude=None, longitude=None):
+    """
+    Saves an uploaded photo of a submission. Django's upload handlers already
+    spool large uploads to a temporary file; here it is hashed chunk by chunk
+    and moved (or chunk-copied) into storage, unless the tenant already stored
+    a file with the same content, in which case the new row points at that file
+    and its variants. Files are never shared across tenants.
+    Thumbnail / preview are made after commit by the worker pool.
+    """
+    check_upload(uploaded)
+    digest = content_hash(uploaded)
+    evidence = EvidenceFile(
+        submission=submission,
+        answer=answer,
+        content_hash=digest,
+        size=uploaded.size,
+        latitude=latitude,
+        longitude=longitude,
+    )
+
+    stored = (
+        EvidenceFile.objects.filter(content_hash=digest, submission__visit__client_id=submission.visit.client_id)
+        .exclude(file='')
+        .order_by('timestamp')
+        .first()
+    )
+    if stored is not None:
+        evidence.file.name = stored.file.name
+        if stored.processing_status == 'READY':
+            evidence.thumbnail.name = stored.thumbnail.name
+            evidence.preview.name = stored.preview.name
+            evidence.processing_status = 'READY'
+    else:
+        extension = os.path.splitext(uploaded.name)[1].lower() or DEFAULT_EXTENSION
+        evidence.file.save(f"{digest}{extension}", uploaded, save=False)
+    evidence.save()
+
+    if evidence.processing_status == 'PENDING':
+        transaction.on_commit(lambda: schedule_processing(evidence.id))
+    return evidence
+
+
+# ----------------------------------------------------------------------
+# Variants (background)
+# ----------------------------------------------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.EVIDENCE_WORKERS, thread_name_prefix='evidence')
+        return _executor
+
+
+def schedule_processing(evidence_id):
+    """
+    Queues the variants of a photo on the in-process worker pool. Rows left
+    PENDING by a restart are picked up by the process_evidence command.
+    """
+    if Image is None:
+        return None
+    return _get_executor().submit(_process_in_worker, evidence_id)
+
+
+def _process_in_worker(evidence_id):
+    close_old_connections()
+    try:
+        return process_evidence(evidence_id)
+    except Exception:
+        logger.exception("Evidence %s: variant generation failed", evidence_id)
+    finally:
+        connections.close_all()  # the worker thread's own connections
+
+
+def _webp(image, size):
+    variant = image.copy()
+    variant.thumbnail(size, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    variant.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return variant, buffer.getvalue()
+
+
+def render_variants(fileobj):
+    """(preview, thumbnail) WebP bytes of an image file, upright per its EXIF orientation."""
+    with Image.open(fileobj) as image:
+        # JPEG: let the decoder downscale by 1/2..1/8 instead of decoding every pixel
+        image.draft('RGB', PREVIEW_SIZE)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        preview, preview_bytes = _webp(image, PREVIEW_SIZE)
+        _, thumbnail_bytes = _webp(preview, THUMBNAIL_SIZE)
+    return preview_bytes, thumbnail_bytes
+
+
+def process_evidence(evidence_id):
+    """
+    Makes the WebP preview and thumbnail of a PENDING photo and shares them
+    with every row of the tenant with the same content. Returns the final
+    status (or None if there was nothing to do).
+    """
+    evidence = (
+        EvidenceFile.objects.filter(id=evidence_id, processing_status='PENDING')
+        .select_related('submission__visit')
+        .first()
+    )
+    if evidence is None or Image is None:
+        return None
+
+    if not evidence.content_hash:  # uploaded before hashing existed
+        with evidence.file.open('rb') as fileobj:
+            evidence.content_hash = content_hash(fileobj)
+        EvidenceFile.objects.filter(id=evidence.id).update(content_hash=evidence.content_hash, size=evidence.file.size)
+
+    same_content = EvidenceFile.objects.filter(
+        content_hash=evidence.content_hash, submission__visit__client_id=evidence.submission.visit.client_id,
+    )
+    done = same_content.filter(processing_status='READY').exclude(thumbnail='').first()
+    if done is not None:
+        same_content.filter(processing_status='PENDING').update(
+            thumbnail=done.thumbnail.name, preview=done.preview.name, processing_status='READY',
+        )
+        return 'READY'
+
+    try:
+        with evidence.file.open('rb') as fileobj:
+            preview_bytes, thumbnail_bytes = render_variants(fileobj)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning("Evidence %s: not a readable image (%s)", evidence.id, exc)
+        same_content.filter(processing_status='PENDING').update(processing_status='FAILED')
+        return 'FAILED'
+
+    name = f"{evidence.content_hash}.webp"
+    evidence.preview.save(name, ContentFile(preview_bytes), save=False)
+    evidence.thumbnail.save(name, ContentFile(thumbnail_bytes), save=False)
+    same_content.update(thumbnail=evidence.thumbnail.name, preview=evidence.preview.name, processing_status='READY')
+    return 'READY'
+
+
+def process_pending_evidence(evidence=None, workers=None):
+    """Processes every PENDING photo on a worker pool; returns {status: count}."""
+    evidence = evidence if evidence is not None else EvidenceFile.objects.all()
+    pending = (
+        evidence.filter(processing_status='PENDING').exclude(file='')
+        .values_list('id', 'submission__visit__client_id', 'content_hash')
+    )
+    # One job per tenant and content: process_evidence hands the variants to the other rows
+    ids = list({
+        (client_id, digest or evidence_id): evidence_id for evidence_id, client_id, digest in pending
+    }.values())
+    counts = {}
+    with ThreadPoolExecutor(max_workers=workers or settings.EVIDENCE_WORKERS) as pool:
+        for status in pool.map(_process_in_worker, ids):
+            counts[status] = counts.get(status, 0) + 1
+    return counts
@@ -0,0 +1,181 @@
+import csv
+
+from django.utils import timezone
+
+from surveys.models import FormAnswer, FormFieldDefinition, FormSubmission
+from surveys.services.answer_values import VALUE_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+# Leading columns of every row (header, values_list path)
+META_COLUMNS = (
+    ('submission_id', 'id'),
+    ('submitted_at', 'submitted_at'),
+    ('completed_at', 'visit__completed_at'),
+    ('pharmacy_code', 'visit__pharmacy__code'),
+    ('pharmacy', 'visit__pharmacy__display_name'),
+    ('zone', 'visit__pharmacy__territory__zone__name'),
+    ('rep', 'visit__rep__external_id'),
+    ('form_version', 'form_definition__version'),
+)
+ANSWER_COLUMNS = ('submission_id', 'field_definition_id', 'raw_value', *sorted(set(VALUE_COLUMNS.values())))
+ITERATOR_CHUNK = 5000
+
+
+class _Echo:
+    """File-like object whose write() returns the line, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+class SubmissionPivot:
+    """
+    Wide layout of the answers of one form: one row per submission, one column
+    per question (field code). Submissions and answers are streamed as two
+    queries ordered by submission id and merge-joined, so memory stays constant
+    whatever the number of submissions. Columns are the questions of the
+    current version; answers of every version land in them by field code, as
+    in form_results. Typed fields export their value_* column, the rest (and
+    untyped legacy answers) their raw_value.
+    """
+
+    def __init__(self, schema, since=None, until=None):
+        self.schema = schema
+        self.since = since
+        self.until = until
+        self.fields = [f for f in schema.input_fields if f.field_type != 'PHOTO']
+        self._answer_value = {column: i for i, column in enumerate(ANSWER_COLUMNS)}
+        self._field_index = None
+
+    @property
+    def field_index(self):
+        """{field id (any version): (position in the row, typed column or None)}."""
+        if self._field_index is None:
+            positions = {f.code: len(META_COLUMNS) + i for i, f in enumerate(self.fields)}
+            versions = FormFieldDefinition.objects.filter(
+                form__client_id=self.schema.client_id, form__code=self.schema.code, code__in=list(positions),
+            ).values_list('id', 'code', 'field_type')
+            self._field_index = {
+                field_id: (positions[code], VALUE_COLUMNS.get(field_type))
+                for field_id, code, field_type in versions
+            }
+        return self._field_index
+
+    @property
+    def header(self):
+        return [name for name, _ in META_COLUMNS] + [f.code for f in self.fields]
+
+    def submissions(self):
+        queryset = FormSubmission.objects.filter(
+            form_definition__client_id=self.schema.client_id, form_definition__code=self.schema.code,
+        )
+        if self.since:
+            queryset = queryset.filter(submitted_at__gte=self.since)
+        if self.until:
+            queryset = queryset.filter(submitted_at__lt=self.until)
+        return queryset
+
+    def rows(self):
+        """Yields one list per submission, in submission id order."""
+        submissions = (
+            self.submissions().order_by('id')
+            .values_list(*(path for _, path in META_COLUMNS))
+            .iterator(chunk_size=ITERATOR_CHUNK)
+        )
+        answers = (
+            FormAnswer.objects.filter(submission__in=self.submissions(), field_definition_id__in=list(self.field_index))
+            .order_by('submission_id')
+            .values_list(*ANSWER_COLUMNS)
+            .iterator(chunk_size=ITERATOR_CHUNK)
+        )
+        width = len(META_COLUMNS) + len(self.fields)
+        pending = next(answers, None)
+        for meta in submissions:
+            row = list(meta) + [None] * (width - len(meta))
+            # The two queries are separate snapshots: answers of a submission committed
+            # in between have no row in the submissions stream and are skipped
+            while pending is not None and pending[0] < meta[0]:
+                pending = next(answers, None)
+            while pending is not None and pending[0] == meta[0]:
+                position, column = self.field_index[pending[1]]
+                value = pending[self._answer_value[column]] if column else None
+                row[position] = value if value is not None else pending[2]
+                pending = next(answers, None)
+            yield row
+
+    # ------------------------------------------------------------------
+    # Writers
+    # ------------------------------------------------------------------
+
+    def write_csv(self, fileobj):
+        writer = csv.writer(fileobj)
+        writer.writerow(self.header)
+        count = 0
+        for row in self.rows():
+            writer.writerow(self._csv_cell(value) for value in row)
+            count += 1
+        return count
+
+    def csv_lines(self):
+        """CSV text line by line, for StreamingHttpResponse."""
+        writer = csv.writer(_Echo())
+        yield writer.writerow(self.header)
+        for row in self.rows():
+            yield writer.writerow(self._csv_cell(value) for value in row)
+
+    @staticmethod
+    def _csv_cell(value):
+        if value is None:
+            return ''
+        if hasattr(value, 'tzinfo') and value.tzinfo is not None:
+            return timezone.localtime(value).isoformat(timespec='seconds')
+        return value
+
+    def arrow_schema(self):
+        types = {'INT': pa.int64(), 'DECIMAL': pa.float64(), 'BOOL': pa.bool_(), 'DATE': pa.date32()}
+        meta_types = {'submitted_at': pa.timestamp('us', tz='UTC'), 'completed_at': pa.timestamp('us', tz='UTC'),
+                      'form_version': pa.int32()}
+        return pa.schema(
+            [(name, meta_types.get(name, pa.string())) for name, _ in META_COLUMNS]
+            + [(f.code, types.get(f.field_type, pa.string())) for f in self.fields]
+        )
+
+    def write_parquet(self, path, batch_rows=50000):
+        """Writes one row group per `batch_rows` submissions. Requires pyarrow."""
+        if pa is None:
+            raise ImportError("La exportación a Parquet requiere pyarrow")
+        schema = self.arrow_schema()
+        typed = {name: schema.field(name).type for name in schema.names}
+        count = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            batch = []
+            for row in self.rows():
+                batch.append(row)
+                if len(batch) >= batch_rows:
+                    writer.write_batch(self._record_batch(batch, schema, typed))
+                    count += len(batch)
+                    batch = []
+            if batch:
+                writer.write_batch(self._record_batch(batch, schema, typed))
+                count += len(batch)
+        return count
+
+    @staticmethod
+    def _record_batch(rows, schema, typed):
+        columns = []
+        for i, name in enumerate(schema.names):
+            values = [row[i] for row in rows]
+            if typed[name] == pa.string():
+                values = [None if v is None else str(v) for v in values]
+            else:
+                # raw_value fallbacks of untyped answers (run backfill_answer_values first)
+                values = [None if isinstance(v, str) else v for v in values]
+                if typed[name] == pa.float64():
+                    values = [None if v is None else float(v) for v in values]
+            columns.append(pa.array(values, type=typed[name]))
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
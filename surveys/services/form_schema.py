@@ -0,0 +1,178 @@
+import threading
+
+from django.core.cache import caches
+
+from analytics.models import Product
+from analytics.services import generations
+from surveys.models import FormDefinition
+from surveys.services.answer_values import coerce_value
+
+CACHE_ALIAS = 'shared'
+CACHE_TIMEOUT = 24 * 60 * 60
+
+# Field codes OOS_<sku> record a stockout of that product
+OOS_PREFIX = 'OOS_'
+
+
+class CompiledField:
+    """Plain, picklable snapshot of a FormFieldDefinition with its catalog options and validator."""
+
+    def __init__(self, field, options):
+        self.id = field.id
+        self.code = field.code
+        self.label = field.label
+        self.field_type = field.field_type
+        self.order = field.order
+        self.required = field.required
+        self.help_text = field.help_text
+        self.catalog_id = field.catalog_id
+        self.min_value = field.min_value
+        self.max_value = field.max_value
+        self.conditions = field.conditions
+        self.options = options  # [{'id', 'code', 'label'}] in catalog order
+        self.option_ids = {o['code']: o['id'] for o in options}
+        self.oos_sku = field.code[len(OOS_PREFIX):] if field.code.startswith(OOS_PREFIX) else None
+
+    @property
+    def is_input(self):
+        return self.field_type != 'SECTION_HEADER'
+
+    def clean(self, raw):
+        """
+        Validates and coerces one raw answer (str, or list for MULTI_SELECT).
+        Returns the typed value (None when empty); raises ValueError with a
+        user-facing message when the answer is invalid.
+        """
+        value = coerce_value(self.field_type, raw)
+        if value in (None, []):
+            if self.required and self.field_type not in ('BOOL', 'PHOTO'):
+                raise ValueError("Campo obligatorio")
+            return None
+
+        if self.field_type in ('INT', 'DECIMAL'):
+            if self.min_value is not None and value < self.min_value:
+                raise ValueError(f"Mínimo {self.min_value}")
+            if self.max_value is not None and value > self.max_value:
+                raise ValueError(f"Máximo {self.max_value}")
+
+        if self.field_type in ('SELECT', 'MULTI_SELECT'):
+            unknown = [c for c in value if c not in self.option_ids]
+            if unknown and self.catalog_id:
+                raise ValueError(f"Opción inválida: {', '.join(unknown)}")
+            if self.field_type == 'SELECT':
+                if len(value) != 1:
+                    raise ValueError("Seleccione una opción")
+                return value[0]
+
+        return value
+
+
+class CompiledFormSchema:
+    """
+    Everything needed to render, validate and persist one FormDefinition version,
+    built with a fixed number of queries and cached per (client, code, version).
+    """
+
+    def __init__(self, form, fields, oos_products):
+        self.form_id = form.id
+        self.client_id = form.client_id
+        self.code = form.code
+        self.version = form.version
+        self.title = form.title
+        self.description = form.description
+        self.allow_photos = form.allow_photos
+        self.fields = fields
+        self.fields_by_code = {f.code: f for f in fields}
+        self.oos_products = oos_products  # {sku: product id}
+
+    @property
+    def input_fields(self):
+        return [f for f in self.fields if f.is_input]
+
+    def validate(self, data):
+        """
+        Cleans a {code: raw value} mapping against the schema.
+        Returns ({code: typed value}, {code: error message}); unknown codes are errors.
+        """
+        cleaned, errors = {}, {}
+        for code in data:
+            if code not in self.fields_by_code:
+                errors[code] = "Campo desconocido"
+        for field in self.input_fields:
+            try:
+                cleaned[field.code] = field.clean(data.get(field.code))
+            except ValueError as exc:
+                errors[field.code] = str(exc)
+        return cleaned, errors
+
+    @classmethod
+    def compile(cls, form):
+        """Three queries: fields with catalogs, options of those catalogs, OOS products."""
+        fields = list(form.fields.select_related('catalog').prefetch_related('catalog__options').order_by('order'))
+        compiled = []
+        for field in fields:
+            options = []
+            if field.catalog_id:
+                options = [{'id': o.id, 'code': o.code, 'label': o.label} for o in field.catalog.options.all()]
+            compiled.append(CompiledField(field, options))
+
+        skus = [f.oos_sku for f in compiled if f.oos_sku]
+        oos_products = {}
+        if skus:
+            oos_products = dict(Product.objects.filter(client_id=form.client_id, sku__in=skus).values_list('sku', 'id'))
+        return cls(form, compiled, oos_products)
+
+
+# ----------------------------------------------------------------------
+# Two-level cache: per-process dict in front of the shared cache. Keys embed
+# a per-tenant generation counter, bumped by surveys.signals on admin edits.
+# ----------------------------------------------------------------------
+
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _generation_key(client_id):
+    return f"form_schema:gen:{client_id}"
+
+
+def get_generation(client_id):
+    return generations.get_generation(caches[CACHE_ALIAS], _generation_key(client_id))
+
+
+def invalidate_form_schemas(client_id):
+    generations.bump_generation(caches[CACHE_ALIAS], _generation_key(client_id))
+
+
+def get_form_schema(client_id, code, version=None):
+    """
+    Compiled schema of a form; `version=None` means the latest active version.
+    Returns None if there is no such form.
+    """
+    generation = get_generation(client_id)
+    key = f"form_schema:{client_id}:{code}:{version or 'active'}:{generation}"
+
+    with _local_lock:
+        schema = _local.get(key)
+    if schema is not None:
+        return schema
+
+    cache = caches[CACHE_ALIAS]
+    schema = cache.get(key)
+    if schema is None:
+        forms = FormDefinition.objects.filter(client_id=client_id, code=code)
+        if version is None:
+            form = forms.filter(is_active=True).order_by('-version').first()
+        else:
+            form = forms.filter(version=version).first()
+        if form is None:
+            return None
+        schema = CompiledFormSchema.compile(form)
+        cache.set(key, schema, CACHE_TIMEOUT)
+
+    with _local_lock:
+        # Entries of older generations are never read again; drop them
+        for stale in [k for k in _local if k.startswith(f"form_schema:{client_id}:") and not k.endswith(f":{generation}")]:
+            del _local[stale]
+        _local[key] = schema
+    return schema
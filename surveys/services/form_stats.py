@@ -0,0 +1,359 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from analytics.models import Zone
+from surveys.models import FormAnswer, FormFieldDailyStat, FormFieldDefinition, FormSubmission
+from surveys.services.answer_values import coerce_value
+
+NUMERIC_TYPES = ('INT', 'DECIMAL')
+OPTION_TYPES = ('SELECT', 'MULTI_SELECT')
+# Distinct numeric values up to which the histogram has one bar per value
+HISTOGRAM_BINS = 10
+PERCENTILES = (25, 50, 75, 90)
+
+ANSWER_ROW = ('submission_id', 'field_definition_id', 'raw_value', 'value_int', 'value_decimal', 'value_bool')
+SUBMISSION_ROW = (
+    'id', 'form_definition__client_id', 'visit__completed_at', 'submitted_at', 'visit__pharmacy__territory__zone_id',
+)
+
+
+class StatDelta:
+    """Additive counters of one (client, field, day, zone) bucket."""
+
+    __slots__ = ('answer_count', 'true_count', 'value_sum', 'value_counts')
+
+    def __init__(self):
+        self.answer_count = 0
+        self.true_count = 0
+        self.value_sum = 0.0
+        self.value_counts = Counter()
+
+    def __bool__(self):
+        return bool(self.answer_count or self.true_count or self.value_sum or any(self.value_counts.values()))
+
+    def add(self, field_type, raw_value, value_int, value_decimal, value_bool, sign=1):
+        """Counts one answer (sign=-1 takes it back out: deleted or edited answers)."""
+        if field_type in NUMERIC_TYPES:
+            number = value_int if field_type == 'INT' else value_decimal
+            if number is None:
+                number = _parse(field_type, raw_value)
+            if number is None:
+                return
+            self.value_sum += sign * float(number)
+            self.value_counts[str(number)] += sign
+        elif field_type == 'BOOL':
+            if value_bool is None:
+                value_bool = _parse(field_type, raw_value)
+            if value_bool is None:
+                return
+            self.true_count += sign * value_bool
+        elif field_type in OPTION_TYPES:
+            codes = coerce_value(field_type, raw_value)
+            if not codes:
+                return
+            for code in codes:
+                self.value_counts[code] += sign
+        elif not raw_value:
+            return
+        self.answer_count += sign
+
+    def merge_into(self, stat):
+        stat.answer_count += self.answer_count
+        stat.true_count += self.true_count
+        stat.value_sum += self.value_sum
+        counts = Counter(stat.value_counts or {})
+        for value, count in self.value_counts.items():
+            counts[value] += count
+        stat.value_counts = {value: count for value, count in counts.items() if count > 0}
+
+
+def _parse(field_type, raw_value):
+    """Typed value of an answer written before value_* columns were populated."""
+    try:
+        return coerce_value(field_type, raw_value)
+    except ValueError:
+        return None
+
+
+def bucket_keys(submissions):
+    """
+    {submission id: (client, day, zone)} for a FormSubmission queryset. The day
+    is the one the visit was completed, not the one the device synced it
+    (submitted_at, the fallback for visits without a completion time).
+    """
+    return {
+        submission_id: (client_id, timezone.localtime(completed_at or submitted_at).date(), zone_id)
+        for submission_id, client_id, completed_at, submitted_at, zone_id
+        in submissions.values_list(*SUBMISSION_ROW).iterator()
+    }
+
+
+def field_types(client_id):
+    return dict(
+        FormFieldDefinition.objects.filter(form__client_id=client_id)
+        .exclude(field_type__in=['SECTION_HEADER', 'PHOTO'])
+        .values_list('id', 'field_type')
+    )
+
+
+def accumulate(rows, buckets, types, sign=1, deltas=None):
+    """
+    Folds answer rows (ANSWER_ROW tuples) into {(client, field, day, zone): StatDelta}.
+    buckets: bucket_keys() of their submissions; types: {field id: field type}.
+    sign=-1 subtracts the rows; pass the result back as `deltas` to net several folds.
+    """
+    deltas = defaultdict(StatDelta, deltas or {})
+    for submission_id, field_id, raw_value, value_int, value_decimal, value_bool in rows:
+        field_type = types.get(field_id)
+        if field_type is None or submission_id not in buckets:
+            continue
+        client_id, day, zone_id = buckets[submission_id]
+        deltas[(client_id, field_id, day, zone_id)].add(
+            field_type, raw_value, value_int, value_decimal, value_bool, sign,
+        )
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_deltas(deltas, attempts=3):
+    """
+    Adds the deltas to the stored buckets: existing rows are locked, merged and
+    updated, missing ones bulk-created. A bucket created meanwhile by a concurrent
+    writer trips the unique constraint: the batch is then retried, merging into it.
+    Buckets left without answers are deleted.
+    """
+    if not deltas:
+        return 0
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                _apply_deltas(deltas)
+            return len(deltas)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def _apply_deltas(deltas):
+    field_ids = {key[1] for key in deltas}
+    days = {key[2] for key in deltas}
+    existing = {
+        (stat.client_id, stat.field_definition_id, stat.date, stat.zone_id): stat
+        for stat in FormFieldDailyStat.objects.select_for_update().filter(field_definition_id__in=field_ids, date__in=days)
+    }
+
+    to_update, to_create, to_delete = [], [], []
+    for key, delta in deltas.items():
+        stat = existing.get(key)
+        if stat is None:
+            if delta.answer_count <= 0:
+                continue  # taking out answers that were never counted (recorded before the stats existed)
+            client_id, field_id, day, zone_id = key
+            stat = FormFieldDailyStat(client_id=client_id, field_definition_id=field_id, date=day, zone_id=zone_id)
+            delta.merge_into(stat)
+            to_create.append(stat)
+            continue
+        delta.merge_into(stat)
+        (to_update if stat.answer_count > 0 else to_delete).append(stat)
+
+    # Row-wise UPDATEs by pk: cheaper than bulk_update's CASE WHEN over JSON values
+    for stat in to_update:
+        stat.save(update_fields=['answer_count', 'true_count', 'value_sum', 'value_counts', 'updated_at'])
+    if to_delete:
+        FormFieldDailyStat.objects.filter(id__in=[stat.id for stat in to_delete]).delete()
+    FormFieldDailyStat.objects.bulk_create(to_create, batch_size=500)
+
+
+def _submission_types(buckets):
+    types = {}
+    for client_id in {client for client, _, _ in buckets.values()}:
+        types.update(field_types(client_id))
+    return types
+
+
+def record_submissions(submission_ids):
+    """Folds new submissions into the statistics (called on commit by the submission views)."""
+    buckets = bucket_keys(FormSubmission.objects.filter(id__in=submission_ids))
+    if not buckets:
+        return 0
+    rows = FormAnswer.objects.filter(submission_id__in=list(buckets)).values_list(*ANSWER_ROW)
+    return apply_deltas(accumulate(rows, buckets, _submission_types(buckets)))
+
+
+def submission_removal_deltas(submission_ids):
+    """
+    Deltas taking submissions back out of the statistics. Computed before the
+    delete (while their answers still exist) and applied once it commits.
+    """
+    buckets = bucket_keys(FormSubmission.objects.filter(id__in=submission_ids))
+    if not buckets:
+        return {}
+    rows = FormAnswer.objects.filter(submission_id__in=list(buckets)).values_list(*ANSWER_ROW)
+    return accumulate(rows, buckets, _submission_types(buckets), sign=-1)
+
+
+def stored_answer_row(answer_id):
+    """ANSWER_ROW of an answer as currently stored (None if it is new)."""
+    return FormAnswer.objects.filter(id=answer_id).values_list(*ANSWER_ROW).first()
+
+
+def answer_edit_deltas(previous_row, answer):
+    """Deltas of an edited answer: its stored version out, the new one in."""
+    buckets = bucket_keys(FormSubmission.objects.filter(id=answer.submission_id))
+    if not buckets:
+        return {}
+    types = _submission_types(buckets)
+    current = tuple(getattr(answer, column) for column in ANSWER_ROW)
+    deltas = accumulate([previous_row], buckets, types, sign=-1)
+    return accumulate([current], buckets, types, deltas=deltas)
+
+
+def rebuild_form_stats(client_id, chunk_size=5000):
+    """
+    Recomputes every bucket of a tenant from FormAnswer: backfill, or repair after
+    answers were added to / removed from an existing submission one by one
+    (submission creates, deletes and answer edits are kept up to date on commit).
+    """
+    buckets = bucket_keys(FormSubmission.objects.filter(form_definition__client_id=client_id))
+    rows = (
+        FormAnswer.objects.filter(submission__form_definition__client_id=client_id)
+        .values_list(*ANSWER_ROW)
+        .iterator(chunk_size=chunk_size)
+    )
+    deltas = accumulate(rows, buckets, field_types(client_id))
+    stats = []
+    for (client, field_id, day, zone_id), delta in deltas.items():
+        stat = FormFieldDailyStat(client_id=client, field_definition_id=field_id, date=day, zone_id=zone_id)
+        delta.merge_into(stat)
+        stats.append(stat)
+    with transaction.atomic():
+        FormFieldDailyStat.objects.filter(client_id=client_id).delete()
+        FormFieldDailyStat.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
+
+
+# ----------------------------------------------------------------------
+# Dashboard: merges the buckets of a date range / zone into per-question results
+# ----------------------------------------------------------------------
+
+def _percentile(values, counts, q):
+    """q-th percentile of a sorted value -> count distribution (nearest rank)."""
+    target = q / 100 * sum(counts)
+    running = 0
+    for value, count in zip(values, counts):
+        running += count
+        if running >= target:
+            return value
+    return values[-1]
+
+
+def _histogram(values, counts):
+    if len(values) <= HISTOGRAM_BINS:
+        bars = [(f"{v:g}", c) for v, c in zip(values, counts)]
+    else:
+        low, high = values[0], values[-1]
+        width = (high - low) / HISTOGRAM_BINS
+        bins = [0] * HISTOGRAM_BINS
+        for value, count in zip(values, counts):
+            bins[min(int((value - low) / width), HISTOGRAM_BINS - 1)] += count
+        bars = [(f"{low + i * width:g}–{low + (i + 1) * width:g}", c) for i, c in enumerate(bins)]
+    peak = max(c for _, c in bars) or 1
+    return [{'label': label, 'count': count, 'pct': round(100 * count / peak)} for label, count in bars]
+
+
+def _summary(field, totals):
+    """Headline numbers of one question from its merged counters."""
+    n = totals['answer_count']
+    result = {'answers': n}
+    if not n:
+        return result
+    if field.field_type == 'BOOL':
+        result['true_rate'] = round(100 * totals['true_count'] / n, 1)
+    elif field.field_type in NUMERIC_TYPES:
+        distribution = sorted((float(v), c) for v, c in totals['value_counts'].items())
+        values, counts = [v for v, _ in distribution], [c for _, c in distribution]
+        result['mean'] = round(totals['value_sum'] / n, 2)
+        result['min'], result['max'] = values[0], values[-1]
+        result['percentiles'] = [(q, _percentile(values, counts, q)) for q in PERCENTILES]
+        result['histogram'] = _histogram(values, counts)
+    elif field.field_type in OPTION_TYPES:
+        labels = {o['code']: o['label'] for o in field.options}
+        result['options'] = [
+            {'code': code, 'label': labels.get(code, code), 'count': count, 'pct': round(100 * count / n, 1)}
+            for code, count in Counter(totals['value_counts']).most_common()
+        ]
+    return result
+
+
+def _headline(field, totals):
+    """Single comparable figure for the zone / date breakdowns."""
+    n = totals['answer_count']
+    if not n:
+        return None
+    if field.field_type == 'BOOL':
+        return round(100 * totals['true_count'] / n, 1)
+    if field.field_type in NUMERIC_TYPES:
+        return round(totals['value_sum'] / n, 2)
+    if field.field_type in OPTION_TYPES and totals['value_counts']:
+        code, count = Counter(totals['value_counts']).most_common(1)[0]
+        labels = {o['code']: o['label'] for o in field.options}
+        return f"{labels.get(code, code)} ({round(100 * count / n)}%)"
+    return None
+
+
+def form_results(schema, date_from=None, date_to=None, zone_id=None):
+    """
+    Results of the questions of a form (every version, matched by field code)
+    from the daily buckets: overall summary plus breakdowns by zone and by day.
+    """
+    stats = FormFieldDailyStat.objects.filter(
+        client_id=schema.client_id,
+        field_definition__form__code=schema.code,
+    )
+    if date_from:
+        stats = stats.filter(date__gte=date_from)
+    if date_to:
+        stats = stats.filter(date__lte=date_to)
+    if zone_id:
+        stats = stats.filter(zone_id=zone_id)
+
+    def empty():
+        return {'answer_count': 0, 'true_count': 0, 'value_sum': 0.0, 'value_counts': Counter()}
+
+    overall = defaultdict(empty)
+    by_zone = defaultdict(lambda: defaultdict(empty))
+    by_date = defaultdict(lambda: defaultdict(empty))
+    rows = stats.values_list(
+        'field_definition__code', 'date', 'zone_id', 'answer_count', 'true_count', 'value_sum', 'value_counts',
+    )
+    for code, day, zone, answer_count, true_count, value_sum, value_counts in rows.iterator(chunk_size=2000):
+        for totals in (overall[code], by_zone[code][zone], by_date[code][day]):
+            totals['answer_count'] += answer_count
+            totals['true_count'] += true_count
+            totals['value_sum'] += value_sum
+            totals['value_counts'].update(value_counts or {})
+
+    zone_ids = {zone for zones in by_zone.values() for zone in zones if zone}
+    zone_names = dict(Zone.objects.filter(id__in=zone_ids).values_list('id', 'name'))
+
+    results = []
+    for field in schema.input_fields:
+        if field.field_type == 'PHOTO':
+            continue
+        result = _summary(field, overall[field.code])
+        result['field'] = field
+        result['by_zone'] = sorted(
+            (
+                {'zone': zone_names.get(zone, 'Sin Zona'), 'answers': totals['answer_count'],
+                 'headline': _headline(field, totals)}
+                for zone, totals in by_zone[field.code].items()
+            ),
+            key=lambda row: -row['answers'],
+        )
+        result['by_date'] = [
+            {'date': day, 'answers': totals['answer_count'], 'headline': _headline(field, totals)}
+            for day, totals in sorted(by_date[field.code].items())
+        ]
+        results.append(result)
+    return results
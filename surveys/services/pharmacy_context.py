@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.utils import timezone
+
+from analytics.models import Pharmacy, SalesDocument, SalesLine, CommercialAgreement
+from analytics.services.market_basket import frequently_bought_with
+from analytics.services.prediction import ReorderPredictor
+from surveys.models import Visit
+
+CACHE_ALIAS = 'shared'
+
+
+def _cache_key(pharmacy_id):
+    return f"pharmacy_context:{pharmacy_id}"
+
+
+def build_pharmacy_context(pharmacy):
+    """Payload of the pharmacy context panel shown while filling a form."""
+    # Date Range: Last 30 Days (from start of day)
+    end_date = timezone.now()
+    start_date = (end_date - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Query Sales Documents
+    docs = SalesDocument.objects.filter(
+        pharmacy=pharmacy,
+        date__range=(start_date, end_date)
+    )
+
+    # Aggregations
+    orders_count = docs.count()
+    total_sales = docs.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
+
+    # Top Products (by quantity)
+    top_products = (
+        SalesLine.objects
+        .filter(document__in=docs)
+        .values('product_id', 'product__name')
+        .annotate(qty=Sum('quantity'))
+        .order_by('-qty')[:3]
+    )
+    top_products = [dict(p, product_id=str(p['product_id'])) for p in top_products]
+
+    # Cross-sell: products usually bought together with the top ones
+    bought_with = frequently_bought_with(pharmacy.client_id, [p['product_id'] for p in top_products])
+
+    # Agreement Data
+    agreement = CommercialAgreement.objects.filter(
+        pharmacy=pharmacy,
+        is_active=True,
+        end_date__gte=timezone.now().date()
+    ).first()
+
+    # Prediction (Local AI): the nightly batch, live only for pharmacies it has not covered
+    predictor = ReorderPredictor(pharmacy.id)
+    suggestions = predictor.get_stored_suggestions() or predictor.get_suggestions()
+
+    return {
+        'pharmacy_name': pharmacy.display_name,
+        'orders_count': orders_count,
+        'total_sales': float(total_sales),
+        'top_products': top_products,
+        'frequently_bought_with': bought_with,
+        'has_agreement': bool(agreement),
+        'agreement_summary': agreement.description if agreement else "",
+        'predictions': suggestions
+    }
+
+
+def get_cached_context(pharmacy_id):
+    """Cached payload or None; a hit costs no database query."""
+    return caches[CACHE_ALIAS].get(_cache_key(pharmacy_id))
+
+
+def cache_pharmacy_context(pharmacy, timeout=None):
+    data = build_pharmacy_context(pharmacy)
+    caches[CACHE_ALIAS].set(_cache_key(pharmacy.id), data, timeout or settings.PHARMACY_CONTEXT_TTL)
+    return data
+
+
+def invalidate_pharmacy_context(pharmacy_id):
+    caches[CACHE_ALIAS].delete(_cache_key(pharmacy_id))
+
+
+def prewarm_pharmacy_contexts(pharmacies):
+    """
+    Builds and caches the context of each pharmacy for the whole route day
+    (PHARMACY_CONTEXT_PREWARM_TTL); returns how many were built.
+    """
+    count = 0
+    for pharmacy in pharmacies:
+        cache_pharmacy_context(pharmacy, timeout=settings.PHARMACY_CONTEXT_PREWARM_TTL)
+        count += 1
+    return count
+
+
+def scheduled_pharmacies(day, rep=None, client=None):
+    """Pharmacies on the reps' scheduled route (Visit.scheduled_at) for a day."""
+    visits = Visit.objects.filter(scheduled_at__date=day)
+    if rep is not None:
+        visits = visits.filter(rep=rep)
+    if client is not None:
+        visits = visits.filter(client=client)
+    return list(Pharmacy.objects.filter(id__in=visits.values('pharmacy_id')).distinct())
+
+
+ROUTE_RECENT_VISITS = 100
+ROUTE_PHARMACY_LIMIT = 50
+
+
+def route_pharmacies(rep, day=None, limit=ROUTE_PHARMACY_LIMIT):
+    """
+    Pharmacies a rep is likely to visit: the day's scheduled route first, then
+    the most recently visited ones. Rendered into the form page so the
+    selector works without connection (offline visits). Dicts with id, code,
+    display_name and city, like the typeahead results.
+    """
+    day = day or timezone.localdate()
+    scheduled = (
+        Visit.objects.filter(rep=rep, scheduled_at__date=day)
+        .order_by('scheduled_at').values_list('pharmacy_id', flat=True)
+    )
+    recent = (
+        Visit.objects.filter(client_id=rep.client_id, rep=rep)
+        .order_by('-started_at').values_list('pharmacy_id', flat=True)[:ROUTE_RECENT_VISITS]
+    )
+    ids = list(dict.fromkeys([*scheduled, *recent]))[:limit]
+    rows = {
+        row['id']: row
+        for row in Pharmacy.objects.filter(id__in=ids, client_id=rep.client_id, is_active=True)
+        .values('id', 'code', 'display_name', 'city')
+    }
+    return [dict(rows[pk], id=str(pk)) for pk in ids if pk in rows]
@@ -0,0 +1,111 @@
+import base64
+import binascii
+import datetime
+import json
+import uuid
+
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from surveys.models import EvidenceFile, FormSubmission
+
+PAGE_SIZE = 50
+THUMBNAILS_PER_ROW = 3
+
+# Columns of one list row (no model instances are built)
+ROW_FIELDS = (
+    'id',
+    'visit__completed_at',
+    'visit__status',
+    'visit__pharmacy__display_name',
+    'visit__pharmacy__city',
+    'visit__rep__user__username',
+    'visit__rep__user__first_name',
+    'visit__rep__user__last_name',
+    'form_definition__title',
+    'form_definition__version',
+)
+
+
+def encode_cursor(completed_at, submission_id):
+    raw = json.dumps([completed_at.isoformat(), str(submission_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(completed_at, submission id) of a cursor; ValueError if it is not one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        completed_at, submission_id = json.loads(raw)
+        parsed = parse_datetime(completed_at)
+        submission_id = uuid.UUID(submission_id)
+    except (AttributeError, binascii.Error, TypeError, UnicodeDecodeError, ValueError):
+        # Well-formed JSON can still hold the wrong types (uuid.UUID(5) -> AttributeError)
+        raise ValueError("Cursor inválido")
+    if parsed is None:
+        raise ValueError("Cursor inválido")
+    return parsed, submission_id
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def filter_submissions(client_id, form_code=None, rep_id=None, zone_id=None, date_from=None, date_to=None):
+    """
+    Completed submissions of a tenant. Dates bound visit.completed_at with
+    plain range comparisons (not __date) so the (client, [rep,] completed_at)
+    indexes of Visit drive the scan.
+    """
+    submissions = FormSubmission.objects.filter(visit__client_id=client_id, visit__completed_at__isnull=False)
+    if form_code:
+        submissions = submissions.filter(form_definition__code=form_code)
+    if rep_id:
+        submissions = submissions.filter(visit__rep_id=rep_id)
+    if zone_id:
+        submissions = submissions.filter(visit__pharmacy__territory__zone_id=zone_id)
+    if date_from:
+        submissions = submissions.filter(visit__completed_at__gte=_day_start(date_from))
+    if date_to:
+        submissions = submissions.filter(visit__completed_at__lt=_day_start(date_to + datetime.timedelta(days=1)))
+    return submissions
+
+
+def submission_page(submissions, cursor=None, page_size=PAGE_SIZE):
+    """
+    One page of list rows, newest first, keyset-paginated on
+    (visit.completed_at, submission id): the cost of a page does not grow
+    with its depth. Returns (rows, cursor of the next page or None).
+    """
+    if cursor is not None:
+        completed_at, submission_id = cursor
+        submissions = submissions.filter(
+            # The plain bound lets the index seek; the OR only breaks ties
+            Q(visit__completed_at__lte=completed_at),
+            Q(visit__completed_at__lt=completed_at) | Q(visit__completed_at=completed_at, id__lt=submission_id),
+        )
+    rows = list(submissions.order_by('-visit__completed_at', '-id').values(*ROW_FIELDS)[:page_size + 1])
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1]['visit__completed_at'], rows[-1]['id'])
+
+    thumbnails = {}
+    evidence = (
+        EvidenceFile.objects.filter(submission_id__in=[row['id'] for row in rows])
+        .order_by('timestamp')
+        .values_list('submission_id', 'file', 'thumbnail')
+    )
+    for submission_id, file_name, thumbnail_name in evidence:
+        urls = thumbnails.setdefault(submission_id, [])
+        if len(urls) < THUMBNAILS_PER_ROW:
+            urls.append(default_storage.url(thumbnail_name or file_name))
+
+    for row in rows:
+        full_name = f"{row['visit__rep__user__first_name']} {row['visit__rep__user__last_name']}".strip()
+        row['rep_name'] = full_name or row['visit__rep__user__username']
+        row['thumbnails'] = thumbnails.get(row['id'], [])
+    return rows, next_cursor
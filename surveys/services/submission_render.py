@@ -0,0 +1,93 @@
+from django.core.cache import caches
+
+from surveys.models import CatalogOption, EvidenceFile
+from surveys.services.answer_values import coerce_value
+from surveys.services.form_schema import CACHE_ALIAS, CACHE_TIMEOUT, get_generation
+
+OPTION_TYPES = ('SELECT', 'MULTI_SELECT')
+
+# Columns of the answers query (field metadata comes along in the same SELECT)
+ANSWER_FIELDS = (
+    'id',
+    'raw_value',
+    'field_definition__label',
+    'field_definition__field_type',
+    'field_definition__catalog_id',
+    'field_definition__order',
+)
+
+
+def catalog_labels(client_id, catalog_ids):
+    """
+    {catalog id: {option code: label}}. Each catalog's map is cached in the
+    shared cache under the tenant's form schema generation, so the catalog
+    signals that invalidate compiled schemas invalidate these too; catalogs
+    missing from the cache are loaded together in one query.
+    """
+    if not catalog_ids:
+        return {}
+    cache = caches[CACHE_ALIAS]
+    generation = get_generation(client_id)
+    keys = {catalog_id: f"catalog_labels:{catalog_id}:{generation}" for catalog_id in catalog_ids}
+    cached = cache.get_many(keys.values())
+    labels = {catalog_id: cached[key] for catalog_id, key in keys.items() if key in cached}
+
+    missing = [catalog_id for catalog_id in catalog_ids if catalog_id not in labels]
+    if missing:
+        loaded = {catalog_id: {} for catalog_id in missing}
+        options = CatalogOption.objects.filter(catalog_id__in=missing).values_list('catalog_id', 'code', 'label')
+        for catalog_id, code, label in options:
+            loaded[catalog_id][code] = label
+        cache.set_many({keys[catalog_id]: codes for catalog_id, codes in loaded.items()}, CACHE_TIMEOUT)
+        labels.update(loaded)
+    return labels
+
+
+def _selected_codes(field_type, raw_value):
+    try:
+        return coerce_value(field_type, raw_value) or []
+    except ValueError:
+        return []
+
+
+def render_submission(submission):
+    """
+    Display rows of a submission's answers, in form order: each dict has
+    label, field_type, raw_value, options (labels of the selected catalog
+    options) and photos (EvidenceFile instances). Takes a constant number of
+    queries: answers, evidence and, on a cache miss, catalog options.
+    Returns (rows, photos not attached to any answer).
+    """
+    answers = list(
+        submission.answers.order_by('field_definition__order').values(*ANSWER_FIELDS)
+    )
+
+    photos, loose_photos = {}, []
+    for photo in EvidenceFile.objects.filter(submission=submission).order_by('timestamp'):
+        if photo.answer_id is None:
+            loose_photos.append(photo)
+        else:
+            photos.setdefault(photo.answer_id, []).append(photo)
+
+    catalog_ids = sorted({
+        answer['field_definition__catalog_id'] for answer in answers
+        if answer['field_definition__catalog_id'] and answer['field_definition__field_type'] in OPTION_TYPES
+    })
+    labels = catalog_labels(submission.form_definition.client_id, catalog_ids)
+
+    rows = []
+    for answer in answers:
+        field_type = answer['field_definition__field_type']
+        options = []
+        if field_type in OPTION_TYPES:
+            codes = labels.get(answer['field_definition__catalog_id'], {})
+            # Seeded / legacy answers may already hold the label
+            options = [codes.get(code, code) for code in _selected_codes(field_type, answer['raw_value'])]
+        rows.append({
+            'label': answer['field_definition__label'],
+            'field_type': field_type,
+            'raw_value': answer['raw_value'],
+            'options': options,
+            'photos': photos.get(answer['id'], []),
+        })
+    return rows, loose_photos
@@ -0,0 +1,123 @@
+from surveys.models import CatalogOption, FormAnswer, StockoutObservation
+from surveys.services.answer_values import TYPED_COLUMNS, VALUE_COLUMNS, coerce_value, typed_values
+
+
+class SubmissionWriter:
+    """
+    Collects the answers and stockouts of one submission in memory and writes
+    them with one bulk INSERT per table, plus one for the catalog-option links
+    (the FormAnswer.value_catalog_options through table).
+    Works on ids (see surveys.services.form_schema), so no model instances
+    of fields, options or products are needed. Answers also get their typed
+    value_* column filled from raw_value, so analytics can aggregate in SQL.
+    bulk_create sends no post_save signals: the caller saves the Visit last,
+    which already invalidates the dashboards of the tenant.
+    """
+
+    def __init__(self, submission):
+        self.submission = submission
+        self.answers = []
+        self.option_links = []
+        self.stockouts = []
+
+    def add_answer(self, field_id, field_type, raw_value, option_ids=()):
+        answer = FormAnswer(
+            submission=self.submission,
+            field_definition_id=field_id,
+            raw_value=raw_value,
+            **typed_values(field_type, raw_value),
+        )
+        self.answers.append(answer)
+        self.option_links.extend((answer.id, option_id) for option_id in option_ids)
+        return answer
+
+    def add_stockout(self, product_id, cluster_source='VISIT'):
+        self.stockouts.append(StockoutObservation(
+            visit=self.submission.visit,
+            product_id=product_id,
+            is_oos=True,
+            cluster_source=cluster_source,
+        ))
+
+    def save(self):
+        self.save_all([self])
+
+    @staticmethod
+    def save_all(writers, batch_size=1000):
+        """Writes the rows of many submissions together (one INSERT per table and batch)."""
+        FormAnswer.objects.bulk_create([a for w in writers for a in w.answers], batch_size=batch_size)
+        StockoutObservation.objects.bulk_create([s for w in writers for s in w.stockouts], batch_size=batch_size)
+
+        Link = FormAnswer.value_catalog_options.through
+        Link.objects.bulk_create([
+            Link(formanswer_id=answer_id, catalogoption_id=option_id)
+            for w in writers
+            for answer_id, option_id in w.option_links
+        ], batch_size=batch_size)
+
+
+def backfill_typed_values(client_id=None, chunk_size=2000):
+    """
+    Fills the typed value_* columns and the catalog-option links of answers
+    that only have raw_value, walking the table by primary key in chunks
+    (one SELECT + one bulk UPDATE / INSERT per chunk).
+    Returns (answers updated, option links created).
+    """
+    answers = FormAnswer.objects.all()
+    if client_id is not None:
+        answers = answers.filter(submission__visit__client_id=client_id)
+
+    untyped = answers.filter(
+        field_definition__field_type__in=list(VALUE_COLUMNS),
+        **{f'{column}__isnull': True for column in TYPED_COLUMNS},
+    ).exclude(raw_value='')
+    updated = 0
+    for chunk in _chunks(untyped, ('id', 'field_definition__field_type', 'raw_value'), chunk_size):
+        rows = []
+        for answer_id, field_type, raw_value in chunk:
+            values = typed_values(field_type, raw_value)
+            if any(value is not None for value in values.values()):
+                rows.append(FormAnswer(id=answer_id, **values))
+        FormAnswer.objects.bulk_update(rows, TYPED_COLUMNS)
+        updated += len(rows)
+
+    unlinked = answers.filter(
+        field_definition__field_type__in=['SELECT', 'MULTI_SELECT'],
+        field_definition__catalog__isnull=False,
+        value_catalog_options__isnull=True,
+    ).exclude(raw_value='')
+    options = CatalogOption.objects.all()
+    if client_id is not None:
+        options = options.filter(catalog__client_id=client_id)
+    # Seeded / legacy answers store option labels instead of codes: accept both
+    option_ids = {}
+    for catalog_id, code, label, option_id in options.values_list('catalog_id', 'code', 'label', 'id'):
+        option_ids.setdefault((catalog_id, label), option_id)
+        option_ids[(catalog_id, code)] = option_id
+    Link = FormAnswer.value_catalog_options.through
+    linked = 0
+    fields = ('id', 'field_definition__field_type', 'field_definition__catalog_id', 'raw_value')
+    for chunk in _chunks(unlinked, fields, chunk_size):
+        links = [
+            Link(formanswer_id=answer_id, catalogoption_id=option_ids[(catalog_id, code)])
+            for answer_id, field_type, catalog_id, raw_value in chunk
+            for code in coerce_value(field_type, raw_value) or ()
+            if (catalog_id, code) in option_ids
+        ]
+        Link.objects.bulk_create(links, ignore_conflicts=True)
+        linked += len(links)
+    return updated, linked
+
+
+def _chunks(queryset, fields, chunk_size):
+    """Keyset pagination on the primary key: yields lists of value tuples."""
+    last_id = None
+    while True:
+        page = queryset.order_by('id')
+        if last_id is not None:
+            page = page.filter(id__gt=last_id)
+        rows = list(page.values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
@@ -0,0 +1,286 @@
+import datetime
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from analytics.models import Pharmacy
+from analytics.services.dashboard_cache import bump_data_version
+from analytics.services.geo import distance_from_target, parse_coordinate
+from surveys.models import FormSubmission, Visit
+from surveys.services.form_schema import get_form_schema
+from surveys.services.form_stats import record_submissions
+from surveys.services.submissions import SubmissionWriter
+
+# Visits accepted per request (a rep's full day fits comfortably)
+MAX_BATCH_VISITS = 200
+
+
+class SyncError(ValueError):
+    """The payload as a whole is malformed (the request is rejected with 400)."""
+
+
+def _uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise ValueError(f"Fecha/hora inválida: {value}")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def raw_value(field, value):
+    """String kept in FormAnswer.raw_value, same format as the form POST."""
+    if field.field_type == 'BOOL':
+        return 'true' if value else 'false'
+    if field.field_type == 'MULTI_SELECT':
+        return ",".join(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+class SubmissionSync:
+    """
+    Offline-first batch sync of a rep's visits. Payload:
+
+        {"visits": [{"id": <uuid>, "pharmacy_id": <uuid>, "started_at": <iso>, "completed_at": <iso>,
+                     "latitude": .., "longitude": ..,
+                     "submissions": [{"id": <uuid>, "form_code": "..", "form_version": 1,
+                                      "answers": {"<field code>": <value>, ...}}]}]}
+
+    Ids are generated on the device, so re-sending a batch is idempotent: known
+    visits / submissions are reported as 'duplicate'. Each visit is validated
+    against the compiled form schemas and accepted or rejected as a whole; the
+    accepted ones are written with bulk inserts in a single transaction.
+    """
+
+    def __init__(self, client, rep):
+        self.client = client
+        self.rep = rep
+
+    def process(self, payload):
+        visits = payload.get('visits') if isinstance(payload, dict) else None
+        if not isinstance(visits, list):
+            raise SyncError("Se espera un objeto con la lista 'visits'")
+        if len(visits) > MAX_BATCH_VISITS:
+            raise SyncError(f"Máximo {MAX_BATCH_VISITS} visitas por sincronización")
+
+        try:
+            return self._process(visits)
+        except IntegrityError:
+            # A concurrent retry of the same batch won the race: its rows are duplicates now.
+            # Whatever still conflicts is written visit by visit and reported as invalid.
+            return self._process(visits, one_by_one=True)
+
+    def _process(self, items, one_by_one=False):
+        visit_ids = [_uuid(item.get('id')) for item in items if isinstance(item, dict)]
+        submission_ids = [
+            _uuid(sub.get('id'))
+            for item in items if isinstance(item, dict)
+            for sub in item.get('submissions') or [] if isinstance(sub, dict)
+        ]
+        known_visits = dict(Visit.objects.filter(id__in=[v for v in visit_ids if v]).values_list('id', 'client_id'))
+        known_submissions = set(
+            FormSubmission.objects.filter(id__in=[s for s in submission_ids if s]).values_list('id', flat=True)
+        )
+        pharmacy_ids = {_uuid(item.get('pharmacy_id')) for item in items if isinstance(item, dict)}
+        pharmacies = {
+            pk: (latitude, longitude)
+            for pk, latitude, longitude in Pharmacy.objects.filter(
+                client=self.client, id__in=[p for p in pharmacy_ids if p]
+            ).values_list('id', 'latitude', 'longitude')
+        }
+
+        results, accepted = [], []
+        seen = set()
+        for item in items:
+            result = self._visit(item, known_visits, known_submissions, pharmacies, seen)
+            status = result.pop('_status')
+            results.append(status)
+            if result:
+                accepted.append((status, result))
+
+        with transaction.atomic():
+            if not one_by_one:
+                self._write([rows for _, rows in accepted])
+            else:
+                for status, rows in accepted:
+                    try:
+                        with transaction.atomic():
+                            self._write([rows])
+                    except IntegrityError:
+                        self._reject(status, {'id': "Conflicto al guardar la visita, reintente la sincronización"})
+            created_ids = [
+                submission.id
+                for status, rows in accepted if status['status'] == 'created'
+                for submission in rows['submissions']
+            ]
+            if created_ids:
+                transaction.on_commit(lambda: record_submissions(created_ids))
+                transaction.on_commit(lambda: bump_data_version(self.client.id))
+
+        summary = {'created': 0, 'duplicate': 0, 'invalid': 0}
+        for result in results:
+            summary[result['status']] += 1
+        return {'visits': results, **summary}
+
+    @staticmethod
+    def _write(accepted):
+        """Bulk inserts the rows of accepted visits (caller holds the transaction)."""
+        Visit.objects.bulk_create([v for rows in accepted for v in rows['visits']], batch_size=500)
+        FormSubmission.objects.bulk_create([s for rows in accepted for s in rows['submissions']], batch_size=500)
+        SubmissionWriter.save_all([w for rows in accepted for w in rows['writers']])
+
+    @staticmethod
+    def _reject(status, errors):
+        status['status'] = 'invalid'
+        status['errors'] = errors
+        for sub_status in status.get('submissions', []):
+            if sub_status['status'] == 'created':
+                sub_status['status'] = 'skipped'
+
+    def _visit(self, item, known_visits, known_submissions, pharmacies, seen):
+        """Validates one visit; returns its status plus the rows to insert when accepted."""
+        if not isinstance(item, dict):
+            return {'_status': {'id': None, 'status': 'invalid', 'errors': {'visit': "Formato inválido"}}}
+        visit_id = _uuid(item.get('id'))
+        status = {'id': str(visit_id) if visit_id else item.get('id'), 'status': 'invalid', 'errors': {}}
+        errors = status['errors']
+
+        if visit_id is None:
+            errors['id'] = "UUID inválido"
+            return {'_status': status}
+        if visit_id in seen:
+            errors['id'] = "Visita repetida en el lote"
+            return {'_status': status}
+        seen.add(visit_id)
+
+        if visit_id in known_visits:
+            if known_visits[visit_id] != self.client.id:
+                errors['id'] = "UUID en uso"
+                return {'_status': status}
+            status['status'] = 'duplicate'
+            status.pop('errors')
+            return {'_status': status}
+
+        pharmacy_id = _uuid(item.get('pharmacy_id'))
+        if pharmacy_id not in pharmacies:
+            errors['pharmacy_id'] = "Farmacia inexistente"
+        try:
+            started_at = _datetime(item.get('started_at'))
+        except ValueError as exc:
+            errors['started_at'] = str(exc)
+        try:
+            completed_at = _datetime(item.get('completed_at')) or timezone.now()
+        except ValueError as exc:
+            errors['completed_at'] = str(exc)
+        coordinates = {}
+        for key, limit in (('latitude', 90), ('longitude', 180)):
+            try:
+                coordinates[key] = parse_coordinate(item.get(key), limit)
+            except ValueError as exc:
+                errors[key] = str(exc)
+        raw_submissions = item.get('submissions')
+        if not isinstance(raw_submissions, list) or not raw_submissions:
+            errors['submissions'] = "La visita no tiene formularios"
+        if errors:
+            return {'_status': status}
+
+        visit = Visit(
+            id=visit_id,
+            client=self.client,
+            rep=self.rep,
+            pharmacy_id=pharmacy_id,
+            status='COMPLETED',
+            started_at=started_at or completed_at,
+            completed_at=completed_at,
+            latitude_check_in=coordinates['latitude'],
+            longitude_check_in=coordinates['longitude'],
+            distance_from_target=distance_from_target(
+                *pharmacies[pharmacy_id], coordinates['latitude'], coordinates['longitude'],
+            ),
+        )
+
+        submission_statuses, submissions, writers = [], [], []
+        forms_in_visit = set()
+        for raw in raw_submissions:
+            sub_status, submission, writer = self._submission(visit, raw, known_submissions, forms_in_visit)
+            submission_statuses.append(sub_status)
+            if submission is not None:
+                submissions.append(submission)
+                writers.append(writer)
+        status['submissions'] = submission_statuses
+
+        if any(s['status'] == 'invalid' for s in submission_statuses):
+            errors['submissions'] = "Hay formularios con errores"
+            for sub_status in submission_statuses:
+                if sub_status['status'] == 'created':
+                    sub_status['status'] = 'skipped'  # valid, but its visit was rejected
+            return {'_status': status}
+        status['status'] = 'created'
+        status.pop('errors')
+        return {'_status': status, 'visits': [visit], 'submissions': submissions, 'writers': writers}
+
+    def _submission(self, visit, raw, known_submissions, forms_in_visit):
+        if not isinstance(raw, dict):
+            return {'id': None, 'status': 'invalid', 'errors': {'submission': "Formato inválido"}}, None, None
+        submission_id = _uuid(raw.get('id'))
+        status = {'id': str(submission_id) if submission_id else raw.get('id'), 'status': 'invalid'}
+        if submission_id is None:
+            status['errors'] = {'id': "UUID inválido"}
+            return status, None, None
+        if submission_id in known_submissions:
+            status['errors'] = {'id': "UUID en uso"}
+            return status, None, None
+
+        form_code, version = raw.get('form_code'), raw.get('form_version')
+        if not isinstance(form_code, str) or not (version is None or isinstance(version, int)):
+            status['errors'] = {'form_code': "Se espera form_code (texto) y form_version (entero)"}
+            return status, None, None
+        schema = get_form_schema(self.client.id, form_code, version)
+        if schema is None:
+            status['errors'] = {'form_code': "Formulario inexistente"}
+            return status, None, None
+        if schema.form_id in forms_in_visit:
+            status['errors'] = {'form_code': "Formulario repetido en la visita"}
+            return status, None, None
+        forms_in_visit.add(schema.form_id)
+
+        answers = raw.get('answers')
+        if not isinstance(answers, dict):
+            status['errors'] = {'answers': "Se espera un objeto {código: valor}"}
+            return status, None, None
+        cleaned, errors = schema.validate(answers)
+        if errors:
+            status['errors'] = errors
+            return status, None, None
+
+        submission = FormSubmission(id=submission_id, visit=visit, form_definition_id=schema.form_id)
+        writer = SubmissionWriter(submission)
+        for code, value in cleaned.items():
+            if value is None or code not in answers:
+                continue
+            field = schema.fields_by_code[code]
+            selected = value if isinstance(value, list) else [value]
+            writer.add_answer(
+                field.id,
+                field.field_type,
+                raw_value(field, value),
+                [field.option_ids[c] for c in selected if c in field.option_ids] if field.catalog_id else (),
+            )
+            if field.oos_sku and value is True:
+                product_id = schema.oos_products.get(field.oos_sku)
+                if product_id:
+                    writer.add_stockout(product_id)
+
+        status['status'] = 'created'
+        return status, submission, writer
@@ -0,0 +1,67 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+
+from analytics.models import SalesDocument, SalesLine, CommercialAgreement
+from .models import Catalog, CatalogOption, FormAnswer, FormDefinition, FormFieldDefinition, FormSubmission
+from .services.form_schema import invalidate_form_schemas
+from .services.form_stats import answer_edit_deltas, apply_deltas, stored_answer_row, submission_removal_deltas
+from .services.pharmacy_context import invalidate_pharmacy_context
+
+
+@receiver([post_save, post_delete], sender=SalesDocument)
+@receiver([post_save, post_delete], sender=CommercialAgreement)
+def invalidate_context_for_pharmacy(sender, instance, **kwargs):
+    pharmacy_id = instance.pharmacy_id
+    transaction.on_commit(lambda: invalidate_pharmacy_context(pharmacy_id))
+
+
+@receiver(post_save, sender=SalesLine)
+def invalidate_context_for_line(sender, instance, **kwargs):
+    pharmacy_id = instance.document.pharmacy_id
+    transaction.on_commit(lambda: invalidate_pharmacy_context(pharmacy_id))
+
+
+@receiver([post_save, post_delete], sender=FormDefinition)
+@receiver([post_save, post_delete], sender=Catalog)
+def invalidate_schemas_for_client(sender, instance, **kwargs):
+    client_id = instance.client_id
+    transaction.on_commit(lambda: invalidate_form_schemas(client_id))
+
+
+@receiver([post_save, post_delete], sender=FormFieldDefinition)
+def invalidate_schemas_for_field(sender, instance, **kwargs):
+    client_id = FormDefinition.objects.filter(id=instance.form_id).values_list('client_id', flat=True).first()
+    if client_id:
+        transaction.on_commit(lambda: invalidate_form_schemas(client_id))
+
+
+@receiver([post_save, post_delete], sender=CatalogOption)
+def invalidate_schemas_for_option(sender, instance, **kwargs):
+    client_id = Catalog.objects.filter(id=instance.catalog_id).values_list('client_id', flat=True).first()
+    if client_id:
+        transaction.on_commit(lambda: invalidate_form_schemas(client_id))
+
+
+# Form statistics: new submissions are recorded by the views / sync on commit;
+# deletes and answer edits are folded in here.
+@receiver(pre_delete, sender=FormSubmission)
+def remove_submission_from_stats(sender, instance, **kwargs):
+    deltas = submission_removal_deltas([instance.id])
+    if deltas:
+        transaction.on_commit(lambda: apply_deltas(deltas))
+
+
+@receiver(pre_save, sender=FormAnswer)
+def remember_stored_answer(sender, instance, raw=False, **kwargs):
+    instance._stored_row = None if raw or instance._state.adding else stored_answer_row(instance.id)
+
+
+@receiver(post_save, sender=FormAnswer)
+def update_stats_for_edited_answer(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_stored_row', None)
+    if created or previous is None:
+        return
+    deltas = answer_edit_deltas(previous, instance)
+    if deltas:
+        transaction.on_commit(lambda: apply_deltas(deltas))
@@ -1,3 +1,647 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import uuid
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.test import Client as DjangoClient, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics.models import Client, Pharmacy, Product, Rep, Territory, Zone
+from surveys.models import (
+    Catalog, CatalogOption, FormAnswer, FormDefinition, FormFieldDailyStat, FormFieldDefinition,
+    FormSubmission, StockoutObservation, Visit,
+)
+from surveys.services import evidence as evidence_service, form_stats, pharmacy_context
+from surveys.services.answer_values import coerce_value, typed_values
+from surveys.services.export import META_COLUMNS, SubmissionPivot
+from surveys.services.form_schema import get_form_schema
+from surveys.services.submission_list import decode_cursor, encode_cursor, filter_submissions, submission_page
+from surveys.services.submissions import SubmissionWriter, backfill_typed_values
+from surveys.services.sync import SubmissionSync
+
+# Every cache alias in memory: tests must not read or leave entries in analytics_data/
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+    for alias in ('default', 'dashboard', 'shared')
+}
+
+
+class SurveyFixtures:
+    """Tenant, rep, pharmacy and form builders shared by the survey tests."""
+
+    @classmethod
+    def make_tenant(cls, code='acme'):
+        client = Client.objects.create(name=code.title(), code=code)
+        user = User.objects.create_user(username=f'rep-{code}', first_name='Ana', last_name='Rep')
+        rep = Rep.objects.create(client=client, user=user, external_id='R1')
+        pharmacy = Pharmacy.objects.create(
+            client=client, code='PH-1', name_legal='Farmacia Uno SA', name_trade='Farmacia Uno',
+            display_name='Farmacia Uno', address='Calle 1', city='CABA',
+        )
+        return client, rep, pharmacy
+
+    @classmethod
+    def make_form(cls, client, version, fields, code='VISITA', is_active=True):
+        """fields: [(code, field_type)] or [(code, field_type, catalog)]."""
+        form = FormDefinition.objects.create(
+            client=client, code=code, version=version, title=f'Visita v{version}', is_active=is_active,
+        )
+        for order, spec in enumerate(fields):
+            FormFieldDefinition.objects.create(
+                form=form, order=order, code=spec[0], field_type=spec[1], label=spec[0].title(),
+                catalog=spec[2] if len(spec) > 2 else None,
+            )
+        return form
+
+    @classmethod
+    def make_submission(cls, rep, pharmacy, form, answers, completed_at=None):
+        """answers: {field code: raw value}, written like the form POST does."""
+        completed_at = completed_at or timezone.now()
+        visit = Visit.objects.create(
+            client=rep.client, rep=rep, pharmacy=pharmacy, status='COMPLETED',
+            started_at=completed_at, completed_at=completed_at,
+        )
+        submission = FormSubmission.objects.create(visit=visit, form_definition=form)
+        schema = get_form_schema(form.client_id, form.code, form.version)
+        writer = SubmissionWriter(submission)
+        for code, raw in answers.items():
+            field = schema.fields_by_code[code]
+            selected = raw.split(',') if field.catalog_id else []
+            writer.add_answer(field.id, field.field_type, raw, [field.option_ids[c] for c in selected])
+        writer.save()
+        return submission
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SubmissionPivotTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+        brands = Catalog.objects.create(client=cls.client_obj, name='Marcas', code='BRANDS')
+        for order, code in enumerate(['A', 'B', 'C']):
+            CatalogOption.objects.create(catalog=brands, code=code, label=f'Marca {code}', order=order)
+        cls.v1 = cls.make_form(cls.client_obj, 1, [('EXHIBE', 'BOOL'), ('FRENTES', 'INT')], is_active=False)
+        cls.v2 = cls.make_form(cls.client_obj, 2, [
+            ('TITULO', 'SECTION_HEADER'),
+            ('EXHIBE', 'BOOL'),
+            ('FRENTES', 'INT'),
+            ('MARCAS', 'MULTI_SELECT', brands),
+            ('FOTO', 'PHOTO'),
+        ])
+
+    def pivot(self, **kwargs):
+        return SubmissionPivot(get_form_schema(self.client_obj.id, 'VISITA'), **kwargs)
+
+    def test_header_has_meta_then_current_version_questions(self):
+        header = self.pivot().header
+        self.assertEqual(header[:len(META_COLUMNS)], [name for name, _ in META_COLUMNS])
+        self.assertEqual(header[len(META_COLUMNS):], ['EXHIBE', 'FRENTES', 'MARCAS'])
+
+    def test_rows_follow_submission_id_order(self):
+        submissions = [
+            self.make_submission(self.rep, self.pharmacy, self.v2, {'FRENTES': str(i)}) for i in range(5)
+        ]
+        rows = list(self.pivot().rows())
+        self.assertEqual([row[0] for row in rows], sorted(s.id for s in submissions))
+
+    def test_older_versions_fill_columns_by_field_code(self):
+        old = self.make_submission(self.rep, self.pharmacy, self.v1, {'EXHIBE': 'true', 'FRENTES': '3'})
+        rows = {row[0]: row for row in self.pivot().rows()}
+        position = len(META_COLUMNS)
+        self.assertEqual(rows[old.id][position:], [True, 3, None])
+        self.assertEqual(rows[old.id][7], 1)  # form_version
+
+    def test_csv_formats_bool_and_multi_select(self):
+        self.make_submission(self.rep, self.pharmacy, self.v2, {'EXHIBE': 'false', 'FRENTES': '12', 'MARCAS': 'A,C'})
+        out = io.StringIO()
+        self.assertEqual(self.pivot().write_csv(out), 1)
+        header, row = list(csv.reader(io.StringIO(out.getvalue())))
+        values = dict(zip(header, row))
+        self.assertEqual(values['EXHIBE'], 'False')
+        self.assertEqual(values['FRENTES'], '12')
+        self.assertEqual(values['MARCAS'], 'A,C')
+        self.assertEqual(values['pharmacy_code'], 'PH-1')
+
+    def test_streamed_csv_matches_file_output(self):
+        self.make_submission(self.rep, self.pharmacy, self.v2, {'EXHIBE': 'true'})
+        out = io.StringIO()
+        self.pivot().write_csv(out)
+        self.assertEqual(''.join(self.pivot().csv_lines()), out.getvalue())
+
+    def test_answers_of_a_submission_missing_from_the_stream_are_skipped(self):
+        submissions = sorted(
+            (self.make_submission(self.rep, self.pharmacy, self.v2, {'FRENTES': str(i)}) for i in range(4)),
+            key=lambda s: s.id,
+        )
+        pivot = self.pivot()
+        everything = pivot.submissions()
+        # Snapshot of the submissions query taken before submissions[1] committed
+        without_second = everything.exclude(id=submissions[1].id)
+        with mock.patch.object(SubmissionPivot, 'submissions', side_effect=[without_second, everything]):
+            rows = list(pivot.rows())
+
+        frentes = len(META_COLUMNS) + 1
+        self.assertEqual([row[0] for row in rows], [s.id for i, s in enumerate(submissions) if i != 1])
+        expected = {s.id: int(s.answers.get().raw_value) for s in submissions}
+        for row in rows:
+            self.assertEqual(row[frentes], expected[row[0]])
+
+    def test_date_window_bounds_submitted_at(self):
+        submission = self.make_submission(self.rep, self.pharmacy, self.v2, {'FRENTES': '1'})
+        later = submission.submitted_at + datetime.timedelta(seconds=1)
+        self.assertEqual(len(list(self.pivot(until=later).rows())), 1)
+        self.assertEqual(len(list(self.pivot(since=later).rows())), 0)
+
+
+def jpeg_bytes(size=(640, 480), color=(200, 30, 30), orientation=None):
+    image = evidence_service.Image.new('RGB', size, color)
+    exif = evidence_service.Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+@skipIf(evidence_service.Image is None, "Pillow no instalado")
+@override_settings(CACHES=TEST_CACHES)
+class EvidenceTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+        cls.form = cls.make_form(cls.client_obj, 1, [('FOTO', 'PHOTO')])
+        other_client, cls.other_rep, cls.other_pharmacy = cls.make_tenant('other')
+        cls.other_form = cls.make_form(other_client, 1, [('FOTO', 'PHOTO')])
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def store(self, content, name='foto.jpg', rep=None):
+        rep = rep or self.rep
+        form = self.form if rep is self.rep else self.other_form
+        pharmacy = self.pharmacy if rep is self.rep else self.other_pharmacy
+        submission = self.make_submission(rep, pharmacy, form, {})
+        return evidence_service.store_evidence(submission, SimpleUploadedFile(name, content, 'image/jpeg'))
+
+    def test_same_content_is_stored_once_per_tenant(self):
+        content = jpeg_bytes()
+        first, second = self.store(content), self.store(content, name='otra.jpg')
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(first.file.name, second.file.name)
+
+        other = self.store(content, rep=self.other_rep)
+        self.assertNotEqual(other.file.name, first.file.name)
+
+    def test_variants_are_upright_webp(self):
+        # EXIF orientation 6: the camera was rotated, the photo is displayed portrait
+        evidence = self.store(jpeg_bytes(size=(2400, 1800), orientation=6))
+        self.assertEqual(evidence.processing_status, 'PENDING')
+        self.assertEqual(evidence_service.process_evidence(evidence.id), 'READY')
+
+        evidence.refresh_from_db()
+        with evidence_service.Image.open(evidence.preview.path) as preview:
+            self.assertEqual((preview.format, preview.size), ('WEBP', (1200, 1600)))
+        with evidence_service.Image.open(evidence.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (240, 320))
+        self.assertEqual(evidence.thumbnail_url, f'/media/{evidence.thumbnail.name}')
+
+    def test_ready_variants_are_shared_within_the_tenant_only(self):
+        content = jpeg_bytes()
+        first, pending = self.store(content), self.store(content)
+        other = self.store(content, rep=self.other_rep)
+        evidence_service.process_evidence(first.id)
+
+        first.refresh_from_db()
+        pending.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((pending.processing_status, pending.thumbnail.name), ('READY', first.thumbnail.name))
+        self.assertEqual(other.processing_status, 'PENDING')
+        # Later uploads of a processed content are READY at once
+        self.assertEqual(self.store(content).processing_status, 'READY')
+
+    def test_unreadable_image_fails(self):
+        evidence = self.store(b'not an image', name='roto.jpg')
+        with self.assertLogs(evidence_service.logger, 'WARNING'):
+            self.assertEqual(evidence_service.process_evidence(evidence.id), 'FAILED')
+        evidence.refresh_from_db()
+        self.assertEqual(evidence.processing_status, 'FAILED')
+        self.assertEqual(evidence.thumbnail_url, evidence.file.url)
+        self.assertIsNone(evidence_service.process_evidence(evidence.id))
+
+    def test_pending_backlog_runs_one_job_per_tenant_and_content(self):
+        content = jpeg_bytes()
+        self.store(content), self.store(content)
+        other = self.store(content, rep=self.other_rep)
+        broken = self.store(b'not an image', name='roto.jpg')
+        with mock.patch.object(evidence_service, '_process_in_worker', side_effect=lambda pk: pk) as worker:
+            counts = evidence_service.process_pending_evidence(workers=1)
+        self.assertEqual(sum(counts.values()), 3)
+        jobs = {call.args[0] for call in worker.call_args_list}
+        self.assertEqual(len(jobs & {other.id, broken.id}), 2)
+
+    def test_oversized_upload_is_rejected(self):
+        with override_settings(EVIDENCE_MAX_UPLOAD_SIZE=10):
+            with self.assertRaises(ValueError):
+                self.store(jpeg_bytes())
+
+
+@override_settings(CACHES=TEST_CACHES, PHARMACY_CONTEXT_TTL=300, PHARMACY_CONTEXT_PREWARM_TTL=57600)
+class PharmacyContextCacheTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+
+    def cached_timeout(self, call):
+        cache = caches[pharmacy_context.CACHE_ALIAS]
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            call()
+        return cache_set.call_args.args[2]
+
+    def test_prewarmed_contexts_last_the_route_day(self):
+        timeout = self.cached_timeout(lambda: pharmacy_context.prewarm_pharmacy_contexts([self.pharmacy]))
+        self.assertEqual(timeout, 57600)
+        self.assertIsNotNone(pharmacy_context.get_cached_context(self.pharmacy.id))
+
+    def test_contexts_built_on_a_miss_use_the_short_ttl(self):
+        timeout = self.cached_timeout(lambda: pharmacy_context.cache_pharmacy_context(self.pharmacy))
+        self.assertEqual(timeout, 300)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FormStatsTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+        cls.form = cls.make_form(cls.client_obj, 1, [('EXHIBE', 'BOOL'), ('FRENTES', 'INT')])
+        cls.exhibe, cls.frentes = cls.form.fields.order_by('order')
+
+    def submit(self, answers, completed_at=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            submission = self.make_submission(self.rep, self.pharmacy, self.form, answers, completed_at)
+            transaction.on_commit(lambda: form_stats.record_submissions([submission.id]))
+        return submission
+
+    def stat(self, field):
+        return FormFieldDailyStat.objects.get(field_definition=field)
+
+    def test_submissions_of_a_day_share_one_bucket(self):
+        self.submit({'EXHIBE': 'true', 'FRENTES': '4'})
+        self.submit({'EXHIBE': 'false', 'FRENTES': '6'})
+        stat = self.stat(self.frentes)
+        self.assertEqual((stat.answer_count, stat.value_sum, stat.value_counts), (2, 10.0, {'4': 1, '6': 1}))
+        self.assertEqual(self.stat(self.exhibe).true_count, 1)
+
+    def test_no_zone_buckets_are_unique(self):
+        self.submit({'EXHIBE': 'true'})
+        stat = self.stat(self.exhibe)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            FormFieldDailyStat.objects.create(
+                client=self.client_obj, field_definition=self.exhibe, date=stat.date, zone=None,
+            )
+
+    def test_deleted_submissions_leave_the_stats(self):
+        self.submit({'EXHIBE': 'true', 'FRENTES': '4'})
+        submission = self.submit({'EXHIBE': 'true', 'FRENTES': '6'})
+        with self.captureOnCommitCallbacks(execute=True):
+            submission.delete()
+        stat = self.stat(self.frentes)
+        self.assertEqual((stat.answer_count, stat.value_sum, stat.value_counts), (1, 4.0, {'4': 1}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FormSubmission.objects.all().delete()
+        self.assertFalse(FormFieldDailyStat.objects.exists())
+
+    def test_edited_answers_move_their_counts(self):
+        submission = self.submit({'EXHIBE': 'true', 'FRENTES': '4'})
+        answer = submission.answers.get(field_definition=self.frentes)
+        answer.raw_value, answer.value_int = '9', 9
+        with self.captureOnCommitCallbacks(execute=True):
+            answer.save()
+        stat = self.stat(self.frentes)
+        self.assertEqual((stat.answer_count, stat.value_sum, stat.value_counts), (1, 9.0, {'9': 1}))
+
+    def test_buckets_follow_the_visit_day_not_the_sync_day(self):
+        visited = timezone.now() - datetime.timedelta(days=3)
+        self.submit({'EXHIBE': 'true'}, completed_at=visited)
+        self.assertEqual(self.stat(self.exhibe).date, timezone.localtime(visited).date())
+        self.assertEqual(FormSubmission.objects.get().submitted_at.date(), timezone.now().date())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SubmissionListTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+        cls.zone = Zone.objects.create(client=cls.client_obj, name='Norte')
+        cls.pharmacy.territory = Territory.objects.create(client=cls.client_obj, name='T1', zone=cls.zone)
+        cls.pharmacy.save()
+        cls.other_pharmacy = Pharmacy.objects.create(
+            client=cls.client_obj, code='PH-2', name_legal='Farmacia Dos SA', name_trade='Farmacia Dos',
+            display_name='Farmacia Dos', address='Calle 2', city='CABA',
+        )
+        user = User.objects.create_user(username='rep-2')
+        cls.other_rep = Rep.objects.create(client=cls.client_obj, user=user, external_id='R2')
+        cls.visit_form = cls.make_form(cls.client_obj, 1, [('EXHIBE', 'BOOL')])
+        cls.audit_form = cls.make_form(cls.client_obj, 1, [('EXHIBE', 'BOOL')], code='AUDITORIA')
+
+        # Five submissions share one completed_at: only the id orders them
+        cls.tied_at = timezone.make_aware(datetime.datetime(2026, 5, 10, 12, 0))
+        cls.submissions = [
+            cls.make_submission(cls.rep, cls.pharmacy, cls.visit_form, {'EXHIBE': 'true'}, cls.tied_at)
+            for _ in range(5)
+        ]
+        cls.earlier = cls.make_submission(
+            cls.other_rep, cls.other_pharmacy, cls.audit_form, {'EXHIBE': 'false'},
+            cls.tied_at - datetime.timedelta(days=3),
+        )
+        cls.later = cls.make_submission(
+            cls.rep, cls.other_pharmacy, cls.visit_form, {'EXHIBE': 'true'}, cls.tied_at + datetime.timedelta(days=1),
+        )
+        other_client, other_rep, other_pharmacy = cls.make_tenant('other')
+        other_form = cls.make_form(other_client, 1, [('EXHIBE', 'BOOL')])
+        cls.make_submission(other_rep, other_pharmacy, other_form, {'EXHIBE': 'true'}, cls.tied_at)
+
+    def walk(self, submissions, page_size):
+        """Ids of every page, following the cursors the way the view does."""
+        pages, cursor = [], None
+        while True:
+            rows, next_cursor = submission_page(submissions, cursor, page_size=page_size)
+            pages.append([row['id'] for row in rows])
+            if next_cursor is None:
+                return pages
+            cursor = decode_cursor(next_cursor)
+
+    def ids(self, *submissions):
+        return {submission.id for submission in submissions}
+
+    def test_pages_cover_tied_completions_once_in_order(self):
+        pages = self.walk(filter_submissions(self.client_obj.id), page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        tied = sorted((s.id for s in self.submissions), reverse=True)
+        self.assertEqual(sum(pages, []), [self.later.id, *tied, self.earlier.id])
+
+    def test_filters_bound_the_pages(self):
+        cases = [
+            ({'form_code': 'AUDITORIA'}, self.ids(self.earlier)),
+            ({'rep_id': self.other_rep.id}, self.ids(self.earlier)),
+            ({'zone_id': self.zone.id}, self.ids(*self.submissions)),
+            ({'date_from': self.tied_at.date(), 'date_to': self.tied_at.date()}, self.ids(*self.submissions)),
+            ({'date_from': self.tied_at.date() + datetime.timedelta(days=1)}, self.ids(self.later)),
+            ({'date_to': self.tied_at.date() - datetime.timedelta(days=1)}, self.ids(self.earlier)),
+        ]
+        for filters, expected in cases:
+            with self.subTest(**filters):
+                pages = self.walk(filter_submissions(self.client_obj.id, **filters), page_size=2)
+                ids = sum(pages, [])
+                self.assertEqual(len(ids), len(expected))
+                self.assertEqual(set(ids), expected)
+
+    def test_cursor_round_trip(self):
+        submission = self.submissions[0]
+        self.assertEqual(decode_cursor(encode_cursor(self.tied_at, submission.id)), (self.tied_at, submission.id))
+
+    def test_malformed_cursors_are_rejected(self):
+        def token(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+        tokens = [
+            'not base64!', token('plain string'), token(5), token(['2026-05-10T12:00:00']),
+            token(['no es fecha', str(self.submissions[0].id)]), token([5, str(self.submissions[0].id)]),
+            token([self.tied_at.isoformat(), 5]), token([self.tied_at.isoformat(), None]),
+            token([self.tied_at.isoformat(), 'no-es-uuid']), token([self.tied_at.isoformat(), ['x']]),
+        ]
+        for value in tokens:
+            with self.subTest(token=value), self.assertRaises(ValueError):
+                decode_cursor(value)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FormFillTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.visited = cls.make_tenant()
+        cls.form = cls.make_form(cls.client_obj, 1, [('EXHIBE', 'BOOL')])
+        cls.make_submission(cls.rep, cls.visited, cls.form, {'EXHIBE': 'true'})
+        cls.scheduled = Pharmacy.objects.create(
+            client=cls.client_obj, code='PH-2', name_legal='Farmacia Dos SA', name_trade='Farmacia Dos',
+            display_name='Farmacia Dos', address='Calle 2', city='Rosario',
+        )
+        Visit.objects.create(
+            client=cls.client_obj, rep=cls.rep, pharmacy=cls.scheduled,
+            scheduled_at=timezone.now(),
+        )
+        Pharmacy.objects.create(
+            client=cls.client_obj, code='PH-3', name_legal='Farmacia Tres SA', name_trade='Farmacia Tres',
+            display_name='Farmacia Tres', address='Calle 3', city='CABA',
+        )
+
+    def test_route_and_recent_pharmacies_come_with_the_page(self):
+        self.client.force_login(self.rep.user)
+        response = self.client.get(reverse('surveys:form_fill', args=[self.form.code]))
+        self.assertEqual(
+            [p['code'] for p in response.context['route_pharmacies']], ['PH-2', 'PH-1'],  # route first, PH-3 never visited
+        )
+        self.assertContains(response, 'id="route-pharmacies"')
+        self.assertContains(response, str(self.scheduled.id))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SyncTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+        cls.product = Product.objects.create(client=cls.client_obj, sku='A1', name='Producto A1')
+        cls.form = cls.make_form(cls.client_obj, 1, [('EXHIBE', 'BOOL'), ('FRENTES', 'INT'), ('OOS_A1', 'BOOL')])
+
+    def setUp(self):
+        self.client.force_login(self.rep.user)
+
+    def visit(self, answers=None, **fields):
+        item = {
+            'id': str(uuid.uuid4()), 'pharmacy_id': str(self.pharmacy.id), 'completed_at': '2026-10-19T10:30:00',
+            'submissions': [{
+                'id': str(uuid.uuid4()), 'form_code': 'VISITA', 'form_version': 1,
+                'answers': answers or {'EXHIBE': True, 'FRENTES': 3},
+            }],
+        }
+        item.update(fields)
+        return item
+
+    def sync(self, *visits, client=None):
+        return (client or self.client).post(
+            reverse('surveys:sync'), json.dumps({'visits': list(visits)}), content_type='application/json',
+        )
+
+    def test_resending_a_batch_is_idempotent(self):
+        batch = [self.visit(), self.visit()]
+        self.assertEqual(self.sync(*batch).json()['created'], 2)
+
+        body = self.sync(*batch).json()
+        self.assertEqual((body['created'], body['duplicate']), (0, 2))
+        self.assertEqual(Visit.objects.count(), 2)
+        self.assertEqual(FormSubmission.objects.count(), 2)
+        self.assertEqual(FormAnswer.objects.count(), 4)
+
+    def test_invalid_visits_are_rejected_one_by_one(self):
+        valid = self.visit()
+        body = self.sync(
+            valid,
+            self.visit(pharmacy_id=str(uuid.uuid4())),
+            self.visit(started_at='ayer'),
+            self.visit(answers={'EXHIBE': True, 'FRENTES': 'muchos'}),
+        ).json()
+
+        self.assertEqual((body['created'], body['invalid']), (1, 3))
+        _, pharmacy, started, answers = body['visits']
+        self.assertEqual(list(pharmacy['errors']), ['pharmacy_id'])
+        self.assertEqual(list(started['errors']), ['started_at'])
+        self.assertIn('FRENTES', answers['submissions'][0]['errors'])
+        self.assertEqual(list(Visit.objects.values_list('id', flat=True)), [uuid.UUID(valid['id'])])
+
+    def test_oos_answers_create_stockout_records(self):
+        oos, in_stock = self.visit({'OOS_A1': True}), self.visit({'OOS_A1': False})
+        self.sync(oos, in_stock)
+
+        self.assertEqual(
+            list(StockoutObservation.objects.values_list('visit_id', 'product_id', 'is_oos')),
+            [(uuid.UUID(oos['id']), self.product.id, True)],
+        )
+
+    def test_write_conflicts_become_a_visit_error(self):
+        conflicting, valid = self.visit(), self.visit()
+        write = SubmissionSync._write
+
+        def racing_write(accepted):
+            if any(str(v.id) == conflicting['id'] for rows in accepted for v in rows['visits']):
+                raise IntegrityError('UNIQUE constraint failed')
+            write(accepted)
+
+        with mock.patch.object(SubmissionSync, '_write', side_effect=racing_write):
+            response = self.sync(conflicting, valid)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([v['status'] for v in body['visits']], ['invalid', 'created'])
+        self.assertEqual(body['visits'][0]['submissions'][0]['status'], 'skipped')
+        self.assertEqual(list(Visit.objects.values_list('id', flat=True)), [uuid.UUID(valid['id'])])
+
+    def test_csrf_is_enforced(self):
+        browser = DjangoClient(enforce_csrf_checks=True)
+        browser.force_login(self.rep.user)
+        self.assertEqual(self.sync(self.visit(), client=browser).status_code, 403)
+        self.assertFalse(Visit.objects.exists())
+
+    def test_only_reps_can_sync(self):
+        self.client.logout()
+        self.assertEqual(self.sync(self.visit()).status_code, 302)  # to the login page
+
+        self.client.force_login(User.objects.create_user(username='admin'))
+        self.assertEqual(self.sync(self.visit()).status_code, 403)
+        self.assertFalse(Visit.objects.exists())
+
+
+class AnswerValueTests(TestCase):
+
+    def test_parses_each_field_type(self):
+        cases = [
+            ('BOOL', 'Sí', True), ('BOOL', 'off', False), ('BOOL', True, True),
+            ('INT', ' 12 ', 12), ('INT', '12,0', 12),
+            ('DECIMAL', '3,456', Decimal('3.46')), ('DECIMAL', '-0.005', Decimal('-0.01')),
+            ('DATE', '2026-10-19', datetime.date(2026, 10, 19)),
+            ('MULTI_SELECT', 'A, B,', ['A', 'B']), ('TEXT', ' hola ', 'hola'), ('INT', '', None),
+        ]
+        for field_type, raw, expected in cases:
+            with self.subTest(field_type=field_type, raw=raw):
+                self.assertEqual(coerce_value(field_type, raw), expected)
+
+    def test_rejects_unparseable_and_out_of_range_values(self):
+        cases = [
+            ('BOOL', 'quizás'), ('INT', '1.5'), ('INT', 'doce'), ('INT', str(2**31)), ('INT', 'NaN'),
+            ('DECIMAL', '1e10'), ('DECIMAL', 'Infinity'), ('DATE', '19/10/2026'),
+        ]
+        for field_type, raw in cases:
+            with self.subTest(field_type=field_type, raw=raw), self.assertRaises(ValueError):
+                coerce_value(field_type, raw)
+
+    def test_unparseable_answers_keep_only_the_raw_value(self):
+        self.assertEqual(typed_values('INT', '7')['value_int'], 7)
+        self.assertEqual(set(typed_values('INT', str(2**31)).values()), {None})
+        self.assertEqual(set(typed_values('SELECT', 'A').values()), {None})  # stored as option links
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BackfillTypedValuesTests(SurveyFixtures, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj, cls.rep, cls.pharmacy = cls.make_tenant()
+        brands = Catalog.objects.create(client=cls.client_obj, name='Marcas', code='BRANDS')
+        cls.options = {
+            code: CatalogOption.objects.create(catalog=brands, code=code, label=f'Marca {code}', order=order)
+            for order, code in enumerate(['A', 'B'])
+        }
+        cls.form = cls.make_form(cls.client_obj, 1, [
+            ('EXHIBE', 'BOOL'), ('FRENTES', 'INT'), ('PRECIO', 'DECIMAL'), ('FECHA', 'DATE'),
+            ('MARCAS', 'MULTI_SELECT', brands),
+        ])
+
+    def legacy_submission(self, answers):
+        """A submission written before the typed columns existed: raw_value only."""
+        submission = self.make_submission(self.rep, self.pharmacy, self.form, {})
+        fields = {f.code: f for f in self.form.fields.all()}
+        for code, raw in answers.items():
+            FormAnswer.objects.create(submission=submission, field_definition=fields[code], raw_value=raw)
+        return submission
+
+    def answer(self, submission, code):
+        return submission.answers.get(field_definition__code=code)
+
+    def test_backfills_typed_columns_and_option_links(self):
+        legacy = self.legacy_submission({
+            'EXHIBE': 'si', 'FRENTES': '4', 'PRECIO': '10,5', 'FECHA': '2026-10-01', 'MARCAS': 'A,Marca B',
+        })
+        bad = self.legacy_submission({'FRENTES': 'muchos', 'MARCAS': 'Z'})
+
+        self.assertEqual(backfill_typed_values(chunk_size=2), (4, 2))
+
+        self.assertIs(self.answer(legacy, 'EXHIBE').value_bool, True)
+        self.assertEqual(self.answer(legacy, 'FRENTES').value_int, 4)
+        self.assertEqual(self.answer(legacy, 'PRECIO').value_decimal, Decimal('10.50'))
+        self.assertEqual(self.answer(legacy, 'FECHA').value_date, datetime.date(2026, 10, 1))
+        self.assertEqual(  # 'A' matched by code, 'Marca B' by label
+            set(self.answer(legacy, 'MARCAS').value_catalog_options.all()), set(self.options.values()),
+        )
+        self.assertIsNone(self.answer(bad, 'FRENTES').value_int)
+        self.assertFalse(self.answer(bad, 'MARCAS').value_catalog_options.exists())
+
+        self.assertEqual(backfill_typed_values(), (0, 0))  # nothing left to type or link
+
+    def test_scoped_to_one_tenant(self):
+        legacy = self.legacy_submission({'FRENTES': '4'})
+        other, _, _ = self.make_tenant('other')
+
+        self.assertEqual(backfill_typed_values(client_id=other.id), (0, 0))
+        self.assertIsNone(self.answer(legacy, 'FRENTES').value_int)
+        self.assertEqual(backfill_typed_values(client_id=self.client_obj.id), (1, 0))
@@ -6,7 +6,12 @@ app_name = 'surveys'
 urlpatterns = [
     path('formularios/', views.FormListView.as_view(), name='form_list'),
     path('formularios/<str:code>/llenar/', views.FormFillView.as_view(), name='form_fill'),
+    path('formularios/<str:code>/exportar/', views.SubmissionExportView.as_view(), name='submission_export'),
+    path('formularios/<str:code>/resultados/', views.FormResultsView.as_view(), name='form_results'),
     path('formularios/respuestas/', views.SubmissionListView.as_view(), name='submission_list'),
     path('formularios/respuestas/<uuid:pk>/', views.SubmissionDetailView.as_view(), name='submission_detail'),
+    path('api/sync/', views.SyncView.as_view(), name='sync'),
+    path('api/pharmacies/', views.PharmacySearchView.as_view(), name='pharmacy_search'),
+    path('api/pharmacies/cercanas/', views.PharmacyNearbyView.as_view(), name='pharmacy_nearby'),
     path('api/pharmacy-context/<uuid:pharmacy_id>/', views.PharmacyContextView.as_view(), name='pharmacy_context'),
 ]
@@ -1,15 +1,36 @@
+import json
+import uuid
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView, TemplateView, DetailView, View
 from django.shortcuts import get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.db import transaction
-from django.db.models import Sum
 from django.utils import timezone
-from datetime import timedelta
-from .models import FormDefinition, FormFieldDefinition, FormSubmission, FormAnswer, Visit, StockoutObservation, CatalogOption
+from django.utils.dateparse import parse_date
+from .models import FormDefinition, FormSubmission, Visit
 # Import Core Models from Analytics
-from analytics.models import Client, Pharmacy, Product, Rep, SalesDocument, SalesLine, CommercialAgreement
-from analytics.services.prediction import ReorderPredictor
+from analytics.models import Pharmacy, Rep, Zone
+from analytics.services.geo import (
+    DEFAULT_RADIUS_M, MAX_RADIUS_M, distance_from_target, nearby_pharmacies, parse_coordinate,
+)
+from analytics.services.pharmacy_search import search_pharmacies
+from analytics.services.tenancy import get_request_client
+from .services.pharmacy_context import get_cached_context, cache_pharmacy_context, route_pharmacies
+from .services.evidence import check_upload, store_evidence
+from .services.export import SubmissionPivot
+from .services.form_schema import get_form_schema
+from .services.form_stats import form_results, record_submissions
+from .services.submission_render import render_submission
+from .services.submission_list import decode_cursor, filter_submissions, submission_page
+from .services.submissions import SubmissionWriter
+from .services.sync import SubmissionSync
+
+def _uuid_param(value):
+    """UUID of a filter parameter, None if empty or malformed."""
+    try:
+        return uuid.UUID(value) if value else None
+    except ValueError:
+        return None
 
 class FormListView(LoginRequiredMixin, ListView):
     model = FormDefinition
@@ -18,70 +39,89 @@ class FormListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         # Filter filters by active and client.
-        client = None
-        if hasattr(self.request.user, 'rep_profile'):
-            rep = self.request.user.rep_profile.first()
-            if rep:
-                client = rep.client
-        
-        if not client:
-             client = Client.objects.first() 
-        
+        client = get_request_client(self.request)
         return FormDefinition.objects.filter(is_active=True, client=client)
 
 class FormFillView(LoginRequiredMixin, TemplateView):
     template_name = "surveys/form_fill.html"
     
+    def get_schema(self):
+        client = get_request_client(self.request)
+        schema = get_form_schema(client.id, self.kwargs.get('code')) if client else None
+        if schema is None:
+            raise Http404("Formulario no encontrado")
+        return schema
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        form_code = kwargs.get('code')
-        form_def = FormDefinition.objects.filter(code=form_code, is_active=True).order_by('-version').first()
-        if not form_def:
-            pass # Handle 404
-            
-        context['form_def'] = form_def
-        context['fields'] = form_def.fields.all().order_by('order')
-        context['pharmacies'] = Pharmacy.objects.filter(is_active=True, client=form_def.client)[:50]
-        
+        schema = self.get_schema()
+
+        context['form_def'] = schema
+        context['fields'] = schema.fields
+        # Pharmacies are picked through the typeahead (PharmacySearchView); the rep's
+        # route / recent ones come with the page for the offline queue
+        rep = self.request.user.rep_profile.filter(client_id=schema.client_id).first()
+        context['route_pharmacies'] = route_pharmacies(rep) if rep else []
+
         return context
 
     def post(self, request, *args, **kwargs):
-        form_code = kwargs.get('code')
-        form_def = FormDefinition.objects.filter(code=form_code, is_active=True).order_by('-version').first()
+        schema = self.get_schema()
         
         pharmacy_id = request.POST.get('pharmacy_id')
-        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_id)
+        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_id, client_id=schema.client_id)
+
+        # Check-in position from the browser (hidden inputs, empty if geolocation was denied)
+        try:
+            latitude = parse_coordinate(request.POST.get('latitude'), 90)
+            longitude = parse_coordinate(request.POST.get('longitude'), 180)
+        except ValueError:
+            latitude = longitude = None
+
+        photos = {}
+        if schema.allow_photos:
+            photos = {
+                field.code: request.FILES[field.code]
+                for field in schema.input_fields
+                if field.field_type == 'PHOTO' and field.code in request.FILES
+            }
+        try:
+            for uploaded in photos.values():
+                check_upload(uploaded)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
         
         with transaction.atomic():
             # 1. Create Visit
             visit = Visit.objects.create(
-                client=form_def.client,
+                client_id=schema.client_id,
                 rep=request.user.rep_profile.first() if hasattr(request.user, 'rep_profile') else None,
                 pharmacy=pharmacy,
                 started_at=timezone.now(),
-                status='IN_PROGRESS'
+                status='IN_PROGRESS',
+                latitude_check_in=latitude,
+                longitude_check_in=longitude,
+                distance_from_target=distance_from_target(pharmacy.latitude, pharmacy.longitude, latitude, longitude),
             )
 
             # 2. Create Submission
             submission = FormSubmission.objects.create(
                 visit=visit,
-                form_definition=form_def
+                form_definition_id=schema.form_id
             )
-            
-            # Pre-fetch products for OOS logic
-            oos_product_map = {}
-            oos_skus = [f.code[4:] for f in form_def.fields.all() if f.code.startswith('OOS_')]
-            if oos_skus:
-                products = Product.objects.filter(client=form_def.client, sku__in=oos_skus)
-                oos_product_map = {p.sku: p for p in products}
-
-            # 3. Save Answers
-            fields = form_def.fields.all()
-            for field in fields:
-                if field.field_type == 'SECTION_HEADER':
+
+            # 3. Save Answers (collected in memory, written in bulk)
+            writer = SubmissionWriter(submission)
+            photo_answers = []
+            for field in schema.input_fields:
+                if field.field_type == 'PHOTO':
+                    if field.code in photos:
+                        answer = writer.add_answer(field.id, field.field_type, photos[field.code].name)
+                        photo_answers.append((answer, photos[field.code]))
                     continue
 
                 raw_value = request.POST.get(field.code)
+                selected = []
                 
                 if field.field_type == 'BOOL':
                      raw_value = 'true' if raw_value == 'on' else 'false'
@@ -89,43 +129,88 @@ class FormFillView(LoginRequiredMixin, TemplateView):
                 if field.field_type == 'MULTI_SELECT':
                     raw_values = request.POST.getlist(field.code)
                     raw_value = ",".join(raw_values) if raw_values else None
+                    selected = raw_values
+                elif field.field_type == 'SELECT' and raw_value:
+                    selected = [raw_value]
 
                 if raw_value is not None:
-                     FormAnswer.objects.create(
-                        submission=submission,
-                        field_definition=field,
-                        raw_value=raw_value
-                    )
+                     writer.add_answer(
+                        field.id,
+                        field.field_type,
+                        raw_value,
+                        [field.option_ids[code] for code in selected if code in field.option_ids],
+                     )
                      
                      # 4. Special Logic: Stockouts
-                     if field.code.startswith('OOS_') and raw_value == 'true':
-                         sku = field.code[4:]
-                         product = oos_product_map.get(sku)
-                         if product:
-                             StockoutObservation.objects.create(
-                                 visit=visit,
-                                 product=product,
-                                 is_oos=True,
-                                 cluster_source='VISIT'
-                             )
+                     if field.oos_sku and raw_value == 'true':
+                         product_id = schema.oos_products.get(field.oos_sku)
+                         if product_id:
+                             writer.add_stockout(product_id)
+            writer.save()
+
+            # 5. Photos: stored (deduplicated by content), variants made in the background
+            for answer, uploaded in photo_answers:
+                store_evidence(submission, uploaded, answer=answer, latitude=latitude, longitude=longitude)
             
             visit.completed_at = timezone.now()
             visit.status = 'COMPLETED'
             visit.save()
+            transaction.on_commit(lambda: record_submissions([submission.id]))
 
         return redirect('surveys:form_list')
 
-class SubmissionListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
-    model = FormSubmission
+class SubmissionListView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Completed submissions of the tenant, newest first, filtered and cursor-paginated."""
     template_name = "surveys/submission_list.html"
-    context_object_name = "submissions"
-    ordering = ['-visit__completed_at']
 
     def test_func(self):
         return self.request.user.is_staff or self.request.user.is_superuser
 
-    def get_queryset(self):
-        return FormSubmission.objects.select_related('visit', 'visit__pharmacy', 'visit__rep__user', 'form_definition').order_by('-visit__completed_at')
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        client = get_request_client(self.request)
+        if client is None:
+            raise Http404("Cliente no encontrado")
+
+        params = self.request.GET
+        filters = {
+            'formulario': params.get('formulario') or None,
+            'visitador': _uuid_param(params.get('visitador')),
+            'zona': _uuid_param(params.get('zona')),
+            'desde': parse_date(params.get('desde') or ''),
+            'hasta': parse_date(params.get('hasta') or ''),
+        }
+        try:
+            cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        except ValueError:
+            cursor = None  # stale / edited link: back to the first page
+
+        submissions = filter_submissions(
+            client.id,
+            form_code=filters['formulario'],
+            rep_id=filters['visitador'],
+            zone_id=filters['zona'],
+            date_from=filters['desde'],
+            date_to=filters['hasta'],
+        )
+        context['submissions'], next_cursor = submission_page(submissions, cursor)
+        query = params.copy()
+        query.pop('cursor', None)
+        context['first_page_query'] = query.urlencode() if cursor else None
+        if next_cursor:
+            query['cursor'] = next_cursor
+            context['next_page_query'] = query.urlencode()
+
+        context['filters'] = filters
+        # code -> title of its latest version
+        context['forms'] = dict(
+            FormDefinition.objects.filter(client=client).order_by('code', 'version').values_list('code', 'title')
+        )
+        context['reps'] = (
+            Rep.objects.filter(client=client).select_related('user').order_by('user__last_name', 'user__username')
+        )
+        context['zones'] = Zone.objects.filter(client=client).order_by('name')
+        return context
 
 class SubmissionDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     model = FormSubmission
@@ -135,61 +220,117 @@ class SubmissionDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     def test_func(self):
         return self.request.user.is_staff or self.request.user.is_superuser
 
+    def get_queryset(self):
+        client = get_request_client(self.request)
+        return (
+            FormSubmission.objects.filter(visit__client=client)
+            .select_related('visit__pharmacy', 'visit__rep__user', 'form_definition')
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['answers'] = (
-            self.object.answers
-            .select_related('field_definition', 'field_definition__catalog')
-            .order_by('field_definition__order')
-        )
+        context['answers'], context['other_photos'] = render_submission(self.object)
         return context
 
+class SubmissionExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Wide CSV (one row per submission, one column per question), streamed."""
+
+    def test_func(self):
+        return self.request.user.is_staff or self.request.user.is_superuser
+
+    def get(self, request, code):
+        client = get_request_client(request)
+        schema = get_form_schema(client.id, code) if client else None
+        if schema is None:
+            raise Http404("Formulario no encontrado")
+
+        pivot = SubmissionPivot(schema)
+        response = StreamingHttpResponse(pivot.csv_lines(), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="respuestas_{schema.code}.csv"'
+        return response
+
+class FormResultsView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Aggregated answers of a form, served from the daily statistics buckets."""
+    template_name = "surveys/form_results.html"
+
+    def test_func(self):
+        return self.request.user.is_staff or self.request.user.is_superuser
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        client = get_request_client(self.request)
+        schema = get_form_schema(client.id, kwargs.get('code')) if client else None
+        if schema is None:
+            raise Http404("Formulario no encontrado")
+
+        date_from = parse_date(self.request.GET.get('desde') or '')
+        date_to = parse_date(self.request.GET.get('hasta') or '')
+        zone_id = _uuid_param(self.request.GET.get('zona'))
+
+        context['form_def'] = schema
+        context['results'] = form_results(schema, date_from, date_to, zone_id)
+        context['zones'] = Zone.objects.filter(client_id=schema.client_id).order_by('name')
+        context['filters'] = {'desde': date_from, 'hasta': date_to, 'zona': zone_id}
+        return context
+
+class SyncView(LoginRequiredMixin, View):
+    """
+    Offline sync for reps: a JSON batch of visits with their submissions and
+    answers (see surveys.services.sync). Returns the status of every visit.
+    """
+
+    def post(self, request):
+        client = get_request_client(request)
+        rep = request.user.rep_profile.filter(client=client).first() if client else None
+        if rep is None:
+            return JsonResponse({'error': 'El usuario no es visitador de ningún cliente'}, status=403)
+
+        try:
+            payload = json.loads(request.body)
+            return JsonResponse(SubmissionSync(client, rep).process(payload))
+        except ValueError as e:  # malformed JSON or SyncError
+            return JsonResponse({'error': str(e)}, status=400)
+
+class PharmacySearchView(LoginRequiredMixin, View):
+    """Typeahead of the pharmacy selector: ?q= matches code, name and city."""
+
+    def get(self, request):
+        client = get_request_client(request)
+        query = request.GET.get('q', '')
+        if client is None or not query.strip():
+            return JsonResponse({'results': []})
+        results = search_pharmacies(client.id, query)
+        for row in results:
+            row['id'] = str(row['id'])
+        return JsonResponse({'results': results})
+
+class PharmacyNearbyView(LoginRequiredMixin, View):
+    """Pharmacies around the rep: ?lat=&lon=[&radio=meters], closest first (KD-tree, see analytics.services.geo)."""
+
+    def get(self, request):
+        client = get_request_client(request)
+        try:
+            latitude = parse_coordinate(request.GET.get('lat'), 90)
+            longitude = parse_coordinate(request.GET.get('lon'), 180)
+            radius = min(int(request.GET.get('radio') or DEFAULT_RADIUS_M), MAX_RADIUS_M)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if latitude is None or longitude is None:
+            return JsonResponse({'error': 'Se requieren lat y lon'}, status=400)
+        if client is None:
+            return JsonResponse({'results': []})
+
+        results = nearby_pharmacies(client.id, latitude, longitude, radius_m=radius)
+        for row in results:
+            row['id'] = str(row['id'])
+        return JsonResponse({'results': results})
+
 class PharmacyContextView(LoginRequiredMixin, View):
     def get(self, request, pharmacy_id):
-        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_id)
-        
-        # Date Range: Last 30 Days (from start of day)
-        end_date = timezone.now()
-        start_date = (end_date - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Query Sales Documents
-        docs = SalesDocument.objects.filter(
-            pharmacy=pharmacy,
-            date__range=(start_date, end_date)
-        )
-        
-        # Aggregations
-        orders_count = docs.count()
-        total_sales = docs.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-        
-        # Top Products (by quantity)
-        top_products = (
-            SalesLine.objects
-            .filter(document__in=docs)
-            .values('product__name')
-            .annotate(qty=Sum('quantity'))
-            .order_by('-qty')[:3]
-        )
-        
-        # Agreement Data
-        agreement = CommercialAgreement.objects.filter(
-            pharmacy=pharmacy,
-            is_active=True,
-            end_date__gte=timezone.now().date()
-        ).first()
-
-        # Prediction (Local AI)
-        predictor = ReorderPredictor(pharmacy.id)
-        suggestions = predictor.get_suggestions()
-
-        data = {
-            'pharmacy_name': pharmacy.display_name,
-            'orders_count': orders_count,
-            'total_sales': float(total_sales),
-            'top_products': list(top_products),
-            'has_agreement': bool(agreement),
-            'agreement_summary': agreement.description if agreement else "",
-            'predictions': suggestions
-        }
-        
+        # Short-TTL cache, invalidated by surveys.signals on new sales / agreements
+        data = get_cached_context(pharmacy_id)
+        if data is None:
+            pharmacy = get_object_or_404(Pharmacy, id=pharmacy_id)
+            data = cache_pharmacy_context(pharmacy)
+
         return JsonResponse(data)